@@ -1,17 +1,47 @@
-from flask import Flask, render_template, request
-from scripts.binaryIndependenceModel import search as binaryIndependenceSearch
-from scripts.NonOverlappedList import search as nonOverlappedSearch
-from scripts.ProximalNodes import search as proximalNodesSearch
-from scripts.structureGuidedAndHypertext import browsingStructure, addHyperlinksToContent
-from scripts.Fuzzy import search as fuzzySearch
-from scripts.ExtendedBoolean import search as booleanExtendedSearch
-from scripts.generalizedVector import search as generalizedVectorSearch
-from scripts.latentSemantic import search as latentSemanticSearch
-from scripts.NeuralNetwork import search as neuralNetworkSearch
-from scripts.InferenceModel import search as inferenceModelSearch
-from scripts.BeliefModel import search as beliefModelSearch
+import logging
+import os
+
+from flask import Flask, jsonify, render_template, request
+from flask.logging import default_handler
+from scripts.binaryIndependenceModel import search as binaryIndependenceSearch, search_batch as binaryIndependenceSearchBatch
+from scripts.NonOverlappedList import search as nonOverlappedSearch, searchBatch as nonOverlappedSearchBatch
+from scripts.ProximalNodes import search as proximalNodesSearch, searchBatch as proximalNodesSearchBatch
+from scripts.structureGuidedAndHypertext import getBrowsingStructure, addHyperlinksToContent, refreshBrowsingStructure
+from scripts.Fuzzy import OPERATORS as fuzzyOperators, search as fuzzySearch, search_batch as fuzzySearchBatch
+from scripts.ExtendedBoolean import search as booleanExtendedSearch, searchBatch as booleanExtendedSearchBatch
+from scripts.generalizedVector import search as generalizedVectorSearch, search_batch as generalizedVectorSearchBatch
+from scripts.latentSemantic import search as latentSemanticSearch, search_batch as latentSemanticSearchBatch
+from scripts.NeuralNetwork import search as neuralNetworkSearch, search_batch as neuralNetworkSearchBatch
+from scripts.InferenceModel import search as inferenceModelSearch, search_batch as inferenceModelSearchBatch
+from scripts.BeliefModel import search as beliefModelSearch, search_batch as beliefModelSearchBatch
+from scripts.corpus import get_corpus, start_watching
+from scripts.ranking import ModelUnavailable, paginate
+from scripts.resultCache import MISSING, createResultCache
 
 app = Flask(__name__)
+# Messages of the search modules (loggers under scripts.*) go to the handler of the app's own log
+logging.getLogger('scripts').addHandler(default_handler)
+
+# Search results cached per (model, query, index version); set RESULT_CACHE_PATH to share them between worker processes
+resultCache = createResultCache(
+    os.environ.get("RESULT_CACHE_PATH"),
+    maxSize=int(os.environ.get("RESULT_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("RESULT_CACHE_TTL", 300)),
+)
+
+# Results shown per page by the model routes
+PAGE_SIZE = 10
+
+# Limits of the JSON search API
+DEFAULT_API_TOP_N = 10
+MAX_API_QUERIES = 100
+
+def indexVersion():
+    """
+    Identifies the indexed documents; the same content gives the same version in every worker.
+    It changes only once every model has applied a refresh, so results are never cached under a newer version.
+    """
+    return get_corpus().applied_fingerprint
 
 MODELS = [
     # {
@@ -32,6 +62,7 @@ MODELS = [
         "endpoint": "binaryIndependenceModel",
         "url": "binary-independence-model",
         "search": binaryIndependenceSearch,
+        "searchBatch": binaryIndependenceSearchBatch,
     },
     {
         "title": "Non Overlapped List",
@@ -39,6 +70,7 @@ MODELS = [
         "endpoint": "nonOverlappedList",
         "url": "non-overlapped-list",
         "search": nonOverlappedSearch,
+        "searchBatch": nonOverlappedSearchBatch,
     },
     {
         "title": "Proximal Nodes Models",
@@ -46,13 +78,14 @@ MODELS = [
         "endpoint": "proximalNodesModels",
         "url": "proximal-nodes-models",
         "search": proximalNodesSearch,
+        "searchBatch": proximalNodesSearchBatch,
     },
     {
         "title": "Structure Guided Browsing and Hypertext Model",
         "description": "Structure Guided Browsing & Hypertext Model",
         "endpoint": "structureGuidedBrowsing",
         "url": "structure-guided-browsing",
-        "browsingStructure": browsingStructure,
+        "browsingStructure": getBrowsingStructure,
     },
     {
         "title": "Fuzzy Model",
@@ -60,6 +93,9 @@ MODELS = [
         "endpoint": "fuzzyModel",
         "url": "fuzzy-model",
         "search": fuzzySearch,
+        "searchBatch": fuzzySearchBatch,
+        # Extra search arguments: {name: allowed values}, the first being the default
+        "options": {"operator": list(fuzzyOperators)},
     },
     {
         "title": "Boolean Extended Model",
@@ -67,6 +103,7 @@ MODELS = [
         "endpoint": "booleanExtendedModel",
         "url": "boolean-extended-model",
         "search": booleanExtendedSearch,
+        "searchBatch": booleanExtendedSearchBatch,
     },
     {
         "title": "Generalized Vector Model",
@@ -74,6 +111,7 @@ MODELS = [
         "endpoint": "generalizedVectorModel",
         "url": "generalized-vector-model",
         "search": generalizedVectorSearch,
+        "searchBatch": generalizedVectorSearchBatch,
     },
     {
         "title": "Latent Semantic Indexing",
@@ -81,20 +119,23 @@ MODELS = [
         "endpoint": "latentSemanticIndexing",
         "url": "latent-semantic-indexing",
         "search": latentSemanticSearch,
+        "searchBatch": latentSemanticSearchBatch,
+    },
+    {
+        "title": "Neural Networks",
+        "description": "Neural Networks",
+        "endpoint": "neuralNetworks",
+        "url": "neural-networks",
+        "search": neuralNetworkSearch,
+        "searchBatch": neuralNetworkSearchBatch,
     },
-    # {
-    #     "title": "Neural Networks",
-    #     "description": "Neural Networks",
-    #     "endpoint": "neuralNetworks",
-    #     "url": "neural-networks",
-    #     "search": neuralNetworkSearch,
-    # },
     {
         "title": "Interference Model",
         "description": "Interference Model",
         "endpoint": "interferenceModel",
         "url": "interference-model",
         "search": inferenceModelSearch,
+        "searchBatch": inferenceModelSearchBatch,
     },
     {
         "title": "Belief Network Model",
@@ -102,6 +143,7 @@ MODELS = [
         "endpoint": "beliefNetworkModel",
         "url": "belief-network-model",
         "search": beliefModelSearch,
+        "searchBatch": beliefModelSearchBatch,
     },
 ]
 
@@ -110,6 +152,7 @@ MODELS = [
 def document(doc_path):
     # Traverse the structure based on the doc_path to find content
     docParts = doc_path.split('/')
+    browsingStructure = getBrowsingStructure()
     doc = browsingStructure
     for part in docParts:
         doc = doc.get(part, {})
@@ -125,6 +168,95 @@ def document(doc_path):
 def index():
     return render_template('index.html', models = MODELS, activeModel="index")
 
+def findModel(name):
+    """Return the model whose url or endpoint is name, or None."""
+    for model in MODELS:
+        if name in (model["url"], model["endpoint"]):
+            return model
+    return None
+
+def searchOptions(model, values):
+    """The model's search options read from values (a dict-like), defaults for the missing ones; ValueError for unknown values."""
+    options = {}
+    for name, allowed in model.get("options", {}).items():
+        value = values.get(name) or allowed[0]
+        if value not in allowed:
+            raise ValueError(f'"{name}" must be one of {", ".join(allowed)}.')
+        options[name] = value
+    return options
+
+def optionsKey(options):
+    return ''.join(f'/{value}' for value in options.values())
+
+def parseApiRequest(model):
+    """
+    Read (queries, topN, options) from a JSON body {"queries": [...], "top_n": k, <option>: value} / {"query": "..."}
+    or from ?q=...&top_n=k&<option>=value.
+    """
+    if request.method == "POST":
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            raise ValueError('Expected a JSON object body.')
+        queries = body.get("queries", [body["query"]] if "query" in body else None)
+        topN = body.get("top_n", DEFAULT_API_TOP_N)
+        options = searchOptions(model, body)
+    else:
+        queries = request.args.getlist("q")
+        topN = request.args.get("top_n", DEFAULT_API_TOP_N)
+        options = searchOptions(model, request.args)
+
+    if not isinstance(queries, list) or not queries or not all(isinstance(query, str) for query in queries):
+        raise ValueError('Give one or more queries as "queries": [string, ...], "query": string or ?q=.')
+    if len(queries) > MAX_API_QUERIES:
+        raise ValueError(f'At most {MAX_API_QUERIES} queries per request.')
+    try:
+        topN = int(topN)
+    except (TypeError, ValueError):
+        raise ValueError('"top_n" must be an integer.')
+    if topN < 1:
+        raise ValueError('"top_n" must be positive.')
+    return queries, topN, options
+
+@app.route('/api/<modelName>/search', methods=["GET", "POST"])
+def apiSearch(modelName):
+    """
+    Search a model with one or many queries and return structured results:
+    {"model": endpoint, "results": [{"query": ..., "results": [{"doc_id": ..., "score": ...}, ...]}, ...]}
+    Cached queries are answered from the result cache; the others run in one batch against the loaded model.
+    """
+    model = findModel(modelName)
+    if model is None or "searchBatch" not in model:
+        return jsonify(error=f'Unknown model {modelName!r}.'), 404
+    try:
+        queries, topN, options = parseApiRequest(model)
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+
+    cacheKey = f'api/{model["endpoint"]}/{topN}{optionsKey(options)}'
+    version = indexVersion()
+    results = [resultCache.get(cacheKey, query, version) for query in queries]
+    missing = [i for i, result in enumerate(results) if result is MISSING]
+    if missing:
+        try:
+            batchResults = model["searchBatch"]([queries[i] for i in missing], topN, **options)
+        except ModelUnavailable as error:
+            return jsonify(error=str(error)), 503
+        for i, ranked in zip(missing, batchResults):
+            results[i] = [
+                {"doc_id": docId, "score": None if score is None else float(score)}
+                for docId, score in ranked
+            ]
+            resultCache.put(cacheKey, queries[i], version, results[i])
+
+    return jsonify(
+        model=model["endpoint"],
+        results=[{"query": query, "results": ranked} for query, ranked in zip(queries, results)],
+    )
+
+@app.route('/cache-stats')
+def cacheStats():
+    return jsonify(resultCache.stats())
+
 # Dynamic route generator
 def generateModelRoute(model):
     """
@@ -134,16 +266,38 @@ def generateModelRoute(model):
         results = None                                  # Variable to hold search results
         query = ""                                      # User query input
         endPoint = model["endpoint"]
+        page = 1                                        # 1-based page of the results shown
+        hasNextPage = False
+        options = searchOptions(model, {})
+        error = None                                    # Why the model could not search, shown instead of results
+        status = 200
 
         # Handle POST requests for querying
         if request.method == "POST" and "search" in model:
             query = request.form.get("query", "")
+            page = max(1, request.form.get("page", 1, type=int))
+            try:
+                options = searchOptions(model, request.form)
+            except ValueError:
+                pass
             if model["search"]:
-                results = model["search"](query)
+                # Rank only as far as this page, plus one result telling whether a next page exists
+                topN = page * PAGE_SIZE + 1
+                cacheKey = f'{endPoint}/{topN}{optionsKey(options)}'
+                version = indexVersion()
+                ranked = resultCache.get(cacheKey, query, version)
+                if ranked is MISSING:
+                    try:
+                        ranked = model["search"](query, topN, **options)
+                        resultCache.put(cacheKey, query, version, ranked)
+                    except ModelUnavailable as unavailable:
+                        error, status, ranked = str(unavailable), 503, []
+                hasNextPage = len(ranked) > page * PAGE_SIZE
+                results = paginate(ranked[:page * PAGE_SIZE], page, PAGE_SIZE)
 
         browsingStructure = None
         if "browsingStructure" in model:
-            browsingStructure = model["browsingStructure"]
+            browsingStructure = model["browsingStructure"]()
 
         return render_template(
             f"{endPoint}.html",
@@ -154,7 +308,12 @@ def generateModelRoute(model):
             results=results,
             query=query,
             browsingStructure=browsingStructure,
-        )
+            page=page,
+            hasNextPage=hasNextPage,
+            options=options,
+            allowedOptions=model.get("options", {}),
+            error=error,
+        ), status
     return routeHandler
 
 # Dynamically add routes for models
@@ -166,6 +325,15 @@ for model in MODELS:
         methods=["GET", "POST"]
     )
 
+@app.before_request
+def startWatcher():
+    """
+    Poll the document folders and apply added, modified and deleted files to the loaded models.
+    Started by the first request of every serving process, so importing the app (or the reloader's parent
+    process, which serves nothing) starts no watcher; start_watching runs one thread per process at most.
+    """
+    start_watching(interval=2.0, callbacks=[refreshBrowsingStructure], log=app.logger)
+
 
 if __name__ == '__main__':
     app.run(debug=True)
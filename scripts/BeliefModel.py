@@ -1,44 +1,89 @@
 import os
-import re
-import random
+from functools import lru_cache
+
+import numpy as np
+
+from scripts.corpus import get_corpus
+from scripts.priors import load_priors
+from scripts.ranking import top_k_indices
 
 class BeliefNetwork:
-    def __init__(self, document_folder):
+    def __init__(self, document_folder, seed=None):
         """Initialize the belief network with documents and relationships."""
+        self.corpus = get_corpus(document_folder)
+        self.seed = seed  # None: priors from corpus statistics, otherwise seeded random priors
+        self.term_frequencies = self.corpus.term_frequencies  # {filename: Counter of lowercase words}
         self.documents = self.load_documents(document_folder)
         self.features = self.extract_features()
         self.relevance_probs = self.initialize_relevance_probabilities()
+        self.term_sets = {doc_name: frozenset(counts) for doc_name, counts in self.term_frequencies.items()}  # {filename: distinct terms}
+        self.prepare_ranking()
+        self.corpus.subscribe(self.apply_changes)
 
     def load_documents(self, folder_path):
-        """Load documents from the folder and return a dictionary with filenames and content."""
-        documents = {}
-        for filename in os.listdir(folder_path):
-            if filename.endswith('.txt'):
-                with open(os.path.join(folder_path, filename), 'r', encoding='utf-8') as file:
-                    documents[filename] = file.read()
-        return documents
+        """Return the shared corpus of the folder as a dictionary with filenames and content."""
+        return get_corpus(folder_path).documents
 
     def extract_features(self):
         """Extract basic features from each document. Here, we use word counts as features."""
-        features = {}
-        for doc_name, content in self.documents.items():
-            words = re.findall(r'\w+', content.lower())
-            word_count = len(words)
-            unique_word_count = len(set(words))
-            avg_word_length = sum(len(word) for word in words) / len(words) if words else 0
-            features[doc_name] = {
-                'word_count': word_count,
-                'unique_word_count': unique_word_count,
-                'avg_word_length': avg_word_length
-            }
-        return features
+        return {doc_name: self.extract_document_features(counts) for doc_name, counts in self.term_frequencies.items()}
+
+    def extract_document_features(self, word_counts):
+        """Word count features of one document, from the Counter of its words."""
+        word_count = sum(word_counts.values())
+        unique_word_count = len(word_counts)
+        avg_word_length = sum(len(word) * count for word, count in word_counts.items()) / word_count if word_count else 0
+        return {
+            'word_count': word_count,
+            'unique_word_count': unique_word_count,
+            'avg_word_length': avg_word_length
+        }
+
+    def apply_changes(self, delta):
+        """Follow a corpus refresh: recompute the features of changed documents, forget removed ones and reload the priors."""
+        documents = self.corpus.documents
+        features = {doc: value for doc, value in self.features.items() if doc in documents}
+        for doc_name in delta.added + delta.modified:
+            features[doc_name] = self.extract_document_features(self.corpus.term_frequencies[doc_name])
+        # Priors depend on the content and the collection statistics, so every refresh reloads them
+        relevance_probs = self.initialize_relevance_probabilities()
+        term_sets = {doc: terms for doc, terms in self.term_sets.items() if doc in documents}
+        for doc_name in delta.added + delta.modified:
+            term_sets[doc_name] = frozenset(self.corpus.term_frequencies[doc_name])
+        self.features = features
+        self.relevance_probs = relevance_probs
+        self.term_sets = term_sets
+        self.term_frequencies = self.corpus.term_frequencies
+        self.documents = documents
+        self.prepare_ranking()
+
+    def prepare_ranking(self):
+        """
+        Precompute everything of P(Q, R, F) that does not depend on the query: the normalized feature scores,
+        the relevance times feature weight of each document and the postings of each term.
+        """
+        doc_names = list(self.documents)
+        maxima = {
+            feature: max(1, max((self.features[doc][feature] for doc in doc_names), default=0))
+            for feature in ('word_count', 'unique_word_count', 'avg_word_length')
+        }
+        feature_scores = {
+            doc: sum(self.features[doc][feature] / maximum for feature, maximum in maxima.items()) / 3
+            for doc in doc_names
+        }
+        weights = np.array([self.relevance_probs[doc] * feature_scores[doc] for doc in doc_names])
+        postings = {}
+        for index, doc in enumerate(doc_names):
+            for term in self.term_sets[doc]:
+                postings.setdefault(term, []).append(index)
+        postings = {term: np.array(indices) for term, indices in postings.items()}
+        self.feature_scores = feature_scores
+        # One tuple so a refresh swaps the ranking state at once
+        self.ranking_state = (doc_names, weights, postings)
 
     def initialize_relevance_probabilities(self):
-        """Initialize the probabilities of relevance for each document randomly (for now)."""
-        relevance_probs = {}
-        for doc_name in self.documents:
-            relevance_probs[doc_name] = random.uniform(0.1, 0.9)  # Random initial relevance probability
-        return relevance_probs
+        """Load the persisted prior relevance probability of each document, deriving it once for documents without one."""
+        return load_priors(self.corpus, self.seed)
 
     def calculate_joint_probability(self, query, document):
         """Calculate the joint probability P(Q, R, F) where Q = query, R = relevance, F = features."""
@@ -49,24 +94,31 @@ class BeliefNetwork:
 
     def calculate_feature_probability(self, document):
         """Calculate the probability of a feature given the document."""
-        # Assume we normalize each feature and combine their values into a single score
-        features = self.features[document]
-        word_count_score = features['word_count'] / max(1, max(f['word_count'] for f in self.features.values()))
-        unique_word_score = features['unique_word_count'] / max(1, max(f['unique_word_count'] for f in self.features.values()))
-        avg_word_length_score = features['avg_word_length'] / max(1, max(f['avg_word_length'] for f in self.features.values()))
-        return (word_count_score + unique_word_score + avg_word_length_score) / 3  # Combine scores
+        # Each feature is normalized by its maximum over the collection and the scores are averaged, once per refresh
+        return self.feature_scores[document]
 
     def calculate_query_probability(self, query, document):
         """Calculate the probability that a query relates to a document."""
-        query_terms = re.findall(r'\w+', query.lower())
-        document_terms = re.findall(r'\w+', self.documents[document].lower())
+        query_terms = self.corpus.analyzer.terms(query)
+        document_terms = self.term_sets[document]
         match_count = sum(1 for term in query_terms if term in document_terms)
         return match_count / len(query_terms) if query_terms else 0
 
+    def calculate_joint_probabilities(self, query, ranking_state=None):
+        """P(Q, R, F) of every document at once; the match counts only touch the postings of the query terms."""
+        doc_names, weights, postings = ranking_state or self.ranking_state
+        query_terms = self.corpus.analyzer.terms(query)
+        match_counts = np.zeros(len(doc_names))
+        for term in query_terms:
+            if term in postings:
+                match_counts[postings[term]] += 1
+        query_probs = match_counts / len(query_terms) if query_terms else match_counts
+        return query_probs * weights
+
     def calculate_marginal_probability(self, query):
-        """Calculate the marginal probability P(Q) by summing over all documents."""
-        total_prob = sum(self.calculate_joint_probability(query, doc) for doc in self.documents)
-        return total_prob / len(self.documents) if self.documents else 0
+        """Calculate the marginal probability P(Q) by averaging over all documents."""
+        joint_probs = self.calculate_joint_probabilities(query)
+        return joint_probs.mean() if len(joint_probs) else 0
 
     def calculate_conditional_probability(self, query, document):
         """Calculate the conditional probability P(R | Q) using Bayes' theorem."""
@@ -76,16 +128,39 @@ class BeliefNetwork:
             return 0
         return joint_prob / marginal_prob
 
-    def rank_documents(self, query):
-        """Rank documents by P(R | Q) for a given query."""
-        relevance_scores = {doc: self.calculate_conditional_probability(query, doc) for doc in self.documents}
-        ranked_docs = sorted(relevance_scores.items(), key=lambda x: x[1], reverse=True)
-        return ranked_docs
+    def rank_documents(self, query, top_n=None):
+        """Rank the documents with P(R | Q) > 0 for a given query, with the marginal computed once; only the top_n are sorted."""
+        ranking_state = self.ranking_state
+        doc_names = ranking_state[0]
+        joint_probs = self.calculate_joint_probabilities(query, ranking_state)
+        marginal_prob = joint_probs.mean() if len(joint_probs) else 0
+        relevance_scores = joint_probs / marginal_prob if marginal_prob else np.zeros(len(doc_names))
+        return [(doc_names[i], float(relevance_scores[i])) for i in top_k_indices(relevance_scores, top_n) if relevance_scores[i] > 0]
+
+    def rank_documents_batch(self, queries, top_n=None):
+        """Rank many queries at once: one (queries x documents) matrix of joint probabilities, one marginal per row."""
+        doc_names, weights, postings = self.ranking_state
+        match_counts = np.zeros((len(queries), len(doc_names)))
+        query_lengths = np.ones(len(queries))
+        for row, query in enumerate(queries):
+            query_terms = self.corpus.analyzer.terms(query)
+            query_lengths[row] = max(1, len(query_terms))
+            for term in query_terms:
+                if term in postings:
+                    match_counts[row, postings[term]] += 1
+        joint_probs = match_counts / query_lengths[:, None] * weights
+        marginal_probs = joint_probs.mean(axis=1, keepdims=True) if len(doc_names) else np.zeros((len(queries), 1))
+        relevance_scores = np.divide(joint_probs, marginal_probs, out=np.zeros_like(joint_probs), where=marginal_probs > 0)
+
+        ranked_batch = []
+        for row in relevance_scores:
+            ranked_batch.append([(doc_names[i], float(row[i])) for i in top_k_indices(row, top_n) if row[i] > 0])
+        return ranked_batch
 
-    def display_ranked_documents(self, query):
-        """Display the ranked documents with their relevance probabilities."""
+    def display_ranked_documents(self, query, top_n=None):
+        """Display the top_n (all when None) ranked documents with their relevance probabilities."""
         print(f"\n\nRanked documents for query: '{query}'\n\n")
-        ranked_docs = self.rank_documents(query)
+        ranked_docs = self.rank_documents(query, top_n)
         results = []
         for rank, (doc, prob) in enumerate(ranked_docs, start=1):
             print(f"{rank}. {doc} - P(R | Q) = {prob:.4f}")
@@ -94,9 +169,18 @@ class BeliefNetwork:
         
         return results
 
-def search(query):
-    network = BeliefNetwork('data/documents')
-    return network.display_ranked_documents(query)
+@lru_cache(maxsize=None)
+def get_network(document_folder='data/documents', seed=None):
+    """Return the belief network of the folder, built once per process."""
+    return BeliefNetwork(document_folder, seed)
+
+def search(query, top_n=None):
+    network = get_network()
+    return network.display_ranked_documents(query, top_n)
+
+def search_batch(queries, top_n=None):
+    """Rank a list of queries in one vectorized pass; returns one list of (doc_id, score) per query."""
+    return get_network().rank_documents_batch(queries, top_n)
 
 
 if __name__ == "__main__":
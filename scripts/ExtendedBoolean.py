@@ -1,54 +1,355 @@
-import os
+import re
+from bisect import bisect_left
+from html import escape
+from functools import lru_cache
+from heapq import merge
 from math import log
 
+from scripts.analysis import DEFAULT_ANALYZER
+from scripts.corpus import get_corpus
+from scripts.positionalIndex import getPositionalIndex
+from scripts.ranking import top_k
+
 # Directory for text files containing documents
 DOCUMENTS_DIR = "data/documents"
 
+# p of the p-norm model: 1 behaves like the vector model, larger values approach strict Boolean logic
+P_NORM = 2
+
+# Number of snippets highlightTerms returns in snippet mode
+MAX_SNIPPETS = 3
+
+OPERATORS = {'AND', 'OR', 'NOT'}
+QUERY_TOKEN_PATTERN = re.compile(r'\(|\)|"[^"]*"?|\w+')
+
 def loadDocuments():
-    """Load all text files from the DOCUMENTS_DIR as a dictionary."""
-    documents = {}
-    for filename in os.listdir(DOCUMENTS_DIR):
-        if filename.endswith('.txt'):
-            filepath = os.path.join(DOCUMENTS_DIR, filename)
-            with open(filepath, 'r', encoding='utf-8') as file:
-                documents[filename] = file.read()
-    return documents
-
-DOCUMENTS = loadDocuments()
-
-def search(query):
+    """Return the shared corpus of DOCUMENTS_DIR as a dictionary of filename and content."""
+    return get_corpus(DOCUMENTS_DIR).documents
+
+class BooleanIndex:
+    """Phrase matching and p-norm term statistics over the shared positional index."""
+
+    def __init__(self, positionalIndex):
+        self.positionalIndex = positionalIndex
+        self.corpus = positionalIndex.corpus
+        self.maxFrequencies = {}            # {doc_id: frequency of its most frequent term}
+        self.build()
+        self.corpus.subscribe(self.applyChanges)
+
+    @property
+    def docIds(self):
+        """All document ids, sorted."""
+        return self.positionalIndex.docIds
+
+    @property
+    def postings(self):
+        """{term: ([doc_id, ...] sorted, [positions, ...])}"""
+        return self.positionalIndex.postings
+
+    def build(self):
+        self.maxFrequencies = {docId: max(counts.values(), default=0) for docId, counts in self.corpus.term_frequencies.items()}
+
+    def applyChanges(self, delta):
+        """Update the statistics of the refreshed documents; the positional index updates its postings itself."""
+        termFrequencies = self.corpus.term_frequencies
+        maxFrequencies = {docId: value for docId, value in self.maxFrequencies.items() if docId in termFrequencies}
+        for docId in delta.added + delta.modified:
+            maxFrequencies[docId] = max(termFrequencies[docId].values(), default=0)
+        self.maxFrequencies = maxFrequencies
+
+    def phrase(self, words):
+        """Return ([doc_id, ...] sorted, [occurrences, ...]) of the documents containing the words consecutively."""
+        postings = self.postings
+        if any(word not in postings for word in words):
+            return [], []
+        firstIds, firstPositions = postings[words[0]]
+        if len(words) == 1:
+            return firstIds, [len(positions) for positions in firstPositions]
+
+        docIds = firstIds
+        for word in sorted(words[1:], key=lambda word: len(postings[word][0])):
+            docIds = intersectPostings(docIds, postings[word][0])
+
+        def positions(word, docId):
+            wordIds, positionLists = postings[word]
+            return positionLists[bisect_left(wordIds, docId)]
+
+        matches, counts = [], []
+        for docId in docIds:
+            positionSets = [set(positions(word, docId)) for word in words[1:]]
+            count = sum(
+                1 for start in positions(words[0], docId)
+                if all(start + offset in positionSets[offset - 1] for offset in range(1, len(words)))
+            )
+            if count:
+                matches.append(docId)
+                counts.append(count)
+        return matches, counts
+
+def intersectPostings(first, second):
+    """Intersect two sorted doc id lists, galloping through the longer one."""
+    shorter, longer = (first, second) if len(first) <= len(second) else (second, first)
+    result = []
+    low = 0
+    for docId in shorter:
+        bound = 1
+        while low + bound < len(longer) and longer[low + bound] < docId:
+            bound *= 2
+        low = bisect_left(longer, docId, low, min(low + bound + 1, len(longer)))
+        if low == len(longer):
+            break
+        if longer[low] == docId:
+            result.append(docId)
+    return result
+
+def unitePostings(lists):
+    """Merge sorted doc id lists into one sorted list without duplicates."""
+    result = []
+    for docId in merge(*lists):
+        if not result or result[-1] != docId:
+            result.append(docId)
+    return result
+
+def subtractPostings(first, second):
+    """Doc ids of the sorted list first that are not in the sorted list second."""
+    excluded = set(second)
+    return [docId for docId in first if docId not in excluded]
+
+def parseQuery(query, analyzer=DEFAULT_ANALYZER):
     """
-    Perform a Boolean search over the DOCUMENTS.
-    Supports AND, OR, and NOT operations (case-insensitive).
+    Parse a query into a tree of ('term', words), ('and', children), ('or', children) and ('not', child) nodes.
+
+    Precedence is NOT > AND > OR and parentheses group. Consecutive words and "quoted text" are phrases,
+    'x NOT y' means x AND NOT y. Operators are case-insensitive, as they always were.
+    Words are run through analyzer, which must be the one the indexed corpus was tokenized with.
     """
-    query = query.upper()
-    results = set(DOCUMENTS.keys())
-
-    if ' AND ' in query:
-        terms = query.split(' AND ')
-        results = set.intersection(*[searchTerm(term) for term in terms])
-    elif ' OR ' in query:
-        terms = query.split(' OR ')
-        results = set.union(*[searchTerm(term) for term in terms])
-    elif ' NOT ' in query:
-        term, excluded = query.split(' NOT ')
-        results = searchTerm(term) - searchTerm(excluded)
-    else:
-        results = searchTerm(query)
-
-    return [(highlightTerms(fileName, query), highlightTerms(DOCUMENTS[fileName], query)) for fileName in results]
+    tokens = QUERY_TOKEN_PATTERN.findall(query)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def isOperator(token):
+        return token is not None and token.upper() in OPERATORS
+
+    def advance():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parseOr():
+        children = [parseAnd()]
+        while isOperator(peek()) and peek().upper() == 'OR':
+            advance()
+            children.append(parseAnd())
+        children = [child for child in children if child is not None]
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else ('or', children)
+
+    def parseAnd():
+        children = [parseUnary()]
+        while peek() is not None and peek() != ')' and not (isOperator(peek()) and peek().upper() == 'OR'):
+            if isOperator(peek()) and peek().upper() == 'AND':
+                advance()
+            children.append(parseUnary())
+        children = [child for child in children if child is not None]
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else ('and', children)
+
+    def parseUnary():
+        if isOperator(peek()) and peek().upper() == 'NOT':
+            advance()
+            child = parseUnary()
+            return ('not', child) if child is not None else None
+        return parsePrimary()
+
+    def parsePrimary():
+        token = peek()
+        if token is None or token == ')' or isOperator(token):
+            return None
+        if token == '(':
+            advance()
+            node = parseOr()
+            if peek() == ')':
+                advance()
+            return node
+        if token.startswith('"'):
+            advance()
+            words = tuple(analyzer.terms(token))
+            return ('term', words) if words else None
+
+        words = []
+        while peek() is not None and peek() not in '()' and not peek().startswith('"') and not isOperator(peek()):
+            words.extend(analyzer.terms(advance()))
+        return ('term', tuple(words))
+
+    tree = parseOr()
+    while position < len(tokens):
+        # Unbalanced ')' ends the expression early: AND the remainder on
+        advance()
+        rest = parseOr()
+        if rest is not None:
+            tree = rest if tree is None else ('and', [tree, rest])
+    return tree
+
+def queryTerms(tree):
+    """All words of the non-negated phrases of a parsed query."""
+    if tree is None or tree[0] == 'not':
+        return []
+    if tree[0] == 'term':
+        return list(tree[1])
+    return [word for child in tree[1] for word in queryTerms(child)]
+
+class QueryEvaluator:
+    """Evaluates a parsed query with postings set operations and ranks the matches with p-norm scores."""
+
+    def __init__(self, index, p=P_NORM):
+        self.index = index
+        self.p = p
+        self.phrases = {}   # {words: {doc_id: occurrences}} of the phrases evaluated so far
+
+    def matches(self, node):
+        """Sorted doc ids satisfying the node under strict Boolean semantics."""
+        kind = node[0]
+        if kind == 'term':
+            docIds, counts = self.index.phrase(node[1])
+            self.phrases[node[1]] = dict(zip(docIds, counts))
+            return docIds
+        if kind == 'not':
+            return subtractPostings(self.index.docIds, self.matches(node[1]))
+        if kind == 'or':
+            return unitePostings([self.matches(child) for child in node[1]])
+
+        positives = [self.matches(child) for child in node[1] if child[0] != 'not']
+        negatives = [self.matches(child[1]) for child in node[1] if child[0] == 'not']
+        if positives:
+            positives.sort(key=len)
+            result = positives[0]
+            for docIds in positives[1:]:
+                result = intersectPostings(result, docIds)
+        else:
+            result = self.index.docIds
+        for docIds in negatives:
+            result = subtractPostings(result, docIds)
+        return result
+
+    def weight(self, words, docId):
+        """Normalized tf-idf weight in [0, 1] of a phrase in a document."""
+        occurrences = self.phrases[words]
+        count = occurrences.get(docId, 0)
+        if count == 0:
+            return 0.0
+        totalDocuments = len(self.index.docIds)
+        idf = log(totalDocuments / len(occurrences)) / log(totalDocuments) if totalDocuments > 1 else 1.0
+        return min(1.0, count / max(1, self.index.maxFrequencies.get(docId, 1))) * idf
+
+    def score(self, node, docId):
+        """Extended Boolean (p-norm) similarity of the document to the node."""
+        kind = node[0]
+        if kind == 'term':
+            return self.weight(node[1], docId)
+        if kind == 'not':
+            return 1.0 - self.score(node[1], docId)
+
+        scores = [self.score(child, docId) for child in node[1]]
+        if kind == 'or':
+            return (sum(score ** self.p for score in scores) / len(scores)) ** (1 / self.p)
+        return 1.0 - (sum((1.0 - score) ** self.p for score in scores) / len(scores)) ** (1 / self.p)
+
+@lru_cache(maxsize=None)
+def getIndex():
+    return BooleanIndex(getPositionalIndex(DOCUMENTS_DIR))
+
+def rankDocuments(query, topN=None):
+    """Return [(doc_id, score), ...] of the (topN best) documents matching the Boolean query, best p-norm score first."""
+    index = getIndex()
+    tree = parseQuery(query, index.corpus.analyzer)
+    if tree is None:
+        return []
+    evaluator = QueryEvaluator(index)
+    docIds = evaluator.matches(tree)
+    scored = [(docId, evaluator.score(tree, docId)) for docId in docIds]
+    return top_k(scored, topN, key=lambda item: (-item[1], item[0]))
+
+def search(query, topN=None, snippetWords=None):
+    """
+    Perform an extended Boolean search over the documents.
+    Supports nested AND, OR and NOT (case-insensitive), parentheses and phrases.
+
+    Args:
+        snippetWords (int): When given, each result shows its best snippets of this many words instead of the whole document.
+    """
+    documents = loadDocuments()
+    terms = ' '.join(queryTerms(parseQuery(query, getIndex().corpus.analyzer)))
+    return [
+        (highlightTerms(fileName, terms), highlightTerms(documents[fileName], terms, snippetWords))
+        for fileName, _ in rankDocuments(query, topN)
+    ]
+
+def searchBatch(queries, topN=None):
+    """Rank a list of Boolean queries; returns one list of (doc_id, score) per query."""
+    return [rankDocuments(query, topN) for query in queries]
 
 def searchTerm(term):
-    """Search for a single term in the documents."""
-    term = term.strip()
-    return {docId for docId, text in DOCUMENTS.items() if term in text.replace(',', '').replace('.', '').upper()}
-
-def highlightTerms(content, query):
-    """Highlight search terms in the content."""
-    terms = query.replace('AND', '').replace('OR', '').replace('NOT', '').split()
-    for term in terms:
-        term = term.strip().lower()
-        for word in content.strip().split(' '):
-            if word.lower().replace(',', '').replace('.', '') == term:
-                content = content.replace(word, f'<span class="highlight">{word}</span>')
-    return content
\ No newline at end of file
+    """Search for a single term or phrase in the documents."""
+    index = getIndex()
+    return set(index.phrase(tuple(index.corpus.analyzer.terms(term)))[0])
+
+def highlightTerms(content, query, snippetWords=None, maxSnippets=MAX_SNIPPETS):
+    """
+    Highlight search terms in the content in a single pass over its words.
+
+    Args:
+        query (str): Words to highlight; upper-case AND, OR and NOT are ignored.
+        snippetWords (int): Only return the (up to maxSnippets) windows of this many words holding the most hits.
+    """
+    analyzer = getIndex().corpus.analyzer
+    terms = {token.term for token in analyzer.tokens(query) if query[token.start:token.end] not in OPERATORS}
+    words = list(analyzer.tokens(content))
+    hits = [index for index, word in enumerate(words) if word.term in terms]
+
+    if snippetWords is None or len(words) <= snippetWords:
+        return renderHighlights(content, 0, len(content), words, hits)
+
+    windows = bestWindows(hits, len(words), snippetWords, maxSnippets)
+    snippets = []
+    for first, last in windows:
+        windowHits = hits[bisect_left(hits, first):bisect_left(hits, last)]
+        start, end = words[first].start, words[last - 1].end
+        snippets.append(renderHighlights(content, start, end, words, windowHits))
+    return ' &hellip; '.join(snippets)
+
+def renderHighlights(content, start, end, words, hits):
+    """Escape content[start:end] and wrap the words at the hit indexes in highlight spans."""
+    pieces = []
+    position = start
+    for index in hits:
+        word = words[index]
+        pieces.append(escape(content[position:word.start]))
+        pieces.append(f'<span class="highlight">{escape(content[word.start:word.end])}</span>')
+        position = word.end
+    pieces.append(escape(content[position:end]))
+    return ''.join(pieces)
+
+def bestWindows(hits, wordCount, size, count):
+    """Pick up to count non-overlapping [first, last) word windows with the most hits, in document order."""
+    if not hits:
+        return [(0, min(size, wordCount))]
+
+    candidates = []
+    for first in hits:
+        first = min(first, max(0, wordCount - size))
+        last = first + size
+        candidates.append((bisect_left(hits, last) - bisect_left(hits, first), -first, last))
+    candidates.sort(reverse=True)
+
+    chosen = []
+    for _, negativeFirst, last in candidates:
+        first = -negativeFirst
+        if all(last <= otherFirst or first >= otherLast for otherFirst, otherLast in chosen):
+            chosen.append((first, last))
+            if len(chosen) == count:
+                break
+    return sorted(chosen)
@@ -1,75 +1,191 @@
-import os
-import re
+import heapq
 # import math
 from collections import defaultdict
+from functools import lru_cache, reduce
+
+from scripts.corpus import get_corpus
+from scripts.ranking import top_k
+
+# Fuzzy operators combining the memberships of the query terms; all are monotone, as the threshold algorithm requires
+OPERATORS = {
+    "max": max,  # Union
+    "min": min,  # Intersection
+    "algebraic_sum": lambda memberships: 1 - reduce(lambda product, mu: product * (1 - mu), memberships, 1.0),
+    "algebraic_product": lambda memberships: reduce(lambda product, mu: product * mu, memberships, 1.0),
+}
+# Operators scoring 0 as soon as one query term is missing from the document
+CONJUNCTIVE_OPERATORS = {"min", "algebraic_product"}
+
+
+class _Descending:
+    """Orders doc ids in reverse, so the heap evicts the larger doc_id among equal scores."""
+    __slots__ = ("value",)
+    
+    def __init__(self, value):
+        self.value = value
+    
+    def __lt__(self, other):
+        return self.value > other.value
+    
+    def __eq__(self, other):
+        return self.value == other.value
 
 
 class FuzzyInformationRetrieval:
-    def __init__(self):
+    def __init__(self, corpus=None):
         """
-        Initializes the Fuzzy IR system by reading and indexing all .txt files in the current folder.
+        Initializes the Fuzzy IR system by indexing all .txt files of the shared corpus.
+        
+        Args:
+            corpus (Corpus): Pre-tokenized documents; defaults to the process-wide data/documents corpus.
         """
+        self.corpus = corpus or get_corpus()
         self.documents = {}  # {doc_id: content}
-        self.term_frequencies = defaultdict(lambda: defaultdict(int))  # {doc_id: {term: frequency}}
+        self.term_frequencies = {}  # {doc_id: {term: frequency}}
         self.fuzzy_memberships = defaultdict(lambda: defaultdict(float))  # {doc_id: {term: membership}} 
+        self.membership_postings = {}  # {term: [(membership, doc_id), ...]} by descending membership, then doc_id
         self._read_documents()
         self._calculate_fuzzy_memberships()
+        self._build_membership_postings()
+        self.corpus.subscribe(self.apply_changes)
     
     def _read_documents(self):
-        """Reads all .txt files in the current folder and stores their content."""
-        DOCUMENTS_DIR = "data/documents"
-        for filename in os.listdir(DOCUMENTS_DIR):
-            if filename.endswith(".txt"):
-                doc_id = filename  # Use filename as the document ID
-                filename = os.path.join(DOCUMENTS_DIR, filename)
-                with open(filename, 'r', encoding='utf-8') as file:
-                    content = file.read().lower()  # Convert to lowercase for case-insensitive search
-                    self.documents[doc_id] = content
-                    self._tokenize_and_count_terms(doc_id, content)
-    
-    def _tokenize_and_count_terms(self, doc_id, content):
-        """Tokenizes the document's content and counts term frequencies."""
-        terms = re.findall(r'\w+', content)  # Extract words only
-        for term in terms:
-            self.term_frequencies[doc_id][term] += 1
+        """Takes the documents and their term frequencies from the shared, already tokenized corpus."""
+        self.documents = self.corpus.documents
+        self.term_frequencies = self.corpus.term_frequencies
     
     def _calculate_fuzzy_memberships(self):
         """Calculates fuzzy membership degrees for each term in each document."""
         for doc_id, term_freqs in self.term_frequencies.items():
-            max_freq = max(term_freqs.values())  # Maximum frequency of any term in the document
-            for term, freq in term_freqs.items():
-                self.fuzzy_memberships[doc_id][term] = freq / max_freq  # Membership degree between 0 and 1
+            self._calculate_document_memberships(self.fuzzy_memberships, doc_id, term_freqs)
+    
+    def _calculate_document_memberships(self, fuzzy_memberships, doc_id, term_freqs):
+        """Calculates the fuzzy membership degree of each term of one document."""
+        if not term_freqs:
+            return
+        max_freq = max(term_freqs.values())  # Maximum frequency of any term in the document
+        for term, freq in term_freqs.items():
+            fuzzy_memberships[doc_id][term] = freq / max_freq  # Membership degree between 0 and 1
     
-    def query(self, query_text):
+    def _build_membership_postings(self):
+        """Inverts the memberships into one postings list per term, sorted for the threshold algorithm."""
+        postings = defaultdict(list)
+        for doc_id, memberships in self.fuzzy_memberships.items():
+            for term, membership in memberships.items():
+                postings[term].append((membership, doc_id))
+        self.membership_postings = {term: sorted(entries, key=lambda entry: (-entry[0], entry[1])) for term, entries in postings.items()}
+    
+    def apply_changes(self, delta):
+        """Updates the memberships and the postings of the terms of the documents a corpus refresh added, modified or removed."""
+        self._read_documents()
+        fuzzy_memberships = defaultdict(lambda: defaultdict(float))
+        fuzzy_memberships.update(self.fuzzy_memberships)
+        for doc_id in delta.modified + delta.removed:
+            fuzzy_memberships.pop(doc_id, None)
+        for doc_id in delta.added + delta.modified:
+            self._calculate_document_memberships(fuzzy_memberships, doc_id, self.term_frequencies[doc_id])
+        
+        changed_docs = set(delta.added + delta.modified + delta.removed)
+        changed_terms = set()
+        for doc_id in delta.modified + delta.removed:
+            changed_terms.update(delta.previous[doc_id])
+        for doc_id in delta.added + delta.modified:
+            changed_terms.update(fuzzy_memberships[doc_id])
+        membership_postings = dict(self.membership_postings)
+        for term in changed_terms:
+            entries = [entry for entry in membership_postings.get(term, []) if entry[1] not in changed_docs]
+            entries.extend((fuzzy_memberships[doc_id][term], doc_id) for doc_id in delta.added + delta.modified if term in fuzzy_memberships[doc_id])
+            if entries:
+                membership_postings[term] = sorted(entries, key=lambda entry: (-entry[0], entry[1]))
+            else:
+                membership_postings.pop(term, None)
+        
+        self.fuzzy_memberships = fuzzy_memberships
+        self.membership_postings = membership_postings
+    
+    def _score(self, doc_id, query_terms, combine):
+        memberships = self.fuzzy_memberships.get(doc_id, {})
+        return combine([memberships.get(term, 0.0) for term in query_terms])
+    
+    def query(self, query_text, operator="max", top_n=None):
         """
         Processes the query and returns a ranked list of documents based on fuzzy membership.
+        Only the postings of the query terms are read; with top_n the threshold algorithm stops
+        as soon as no unseen document can beat the top_n-th score.
         
         Args:
             query_text (str): The user's search query.
+            operator (str): One of OPERATORS, combining the memberships of the query terms.
+            top_n (int): Keep only the best top_n documents; all matching documents when None.
         
         Returns:
-            list of tuples: List of (doc_id, score) sorted by descending score.
+            list of tuples: List of (doc_id, score) sorted by descending score, documents scoring 0 left out.
         """
-        query_terms = re.findall(r'\w+', query_text.lower())  # Tokenize the query into terms
-        document_scores = defaultdict(float)  # {doc_id: fuzzy score}
+        combine = OPERATORS[operator]
+        query_terms = list(dict.fromkeys(self.corpus.analyzer.terms(query_text)))  # Tokenize the query into distinct terms
+        if not query_terms:
+            return []
+        postings = self.membership_postings
+        if operator in CONJUNCTIVE_OPERATORS and any(term not in postings for term in query_terms):
+            return []
+        lists = [postings[term] for term in query_terms if term in postings]
+        if not lists:
+            return []
         
-        for doc_id, memberships in self.fuzzy_memberships.items():
-            scores = [memberships.get(term, 0) for term in query_terms]  # Get membership for each query term
-            document_scores[doc_id] = max(scores)  # Fuzzy logic: Use max of membership degrees
+        if top_n is None:
+            if operator in CONJUNCTIVE_OPERATORS:
+                # Intersect, walking the shortest list
+                shortest = min(lists, key=len)
+                candidates = {doc_id for _, doc_id in shortest if all(term in self.fuzzy_memberships.get(doc_id, {}) for term in query_terms)}
+            else:
+                candidates = {doc_id for entries in lists for _, doc_id in entries}
+            document_scores = ((doc_id, self._score(doc_id, query_terms, combine)) for doc_id in candidates)
+            return top_k(((doc_id, score) for doc_id, score in document_scores if score > 0), None, key=lambda x: (-x[1], x[0]))
         
-        # Rank documents by score in descending order
-        ranked_results = sorted(document_scores.items(), key=lambda x: x[1], reverse=True)
-        return ranked_results
+        return self._threshold_top_k(lists, query_terms, combine, top_n)
+    
+    def _threshold_top_k(self, lists, query_terms, combine, top_n):
+        """Fagin's threshold algorithm: sorted access round-robin over the lists, random access for the full score."""
+        if top_n <= 0:
+            return []
+        best = []  # Min-heap of (score, _Descending(doc_id)) holding the top_n seen so far
+        seen = set()
+        # Terms without postings (disjunctive operators only) always contribute 0
+        last = [0.0] * len(query_terms)
+        positions = {term: i for i, term in enumerate(query_terms)}
+        slots = [positions[term] for term in query_terms if term in self.membership_postings]
+        for depth in range(max(len(entries) for entries in lists)):
+            for slot, entries in zip(slots, lists):
+                if depth >= len(entries):
+                    last[slot] = 0.0
+                    continue
+                membership, doc_id = entries[depth]
+                last[slot] = membership
+                if doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                score = self._score(doc_id, query_terms, combine)
+                if score > 0:
+                    entry = (score, _Descending(doc_id))
+                    if len(best) < top_n:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+            # No unseen document can score above the combination of the last memberships read
+            if len(best) == top_n and best[0][0] > combine(last):
+                break
+        return [(key.value, score) for score, key in sorted(best, reverse=True)]
     
-    def display_results(self, query_text, top_n=5):
+    def display_results(self, query_text, top_n=5, operator="max"):
         """
         Runs a query and displays the top N results.
         
         Args:
             query_text (str): The user's search query.
             top_n (int): Number of top results to display.
+            operator (str): One of OPERATORS.
         """
-        results = self.query(query_text)
+        results = self.query(query_text, operator, top_n)
         mappedResults = []
         print(f"\nTop {top_n} results for query: '{query_text}'\n{'=' * 40}")
         for rank, (doc_id, score) in enumerate(results[:top_n], start=1):
@@ -79,9 +195,19 @@ class FuzzyInformationRetrieval:
         
         return mappedResults
 
-def search(query, top_n = 10):
-    ir_system = FuzzyInformationRetrieval()
-    return ir_system.display_results(query, top_n)
+@lru_cache(maxsize=None)
+def get_model():
+    """Builds the fuzzy model once per process; every request reuses it."""
+    return FuzzyInformationRetrieval()
+
+def search(query, top_n = 10, operator = "max"):
+    ir_system = get_model()
+    return ir_system.display_results(query, top_n, operator)
+
+def search_batch(queries, top_n = 10, operator = "max"):
+    """Ranks a list of queries against the loaded model; returns one list of (doc_id, score) per query."""
+    ir_system = get_model()
+    return [ir_system.query(query, operator, top_n) for query in queries]
 
 
 if __name__ == "__main__":
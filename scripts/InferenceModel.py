@@ -1,39 +1,73 @@
 import os
-import re
-import random
+from functools import lru_cache
+
+from scripts.corpus import get_corpus
+from scripts.priors import load_priors
+from scripts.ranking import top_k
 
 class InterferenceModel:
-    def __init__(self, document_folder):
+    def __init__(self, document_folder, seed=None):
         """Initialize the Interference Model with documents and relevance probabilities."""
+        self.corpus = get_corpus(document_folder)
+        self.seed = seed  # None: priors from corpus statistics, otherwise seeded random priors
         self.documents = self.load_documents(document_folder)
         self.relevance_probs = self.initialize_relevance_probabilities()
+        self.term_frequencies = self.corpus.term_frequencies  # {filename: Counter of terms}
+        self.document_lengths = self.corpus.lengths  # {filename: number of words}
+        self.postings = self.build_postings(self.documents)  # {term: {filename: term frequency / document length}}
+        self.corpus.subscribe(self.apply_changes)
 
     def load_documents(self, folder_path):
-        """Load documents from the folder and return a dictionary with filenames and content."""
-        documents = {}
-        for filename in os.listdir(folder_path):
-            if filename.endswith('.txt'):
-                with open(os.path.join(folder_path, filename), 'r', encoding='utf-8') as file:
-                    documents[filename] = file.read()
-        return documents
+        """Return the shared corpus of the folder as a dictionary with filenames and content."""
+        return get_corpus(folder_path).documents
 
     def initialize_relevance_probabilities(self):
-        """Randomly initialize relevance probabilities for each document."""
-        relevance_probs = {}
-        for doc_name in self.documents:
-            relevance_probs[doc_name] = random.uniform(0.1, 0.9)  # Random initial relevance probability
-        return relevance_probs
+        """Load the persisted prior relevance probability of each document, deriving it once for documents without one."""
+        return load_priors(self.corpus, self.seed)
+
+    def build_postings(self, doc_names, terms=None):
+        """Invert the term-frequency tables of doc_names into normalized term frequencies, optionally only for terms."""
+        postings = {}
+        for doc_name in doc_names:
+            total_terms = self.document_lengths[doc_name]
+            for term, freq in self.term_frequencies[doc_name].items():
+                if terms is None or term in terms:
+                    postings.setdefault(term, {})[doc_name] = freq / total_terms
+        return postings
+
+    def apply_changes(self, delta):
+        """Follow a corpus refresh: update the postings of the changed documents' terms, drop removed documents and reload the priors."""
+        documents = self.corpus.documents
+        # Priors depend on the content and the collection statistics, so every refresh reloads them
+        relevance_probs = self.initialize_relevance_probabilities()
+
+        changed_docs = delta.added + delta.modified
+        changed_terms = set()
+        for doc_name in delta.modified + delta.removed:
+            changed_terms.update(delta.previous[doc_name])
+        for doc_name in changed_docs:
+            changed_terms.update(self.corpus.term_frequencies[doc_name])
+        self.term_frequencies = self.corpus.term_frequencies
+        self.document_lengths = self.corpus.lengths
+
+        postings = dict(self.postings)
+        changed_postings = self.build_postings(changed_docs, changed_terms)
+        for term in changed_terms:
+            entries = {doc: weight for doc, weight in postings.get(term, {}).items() if doc in documents and doc not in delta.modified}
+            entries.update(changed_postings.get(term, {}))
+            if entries:
+                postings[term] = entries
+            else:
+                postings.pop(term, None)
+
+        self.relevance_probs = relevance_probs
+        self.postings = postings
+        self.documents = documents
 
     def calculate_query_document_similarity(self, query, document):
         """Calculate similarity between query and document using term frequency."""
-        query_terms = re.findall(r'\w+', query.lower())
-        document_terms = re.findall(r'\w+', self.documents[document].lower())
-        
-        term_frequencies = {term: document_terms.count(term) for term in query_terms}
-        total_terms = len(document_terms)
-        
-        similarity = sum(freq / total_terms for freq in term_frequencies.values())
-        return similarity
+        query_terms = set(self.corpus.analyzer.terms(query))
+        return sum(self.postings.get(term, {}).get(document, 0) for term in query_terms)
 
     def calculate_relevance(self, query, document):
         """Calculate the relevance of a document given a query using the Interference Model."""
@@ -41,16 +75,25 @@ class InterferenceModel:
         document_relevance = self.relevance_probs[document]
         return query_similarity * document_relevance
 
-    def rank_documents(self, query):
-        """Rank documents by their relevance score for the given query."""
-        relevance_scores = {doc: self.calculate_relevance(query, doc) for doc in self.documents}
-        ranked_docs = sorted(relevance_scores.items(), key=lambda x: x[1], reverse=True)
+    def rank_documents(self, query, top_n=None):
+        """
+        Rank the documents containing a query term by their relevance score for the given query.
+        The similarity is accumulated over the postings of the distinct query terms, a sparse dot product.
+        """
+        postings = self.postings
+        relevance_probs = self.relevance_probs
+        similarities = {}
+        for term in set(self.corpus.analyzer.terms(query)):
+            for doc, weight in postings.get(term, {}).items():
+                similarities[doc] = similarities.get(doc, 0) + weight
+        relevance_scores = {doc: similarity * relevance_probs[doc] for doc, similarity in similarities.items()}
+        ranked_docs = top_k(relevance_scores.items(), top_n, key=lambda x: (-x[1], x[0]))
         return ranked_docs
 
-    def display_ranked_documents(self, query):
-        """Display the ranked documents with their relevance scores."""
+    def display_ranked_documents(self, query, top_n=None):
+        """Display the top_n (all when None) ranked documents with their relevance scores."""
         print(f"\nRanked documents for query: '{query}'\n")
-        ranked_docs = self.rank_documents(query)
+        ranked_docs = self.rank_documents(query, top_n)
         results = []
         for rank, (doc, score) in enumerate(ranked_docs, start=1):
             print(f"{rank}. {doc} - Relevance Score = {score:.4f}")
@@ -59,9 +102,19 @@ class InterferenceModel:
 
         return results
 
-def search(query):
-    model = InterferenceModel('data/documents')
-    return model.display_ranked_documents(query)
+@lru_cache(maxsize=None)
+def get_model(document_folder='data/documents', seed=None):
+    """Return the Interference Model of the folder, built on first use."""
+    return InterferenceModel(document_folder, seed)
+
+def search(query, top_n=None):
+    model = get_model()
+    return model.display_ranked_documents(query, top_n)
+
+def search_batch(queries, top_n=None):
+    """Rank a list of queries against the loaded model; returns one list of (doc_id, score) per query."""
+    model = get_model()
+    return [model.rank_documents(query, top_n) for query in queries]
 
 
 if __name__ == "__main__":
@@ -1,54 +1,150 @@
+import argparse
+import logging
+import multiprocessing
 import os
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import shared_memory
+
 import numpy as np
 
+from scripts.corpus import INDEX_DIR, get_corpus
+from scripts.ingestion import START_METHOD
+from scripts.ranking import ModelUnavailable, top_k_indices
+from scripts.sparse import SparseMatrix
+
+logger = logging.getLogger(__name__)
+
+# Weights and vocabulary of the trained ranker, written by `python -m scripts.NeuralNetwork train`
+MODEL_PATH = os.path.join(INDEX_DIR, "neural_ranker.npz")
+# Training state saved after every epoch, so an interrupted training can resume
+CHECKPOINT_PATH = os.path.join(INDEX_DIR, "neural_ranker.checkpoint.npz")
+
 # 1️⃣ **Data Preparation**
-def load_txt_files(folder_path):
-    """Load all .txt files from the given folder into a Pandas DataFrame."""
-    data = {'filename': [], 'text': []}
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".txt"):
-            with open(os.path.join(folder_path, filename), 'r', encoding='utf-8') as file:
-                text = file.read().lower()  # Convert to lowercase
-                text = ''.join(char if char.isalnum() else ' ' for char in text)  # Remove non-alphanumeric chars
-                data['filename'].append(filename)
-                data['text'].append(text)
-    return pd.DataFrame(data)
-
-def tokenize(text):
-    """Split the text into words."""
-    return text.split()
-
-def build_vocabulary(documents):
-    """Create a vocabulary from all the words in the documents."""
-    vocab = set()
-    for doc in documents:
-        tokens = tokenize(doc)
-        vocab.update(tokens)
-    return list(vocab)
-
-def create_bow_vector(document, vocabulary):
-    """Create a Bag-of-Words (BoW) vector for a document."""
-    tokens = tokenize(document)
-    vector = np.zeros(len(vocabulary), dtype=int)
-    for token in tokens:
-        if token in vocabulary:
-            index = vocabulary.index(token)
-            vector[index] += 1
-    return vector
-
-def prepare_bow_vectors(documents, vocabulary):
-    """Convert all documents into BoW vectors."""
-    return np.array([create_bow_vector(doc, vocabulary) for doc in documents])
+def build_vocabulary(term_collections):
+    """Create a vocabulary {term: column} from all the words of the documents (token lists or term Counters)."""
+    terms = sorted(set(term for terms in term_collections for term in terms))
+    return {term: index for index, term in enumerate(terms)}
+
+def create_bow_vector(tokens, vocabulary):
+    """Create a sparse Bag-of-Words (BoW) vector: (vocabulary columns, counts) of the known tokens."""
+    columns = np.array([vocabulary[token] for token in tokens if token in vocabulary], dtype=np.int64)
+    return np.unique(columns, return_counts=True)
+
+def create_count_vector(term_frequencies, vocabulary):
+    """The Bag-of-Words vector of create_bow_vector from the Counter of a document's terms."""
+    known = sorted((vocabulary[term], count) for term, count in term_frequencies.items() if term in vocabulary)
+    columns = np.array([column for column, _ in known], dtype=np.int64)
+    return columns, np.array([count for _, count in known], dtype=np.int64)
+
+def inverse_document_frequencies(bow_vectors, vocabulary_size):
+    """Smoothed idf of every vocabulary column."""
+    document_frequencies = np.zeros(vocabulary_size)
+    for columns, _ in bow_vectors:
+        document_frequencies[columns] += 1
+    return np.log((1 + len(bow_vectors)) / (1 + document_frequencies)) + 1
+
+class DocumentVectors:
+    def __init__(self, corpus, vocabulary, idf):
+        """
+        Unit-length tf-idf vectors of the corpus documents over a fixed vocabulary, with per-term postings
+        so a query only reads the documents containing its terms.
+        """
+        self.idf = idf
+        self.doc_ids = list(corpus.term_frequencies)
+        self.vectors = []  # (columns, weights) of each document
+        postings = {}  # {column: ([row, ...], [weight, ...])}
+        for row, doc_id in enumerate(self.doc_ids):
+            columns, counts = create_count_vector(corpus.term_frequencies[doc_id], vocabulary)
+            weights = counts * idf[columns]
+            norm = np.linalg.norm(weights)
+            weights = weights / norm if norm > 0 else weights
+            self.vectors.append((columns, weights))
+            for column, weight in zip(columns.tolist(), weights.tolist()):
+                rows, values = postings.setdefault(column, ([], []))
+                rows.append(row)
+                values.append(weight)
+        self.postings = {column: (np.array(rows), np.array(values)) for column, (rows, values) in postings.items()}
+
+def pair_features(query_vector, document_vectors, rows):
+    """
+    Query-document feature pairs, one row per document row: the query counts times the document weights of
+    the query terms, a sparse (len(rows) x vocabulary) matrix.
+    """
+    position = {row: i for i, row in enumerate(rows)}
+    feature_rows, feature_columns, feature_values = [], [], []
+    for column, count in zip(*query_vector):
+        if column not in document_vectors.postings:
+            continue
+        doc_rows, weights = document_vectors.postings[column]
+        for doc_row, weight in zip(doc_rows.tolist(), weights.tolist()):
+            if doc_row in position:
+                feature_rows.append(position[doc_row])
+                feature_columns.append(column)
+                feature_values.append(count * weight)
+    return SparseMatrix(feature_rows, feature_columns, feature_values, (len(rows), len(document_vectors.idf)), np.float32)
+
+def make_training_pairs(document_vectors, pairs_per_document=20, max_query_terms=3, seed=0):
+    """
+    Self-supervised training data: pseudo-queries sampled from a document's terms, paired with that document
+    (label 1) and with another document sharing a query term, or a random one (label 0).
+
+    Returns:
+        tuple: Features as a SparseMatrix and labels of shape (pairs, 1).
+    """
+    rng = np.random.default_rng(seed)
+    num_docs = len(document_vectors.doc_ids)
+    feature_rows, feature_columns, feature_values, labels = [], [], [], []
+
+    def add_pair(query_columns, doc_row, label):
+        columns, weights = document_vectors.vectors[doc_row]
+        matched = np.isin(columns, query_columns)
+        row = len(labels)
+        feature_rows.extend([row] * int(matched.sum()))
+        feature_columns.extend(columns[matched].tolist())
+        feature_values.extend(weights[matched].tolist())
+        labels.append(label)
+
+    for doc_row, (columns, weights) in enumerate(document_vectors.vectors):
+        if len(columns) == 0:
+            continue
+        for _ in range(pairs_per_document):
+            size = rng.integers(1, min(max_query_terms, len(columns)) + 1)
+            query_columns = rng.choice(columns, size=size, replace=False, p=weights / weights.sum())
+            add_pair(query_columns, doc_row, 1.0)
+            sharing = np.unique(np.concatenate([document_vectors.postings[column][0] for column in query_columns]))
+            sharing = sharing[sharing != doc_row]
+            if len(sharing):
+                add_pair(query_columns, int(rng.choice(sharing)), 0.0)
+            elif num_docs > 1:
+                other = int(rng.integers(num_docs - 1))
+                add_pair(query_columns, other + (other >= doc_row), 0.0)
+
+    features = SparseMatrix(feature_rows, feature_columns, feature_values, (len(labels), len(document_vectors.idf)), np.float32)
+    return features, np.array(labels, dtype=np.float32).reshape(-1, 1)
 
 # 2️⃣ **Neural Network Design**
 class NeuralNetwork:
-    def __init__(self, input_dim, hidden_dim, output_dim):
-        """Initialize weights and biases for the hidden and output layers."""
-        self.W1 = np.random.randn(input_dim, hidden_dim) * 0.01  # Weights for input to hidden
-        self.B1 = np.zeros((1, hidden_dim))  # Bias for hidden layer
-        self.W2 = np.random.randn(hidden_dim, output_dim) * 0.01  # Weights for hidden to output
-        self.B2 = np.zeros((1, output_dim))  # Bias for output layer
+    def __init__(self, input_dim, hidden_dim, output_dim, weight_scale=0.01, seed=0):
+        """Initialize float32 weights and biases for the hidden and output layers."""
+        rng = np.random.default_rng(seed)
+        self.W1 = (rng.standard_normal((input_dim, hidden_dim)) * weight_scale).astype(np.float32)  # Weights for input to hidden
+        self.B1 = np.zeros((1, hidden_dim), dtype=np.float32)  # Bias for hidden layer
+        self.W2 = (rng.standard_normal((hidden_dim, output_dim)) * weight_scale).astype(np.float32)  # Weights for hidden to output
+        self.B2 = np.zeros((1, output_dim), dtype=np.float32)  # Bias for output layer
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        """A network using the given weights and biases as they are, without initializing new ones."""
+        model = cls.__new__(cls)
+        model.set_parameters(parameters)
+        return model
+
+    def parameters(self):
+        return {'W1': self.W1, 'B1': self.B1, 'W2': self.W2, 'B2': self.B2}
+
+    def set_parameters(self, parameters):
+        self.W1, self.B1, self.W2, self.B2 = (parameters[name] for name in ('W1', 'B1', 'W2', 'B2'))
 
     def relu(self, x):
         """ReLU activation function."""
@@ -56,17 +152,20 @@ class NeuralNetwork:
 
     def relu_derivative(self, x):
         """Derivative of ReLU (used for backpropagation)."""
-        return np.where(x > 0, 1, 0)
+        return (x > 0).astype(x.dtype)
 
     def forward(self, x):
-        """Forward pass through the network."""
-        self.Z1 = np.dot(x, self.W1) + self.B1  # Linear transformation
+        """Forward pass through the network; x is a dense array or a SparseMatrix with one row per example."""
+        self.Z1 = (x.dot(self.W1) if isinstance(x, SparseMatrix) else np.dot(x, self.W1)) + self.B1  # Linear transformation
         self.A1 = self.relu(self.Z1)  # Apply ReLU
         self.Z2 = np.dot(self.A1, self.W2) + self.B2  # Linear transformation for output
         return self.Z2
 
-    def backward(self, x, y_true, y_pred, learning_rate):
-        """Backward pass for weight updates."""
+    def gradients(self, x, y_true, y_pred):
+        """
+        Mean squared error gradients of the last forward pass, as {name: (gradient, rows)}.
+        For a SparseMatrix x the W1 gradient only holds the rows of the columns x uses (rows gives them), otherwise rows is None.
+        """
         m = x.shape[0]  # Number of examples
 
         # Compute gradients for output layer
@@ -77,91 +176,367 @@ class NeuralNetwork:
         # Compute gradients for hidden layer
         dA1 = np.dot(dZ2, self.W2.T)
         dZ1 = dA1 * self.relu_derivative(self.Z1)
-        dW1 = np.dot(x.T, dZ1) / m
+        if isinstance(x, SparseMatrix):
+            rows, columns = np.unique(x.cols, return_inverse=True)
+            local = SparseMatrix(x.rows, columns, x.values, (x.shape[0], len(rows)), x.values.dtype)
+            dW1 = (local.transpose_dot(dZ1) / m, rows)
+        else:
+            dW1 = (np.dot(x.T, dZ1) / m, None)
         dB1 = np.sum(dZ1, axis=0, keepdims=True) / m
-
-        # Update weights and biases
-        self.W1 -= learning_rate * dW1
-        self.B1 -= learning_rate * dB1
-        self.W2 -= learning_rate * dW2
-        self.B2 -= learning_rate * dB2
+        return {'W1': dW1, 'B1': (dB1, None), 'W2': (dW2, None), 'B2': (dB2, None)}
 
 # 3️⃣ **Training**
-def train_model(model, X_train, y_train, epochs=100, learning_rate=0.01):
-    """Train the model on the training set."""
-    for epoch in range(epochs):
-        y_pred = model.forward(X_train)  # Forward pass
-        loss = np.mean((y_pred - y_train) ** 2)  # Mean squared error loss
-        model.backward(X_train, y_train, y_pred, learning_rate)  # Backward pass
-        
-        if (epoch + 1) % 10 == 0:
-            print(f'Epoch [{epoch+1}/{epochs}], Loss: {loss:.4f}')
+class SGD:
+    def __init__(self, learning_rate=0.5, momentum=0.0):
+        """Stochastic gradient descent, with optional momentum."""
+        self.learning_rate = learning_rate
+        self.momentum = momentum
+        self.velocities = {}  # {parameter name: velocity}
+
+    def apply(self, parameters, gradients):
+        """Update the parameters in place from {name: (gradient, rows)}; rows limits the update to those rows."""
+        for name, (gradient, rows) in gradients.items():
+            parameter = parameters[name]
+            index = slice(None) if rows is None else rows
+            if self.momentum:
+                velocity = self.velocities.setdefault(name, np.zeros_like(parameter))
+                velocity[index] = self.momentum * velocity[index] - self.learning_rate * gradient
+                parameter[index] += velocity[index]
+            else:
+                parameter[index] -= self.learning_rate * gradient
+
+    def state(self):
+        return {f'velocity/{name}': velocity for name, velocity in self.velocities.items()}
+
+    def load_state(self, state):
+        self.velocities = {key.split('/', 1)[1]: value for key, value in state.items() if key.startswith('velocity/')}
+
+class Adam:
+    def __init__(self, learning_rate=0.01, beta1=0.9, beta2=0.999, epsilon=1e-8):
+        """Adam; with row-sparse gradients only the moments of the touched rows are updated (lazy Adam)."""
+        self.learning_rate = learning_rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.steps = 0
+        self.moments = {}  # {parameter name: (first moment, second moment)}
+
+    def apply(self, parameters, gradients):
+        self.steps += 1
+        step_size = self.learning_rate * np.sqrt(1 - self.beta2 ** self.steps) / (1 - self.beta1 ** self.steps)
+        for name, (gradient, rows) in gradients.items():
+            parameter = parameters[name]
+            index = slice(None) if rows is None else rows
+            first, second = self.moments.setdefault(name, (np.zeros_like(parameter), np.zeros_like(parameter)))
+            first[index] = self.beta1 * first[index] + (1 - self.beta1) * gradient
+            second[index] = self.beta2 * second[index] + (1 - self.beta2) * gradient ** 2
+            parameter[index] -= (step_size * first[index] / (np.sqrt(second[index]) + self.epsilon)).astype(parameter.dtype)
+
+    def state(self):
+        state = {'steps': np.array(self.steps)}
+        for name, (first, second) in self.moments.items():
+            state[f'first/{name}'] = first
+            state[f'second/{name}'] = second
+        return state
+
+    def load_state(self, state):
+        self.steps = int(state.get('steps', 0))
+        names = [key.split('/', 1)[1] for key in state if key.startswith('first/')]
+        self.moments = {name: (state[f'first/{name}'], state[f'second/{name}']) for name in names}
+
+def minibatch_rows(count, batch_size, rng):
+    """Yield the row numbers of every batch of a shuffled pass over count examples."""
+    order = rng.permutation(count)
+    for start in range(0, len(order), batch_size):
+        yield order[start:start + batch_size]
+
+def _mean_squared_error(model, X, y, batch_size=4096):
+    """Loss over X, evaluated in batches so the activations of the whole set are never held at once."""
+    total = 0.0
+    for start in range(0, X.shape[0], batch_size):
+        rows = np.arange(start, min(start + batch_size, X.shape[0]))
+        total += float(np.sum((model.forward(X.take_rows(rows)) - y[rows]) ** 2))
+    return total / max(1, X.shape[0])
+
+# Data-parallel training: the parameters live in shared memory, which the trainer updates between batches while no
+# worker runs, and each worker receives the training set once; a batch only sends the row numbers of every shard
+
+def _share_parameters(model):
+    """Move the parameters of the model into new shared memory blocks; returns {name: block} to close and unlink."""
+    blocks, parameters = {}, {}
+    for name, value in model.parameters().items():
+        blocks[name] = shared_memory.SharedMemory(create=True, size=max(1, value.nbytes))
+        parameters[name] = np.ndarray(value.shape, dtype=value.dtype, buffer=blocks[name].buf)
+        parameters[name][...] = value
+    model.set_parameters(parameters)
+    return blocks
+
+_worker = {}  # State of a training worker process, set by _init_worker
+
+def _init_worker(layout, X, y):
+    """Pool initializer: attach the shared parameters {name: (block name, shape, dtype)} and keep the training set."""
+    blocks = {name: shared_memory.SharedMemory(name=block_name) for name, (block_name, _, _) in layout.items()}
+    parameters = {name: np.ndarray(shape, dtype=dtype, buffer=blocks[name].buf) for name, (_, shape, dtype) in layout.items()}
+    _worker.update(blocks=blocks, model=NeuralNetwork.from_parameters(parameters), X=X, y=y)
+
+def _shard_gradients(rows):
+    """Worker side of data-parallel training: gradients and loss of the training rows of one shard of a batch."""
+    model = _worker['model']
+    X, y = _worker['X'].take_rows(rows), _worker['y'][rows]
+    y_pred = model.forward(X)
+    return model.gradients(X, y, y_pred), float(np.sum((y_pred - y) ** 2)), X.shape[0]
+
+def _combine_gradients(results):
+    """Average shard gradients weighted by shard size; row-sparse W1 gradients are summed per row."""
+    total = sum(count for _, _, count in results)
+    combined = {}
+    for name in results[0][0]:
+        if results[0][0][name][1] is None:
+            combined[name] = (sum(gradients[name][0] * count for gradients, _, count in results) / total, None)
+            continue
+        rows = np.concatenate([gradients[name][1] for gradients, _, _ in results])
+        values = np.concatenate([gradients[name][0] * count for gradients, _, count in results])
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        summed = np.zeros((len(unique_rows), values.shape[1]), dtype=values.dtype)
+        np.add.at(summed, inverse, values)
+        combined[name] = (summed / total, unique_rows)
+    return combined, sum(loss for _, loss, _ in results)
+
+def save_checkpoint(path, model, optimizer, epoch, best_loss, best_parameters, waited):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    arrays = {f'model/{name}': value for name, value in model.parameters().items()}
+    arrays.update({f'best/{name}': value for name, value in (best_parameters or {}).items()})
+    arrays.update({f'optimizer/{key}': value for key, value in optimizer.state().items()})
+    temporary_path = path + ".tmp.npz"
+    np.savez(temporary_path, epoch=epoch, best_loss=best_loss, waited=waited, **arrays)
+    os.replace(temporary_path, path)
+
+def load_checkpoint(path, model, optimizer):
+    """Restore the model and optimizer; returns (last finished epoch, best validation loss, best parameters, epochs waited)."""
+    with np.load(path) as saved:
+        model.set_parameters({key[len('model/'):]: saved[key] for key in saved.files if key.startswith('model/')})
+        optimizer.load_state({key[len('optimizer/'):]: saved[key] for key in saved.files if key.startswith('optimizer/')})
+        best_parameters = {key[len('best/'):]: saved[key] for key in saved.files if key.startswith('best/')}
+        return int(saved['epoch']), float(saved['best_loss']), best_parameters or None, int(saved['waited'])
+
+def train_model(model, X_train, y_train, epochs=100, learning_rate=0.01, batch_size=None, optimizer=None,
+                X_val=None, y_val=None, patience=None, checkpoint_path=None, resume=False, workers=0, seed=0):
+    """
+    Train the model on the training set.
+
+    Args:
+        batch_size (int): Examples per update, streamed from the SparseMatrix X_train; the whole set when None.
+        optimizer (SGD or Adam): Defaults to plain SGD with learning_rate.
+        X_val, y_val: Validation set; the best weights on it are kept.
+        patience (int): Stop after this many epochs without a better validation loss.
+        checkpoint_path (str): Save the training state there after every epoch.
+        resume (bool): Continue from the checkpoint when it exists.
+        workers (int): Split every batch over this many processes (data-parallel gradients) when above 1; they
+            share the parameters and receive the training set once.
+    """
+    optimizer = optimizer or SGD(learning_rate)
+    y_train = np.asarray(y_train, dtype=np.float32)
+    y_val = None if y_val is None else np.asarray(y_val, dtype=np.float32)
+    batch_size = batch_size or X_train.shape[0]
+    first_epoch, best_loss, best_parameters, waited = 0, np.inf, None, 0
+    if resume and checkpoint_path and os.path.exists(checkpoint_path):
+        first_epoch, best_loss, best_parameters, waited = load_checkpoint(checkpoint_path, model, optimizer)
+        print(f'Resuming after epoch {first_epoch}')
+
+    pool, blocks = None, {}
+    if workers > 1:
+        blocks = _share_parameters(model)
+        layout = {name: (blocks[name].name, value.shape, value.dtype) for name, value in model.parameters().items()}
+        pool = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context(START_METHOD), initializer=_init_worker, initargs=(layout, X_train, y_train)
+        )
+    try:
+        for epoch in range(first_epoch, epochs):
+            rng = np.random.default_rng([seed, epoch])  # Reproducible shuffles, also after resuming
+            loss = 0.0
+            for rows in minibatch_rows(X_train.shape[0], batch_size, rng):
+                if pool is None:
+                    X_batch, y_batch = X_train.take_rows(rows), y_train[rows]
+                    y_pred = model.forward(X_batch)  # Forward pass
+                    loss += float(np.sum((y_pred - y_batch) ** 2))  # Squared error, averaged per epoch below
+                    optimizer.apply(model.parameters(), model.gradients(X_batch, y_batch, y_pred))  # Backward pass
+                else:
+                    shards = [shard for shard in np.array_split(rows, workers) if len(shard)]
+                    gradients, batch_loss = _combine_gradients(list(pool.map(_shard_gradients, shards)))
+                    loss += batch_loss
+                    optimizer.apply(model.parameters(), gradients)  # In place, into the shared parameters
+            loss /= max(1, X_train.shape[0])
+
+            message = f'Epoch [{epoch+1}/{epochs}], Loss: {loss:.4f}'
+            if X_val is not None:
+                validation_loss = _mean_squared_error(model, X_val, y_val)
+                message += f', Validation Loss: {validation_loss:.4f}'
+                if validation_loss < best_loss:
+                    best_loss, waited = validation_loss, 0
+                    best_parameters = {name: value.copy() for name, value in model.parameters().items()}
+                else:
+                    waited += 1
+            if (epoch + 1) % 10 == 0 or X_val is not None:
+                print(message)
+            if checkpoint_path:
+                save_checkpoint(checkpoint_path, model, optimizer, epoch + 1, best_loss, best_parameters, waited)
+            if patience is not None and waited >= patience:
+                print(f'Early stopping: no validation improvement for {patience} epochs')
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+            model.set_parameters({name: value.copy() for name, value in model.parameters().items()})
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+
+    if best_parameters is not None:
+        model.set_parameters(best_parameters)
+    return model
+
+def train_ranker(corpus, hidden_dim=16, epochs=50, batch_size=256, optimizer=None, patience=5,
+                 checkpoint_path=None, resume=False, workers=0, seed=0):
+    """Build the vocabulary of the corpus and train a ranker on its self-supervised query-document pairs."""
+    vocabulary = build_vocabulary(corpus.term_frequencies.values())
+    idf = inverse_document_frequencies([create_count_vector(counts, vocabulary) for counts in corpus.term_frequencies.values()], len(vocabulary))
+    document_vectors = DocumentVectors(corpus, vocabulary, idf)
+    X_train, y_train = make_training_pairs(document_vectors, seed=seed)
+    # Held-out pseudo-queries drawn with another seed decide when to stop
+    X_val, y_val = make_training_pairs(document_vectors, pairs_per_document=4, seed=seed + 1)
+    model = NeuralNetwork(input_dim=len(vocabulary), hidden_dim=hidden_dim, output_dim=1, weight_scale=0.1, seed=seed)
+    train_model(
+        model, X_train, y_train, epochs=epochs, batch_size=batch_size, optimizer=optimizer or Adam(0.01),
+        X_val=X_val, y_val=y_val, patience=patience, checkpoint_path=checkpoint_path, resume=resume, workers=workers, seed=seed,
+    )
+    return model, vocabulary, idf
+
+def save_model(path, model, vocabulary, idf, fingerprint):
+    """Write the weights, the vocabulary and its idf to path, replaced atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    terms = np.array(sorted(vocabulary, key=vocabulary.get))
+    temporary_path = path + ".tmp.npz"
+    np.savez(temporary_path, W1=model.W1, B1=model.B1, W2=model.W2, B2=model.B2, terms=terms, idf=idf, fingerprint=fingerprint)
+    os.replace(temporary_path, path)
+
+def load_model(path):
+    """
+    Read a ranker saved by save_model; returns (model, vocabulary, idf, fingerprint of the documents it was trained on)
+    or None when there is none.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as saved:
+        model = NeuralNetwork.from_parameters({name: saved[name] for name in ('W1', 'B1', 'W2', 'B2')})
+        vocabulary = {str(term): index for index, term in enumerate(saved["terms"])}
+        fingerprint = str(saved["fingerprint"]) if "fingerprint" in saved.files else None
+        return model, vocabulary, saved["idf"], fingerprint
 
 # 4️⃣ **Inference**
-def test_model(model, X_test):
-    """Test the trained model on new document vectors."""
-    y_pred = model.forward(X_test)
-    return y_pred
+class NeuralRanker:
+    def __init__(self, corpus, model, vocabulary, idf, fingerprint=None):
+        """
+        Scores the documents of the corpus with a trained network; the vocabulary stays the one trained on.
+        fingerprint identifies the documents the network was trained on; stale tells they were not these.
+        """
+        self.corpus = corpus
+        self.model = model
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.fingerprint = fingerprint
+        self.stale = fingerprint != corpus.fingerprint
+        self.document_vectors = DocumentVectors(corpus, vocabulary, idf)
+        self.corpus.subscribe(self.apply_changes)
+
+    def apply_changes(self, delta):
+        """Re-vectorizes the documents after a corpus refresh; terms unseen in training are ignored until retraining."""
+        self.document_vectors = DocumentVectors(self.corpus, self.vocabulary, self.idf)
+
+    def query(self, query, top_n=None):
+        """
+        Rank the documents containing a query term in one batched forward pass over their query-document features.
+
+        Returns:
+            list of tuples: (doc_id, score) sorted by descending score.
+        """
+        document_vectors = self.document_vectors
+        query_vector = create_bow_vector(self.corpus.analyzer.terms(query), self.vocabulary)
+        rows = sorted(set(row for column in query_vector[0] if column in document_vectors.postings for row in document_vectors.postings[column][0].tolist()))
+        if not rows:
+            return []
+        scores = self.model.forward(pair_features(query_vector, document_vectors, rows)).ravel()
+        return [(document_vectors.doc_ids[rows[i]], float(scores[i])) for i in top_k_indices(scores, top_n)]
 
 # 5️⃣ **Query from Model**
-def query_model(model, query, vocabulary, df):
-    """Query the model and rank the documents based on their relevance scores."""
-    # Convert query to BoW vector
-    query_vector = create_bow_vector(query, vocabulary)  # BoW vector for the query
-    query_vector = query_vector.reshape(1, -1)  # Reshape to (1, input_dim)
-    
-    # Compute relevance scores for each document using document BoW vectors
-    X_documents = prepare_bow_vectors(df['text'], vocabulary)  # All document BoW vectors
-    relevance_scores = model.forward(X_documents)  # Forward pass for all documents
-    
-    # Assign the relevance scores back to the DataFrame
-    df['relevance'] = relevance_scores.flatten()  # Add relevance score as a new column
-    ranked_docs = df.sort_values(by='relevance', ascending=False)  # Rank documents
-    return ranked_docs[['filename', 'relevance']]
-
-def search(query):
-    folder_path = 'data/documents'
-    df = load_txt_files(folder_path)
-
-    vocabulary = build_vocabulary(df['text'])
-    X = prepare_bow_vectors(df['text'], vocabulary)
-    
-    y = np.random.rand(len(X), 1)  # Random relevance scores (replace with real scores)
-    split_index = int(0.8 * len(X))
-    X_train, X_test = X[:split_index], X[split_index:]
-    y_train, y_test = y[:split_index], y[split_index:]
-
-    input_dim = X.shape[1]
-    model = NeuralNetwork(input_dim=input_dim, hidden_dim=10, output_dim=1)
-    train_model(model, X_train, y_train, epochs=50, learning_rate=0.01)
-
-    return query_model(model, query, vocabulary, df)
+@lru_cache(maxsize=None)
+def get_ranker(folder_path='data/documents', model_path=MODEL_PATH):
+    """
+    Load the ranker trained offline by `python -m scripts.NeuralNetwork train`. Raises ModelUnavailable until it
+    exists; requests never train. A ranker trained on other documents is served, flagged stale, with a warning.
+    """
+    corpus = get_corpus(folder_path)
+    loaded = load_model(model_path)
+    if loaded is None:
+        raise ModelUnavailable(f'The neural ranker is not trained yet: run `python -m scripts.NeuralNetwork train` to create {model_path}.')
+    ranker = NeuralRanker(corpus, *loaded)
+    if ranker.stale:
+        logger.warning('%s was trained on other documents than %s; retrain it with `python -m scripts.NeuralNetwork train`.', model_path, folder_path)
+    return ranker
+
+def search(query, top_n=None):
+    ranked_docs = get_ranker().query(query, top_n)
+    return [f"{rank}. {doc_id} (Score: {score:.4f})" for rank, (doc_id, score) in enumerate(ranked_docs, start=1)]
+
+def search_batch(queries, top_n=None):
+    """Rank a list of queries against the loaded ranker; returns one list of (doc_id, score) per query."""
+    ranker = get_ranker()
+    return [ranker.query(query, top_n) for query in queries]
 
 # 6️⃣ **Main Workflow**
 def main():
-    folder_path = 'data/documents'
-    df = load_txt_files(folder_path)
-    print(f"Loaded {len(df)} documents.")
-
-    vocabulary = build_vocabulary(df['text'])
-    X = prepare_bow_vectors(df['text'], vocabulary)
-    
-    y = np.random.rand(len(X), 1)  # Random relevance scores (replace with real scores)
-    split_index = int(0.8 * len(X))
-    X_train, X_test = X[:split_index], X[split_index:]
-    y_train, y_test = y[:split_index], y[split_index:]
-
-    input_dim = X.shape[1]
-    model = NeuralNetwork(input_dim=input_dim, hidden_dim=10, output_dim=1)
-    train_model(model, X_train, y_train, epochs=50, learning_rate=0.01)
+    parser = argparse.ArgumentParser(description='Train or query the neural ranker.')
+    parser.add_argument('command', nargs='?', choices=['train', 'query'], default='query')
+    parser.add_argument('folder', nargs='?', default='data/documents', help='documents folder')
+    parser.add_argument('model', nargs='?', default=MODEL_PATH, help='model file')
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--optimizer', choices=['adam', 'sgd'], default='adam')
+    parser.add_argument('--learning-rate', type=float, default=None)
+    parser.add_argument('--patience', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=0, help='processes computing the gradients of each batch')
+    parser.add_argument('--resume', action='store_true', help='continue from the last checkpoint')
+    arguments = parser.parse_args()
+
+    if arguments.command == 'train':
+        # Offline training: python -m scripts.NeuralNetwork train [documents folder] [model file] [options]
+        corpus = get_corpus(arguments.folder)
+        print(f"Loaded {len(corpus.documents)} documents.")
+        if arguments.optimizer == 'adam':
+            optimizer = Adam(arguments.learning_rate or 0.01)
+        else:
+            optimizer = SGD(arguments.learning_rate or 0.5, momentum=0.9)
+        model, vocabulary, idf = train_ranker(
+            corpus, epochs=arguments.epochs, batch_size=arguments.batch_size, optimizer=optimizer, patience=arguments.patience,
+            checkpoint_path=CHECKPOINT_PATH, resume=arguments.resume, workers=arguments.workers,
+        )
+        save_model(arguments.model, model, vocabulary, idf, corpus.fingerprint)
+        if os.path.exists(CHECKPOINT_PATH):
+            os.remove(CHECKPOINT_PATH)  # Only needed to resume an interrupted training
+        print(f"Saved the ranker to {arguments.model}")
+        return
 
+    try:
+        ranker = get_ranker(arguments.folder, arguments.model)
+    except ModelUnavailable as error:
+        print(error)
+        return
     while True:
         query = input("\nEnter your query (or 'exit' to stop): ")
         if query.lower() == 'exit':
             break
-        ranked_docs = query_model(model, query, vocabulary, df)
         print("\nTop Matching Documents:")
-        print(ranked_docs.head(5))  # Show top 5 relevant documents
+        for doc_id, score in ranker.query(query, top_n=5):  # Show top 5 relevant documents
+            print(f"{doc_id}: {score:.4f}")
 
 if __name__ == "__main__":
     main()
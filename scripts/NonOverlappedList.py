@@ -1,96 +1,132 @@
-import glob
+import logging
 import os
-import string
+from collections import Counter
+from functools import lru_cache
 
-indexes = {}
+from scripts.analysis import WHITESPACE_PATTERN, Analyzer, strip_characters
+from scripts.corpus import get_corpus
+from scripts.diskIndex import DEFAULT_INDEX_PATH, openIndex
+from scripts.stemmer import stem
 
-def loadDocuments(folderPath):
+logger = logging.getLogger(__name__)
+
+# Default collection searched by the model route
+DOCUMENTS_DIR = "data/documents"
+
+# Whitespace separated words, lowercased, stripped of ',' and '.' and stemmed; stop words are dropped
+STOP_WORDS = {'the', 'is', 'and', 'in', 'to', 'of', 'a', 'with', 'for', 'on', 'by', 'are', 'an', 'as', 'that'}
+ANALYZER = Analyzer(WHITESPACE_PATTERN, filters=[strip_characters(',.')], stop_words=STOP_WORDS, stemmer=stem)
+
+class TermIndex:
+    """Inverted index {word: {document name: count}} of the important words, built once from the shared corpus."""
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+        self.index = {}         # {word: {document name: count}}, postings in document name order
+        self.documentWords = {} # {doc_id: Counter of the words indexed for it}, to unindex a changed document
+        contentCounts = corpus.analyze(ANALYZER)  # Analyzed once per document, shared with other users of ANALYZER
+        for docId in sorted(contentCounts, key=documentName):
+            self.addDocument(self.index, docId, contentCounts[docId])
+        self.corpus.subscribe(self.applyChanges)
+
+    def addDocument(self, index, docId, contentCounts):
+        fileName = documentName(docId)
+        counts = Counter(filterImportantWords(fileName))
+        counts.update(contentCounts)
+        for word, count in counts.items():
+            index.setdefault(word, {})[fileName] = count
+        self.documentWords[docId] = counts
+
+    def applyChanges(self, delta):
+        """Re-index the refreshed documents only; postings are copied before they change, as searches may be reading them."""
+        index = dict(self.index)
+        for docId in delta.modified + delta.removed:
+            fileName = documentName(docId)
+            for word in self.documentWords.pop(docId, {}):
+                index[word] = {other: count for other, count in index[word].items() if other != fileName}
+                if not index[word]:
+                    del index[word]
+
+        added = {}
+        contentCounts = self.corpus.analyze(ANALYZER)
+        for docId in delta.added + delta.modified:
+            self.addDocument(added, docId, contentCounts[docId])
+        for word, postings in added.items():
+            # Keep the postings sorted, so results do not depend on the order documents were refreshed in
+            index[word] = dict(sorted({**index.get(word, {}), **postings}.items()))
+        self.index = index
+
+    def __contains__(self, word):
+        return word in self.index
+
+    def postings(self, word):
+        """Return [(document name, count), ...] for word, or None if it is not indexed, as DiskIndex.postings does."""
+        postings = self.index.get(word)
+        return None if postings is None else list(postings.items())
+
+def filterImportantWords(text):
     """
-    Load all text documents from the given folder, process their content, 
-    and build an inverted index for efficient searching.
+    Filter out unimportant words (stop words) and return the stems of the important words.
     """
-    try:
-        for fileName in os.listdir(folderPath):
-            if fileName.endswith('.txt'):  # Only process .txt files
-                filePath = os.path.join(folderPath, fileName)
-                with open(filePath, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                    
-                    # Remove file extension to use as document name
-                    if 'txt' in fileName:
-                        fileName = fileName.split('.')[0]
-
-                    # Filter important words from the document name and content
-                    filteredFileNamesList = filterImportantWords(fileName)
-                    filteredContentWordsList = filterImportantWords(content)
-
-                    # Build inverted index: for each word, store the documents and their frequency
-                    for indexWord in filteredFileNamesList + filteredContentWordsList:
-                        if indexWord not in indexes:
-                            indexes[indexWord] = [[fileName, 1]]
-                        else:
-                            not_inserted = True
-                            indexValue = indexes[indexWord]
-
-                            # Check if the word already exists in the document, update count if it does
-                            for i in range(0, len(indexValue)):
-                                if indexValue[i][0] == fileName:
-                                    indexValue[i][1] += 1
-                                    not_inserted = False
-                            if not_inserted:
-                                indexValue.append([fileName, 1])
-    except FileNotFoundError:
-        print(f'The Directory {folderPath} does not exist.')
+    return ANALYZER.terms(text)
 
-def filterImportantWords(text):
+def documentTermCounts(filePath):
     """
-    Filter out unimportant words (stop words, verb suffixes) and return a list of important words.
+    Return the document name and the counts of the important words of its name and content, as TermIndex holds them,
+    reading the file in chunks so that memory stays bounded whatever its size. Used to build the indexes.
     """
-    wordsList = []
-    stopWords = {'the', 'is', 'and', 'in', 'to', 'of', 'a', 'with', 'for', 'on', 'by', 'are', 'an', 'as', 'that'}
-    verbSuffixes = {'ing', 'ed', 'ate', 'ify', 'ize', 'en', 'fy'}
-    for word in text.split():
-        word = word.lower().strip(',.')
+    fileName = documentName(os.path.basename(filePath))
+    counts = Counter(filterImportantWords(fileName))
+    with open(filePath, 'r', encoding='utf-8') as file:
+        counts.update(ANALYZER.stream_terms(file))
+    return fileName, counts
 
-        if word in stopWords:
-            continue 
+def documentName(fileName):
+    """Remove the file extension to use the file name as document name."""
+    if 'txt' in fileName:
+        fileName = fileName.split('.')[0]
+    return fileName
 
-        if any(word.endswith(suffix) for suffix in verbSuffixes):
-            continue
+@lru_cache(maxsize=None)
+def diskIndex():
+    """Memory-mapped index built by `python -m scripts.diskIndex build`, or None if it does not exist or has an old format."""
+    try:
+        return openIndex(DEFAULT_INDEX_PATH)
+    except ValueError as error:
+        logger.warning('%s Rebuild it with `python -m scripts.diskIndex build`; searching the in-memory index.', error)
+        return None
+
+@lru_cache(maxsize=None)
+def getIndex(folderPath=DOCUMENTS_DIR):
+    """In-memory index of the .txt files of folderPath, built on first use and kept up to date on refresh."""
+    return TermIndex(get_corpus(folderPath))
 
-        wordsList.append(word)
+def servingIndex():
+    """The disk index while it was built from the current documents, otherwise the in-memory index."""
+    index = diskIndex()
+    if index is None or index.fingerprint != get_corpus(DOCUMENTS_DIR).fingerprint:
+        return getIndex()
+    return index
 
-    return wordsList
+def searchBatch(queries, topN=None):
+    """Run a list of queries; the list has no scores, so each result is (document name, None)."""
+    return [[(fileName, None) for fileName in search(query, topN)] for query in queries]
 
-def search(query):
+def search(query, topN=None):
     """
-    Process the query to find documents that contain the queried terms, 
-    combining results without overlapping.
+    Process the query to find documents that contain the queried terms,
+    combining results without overlapping. Only the first topN documents are returned when given.
     """
-    folderPath = "data/documents"
-    loadDocuments(folderPath)
-
-    queries = {}
-    # Prepare the query list by initializing a dictionary for each query
-    queryList = query.split(',')
-    for query in queryList:
-        query = query.lower().strip()  # Clean the query
-        queries[query] = []
-
-    # Process each query, checking the inverted index for matching documents
-    for query, files in queries.items():
-        for word in query.split(' '):
-            if word in indexes:
-                for fileName, count in indexes[word]:
-                    if fileName not in files:
-                        files.append(fileName)
-
-    # Combine the results and avoid overlapping documents
-    nonOverLappedList = []
-    for _, files in queries.items():
-        for file in files:
-            if file not in nonOverLappedList:
-                nonOverLappedList.append(file)
-    
-    # Display the final result of non-overlapping documents
-    return nonOverLappedList
+    index = servingIndex()
+
+    # Documents of every comma-separated sub-query, in query order; the dict is an ordered set,
+    # so a document matched again by a later word or sub-query keeps its first position
+    nonOverLappedList = {}
+    for subQuery in query.split(','):
+        for word in filterImportantWords(subQuery):
+            postings = index.postings(word)
+            if postings:
+                nonOverLappedList.update(dict.fromkeys(fileName for fileName, count in postings))
+
+    # Return the final result of non-overlapping documents
+    return list(nonOverLappedList)[:topN]
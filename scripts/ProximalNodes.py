@@ -1,102 +1,141 @@
-import glob
-import os
-import string
-
-
-def createIndex():
-    file_names = []
-    current_directory = os.getcwd()
-    txt_files = glob.glob(current_directory + "/*.txt")
-
-    for file_name in txt_files:
-        file_name_only = os.path.basename(file_name)
-        file_names.append(file_name_only)
-
-    translator = str.maketrans('', '', string.punctuation)
-    index_dict = {}
-
-    for file_name in file_names:
-
-        with open(file_name, 'r') as file:
-
-            content = file.read()
-            words = content.split()
-
-            for word in words:
-                clean_word = word.translate(translator)
-                clean_word = clean_word.lower()
-                if clean_word not in index_dict.keys():
-                    index_dict[clean_word] = [[file_name, 1]]
-                else:
-                    not_inserted = True
-                    temp = index_dict[clean_word]
-                    for i in range(0, len(temp)):
-                        if temp[i][0] == file_name:
-                            temp[i][1] += 1
-                            not_inserted = False
-                    if not_inserted:
-                        temp.append([file_name, 1])
-    return file_names, index_dict
-
-
-def search(query):
-    
-    graph = {
-    'health': ['pokemon.txt', 'ai.txt', 'plants.txt'],
-    'creature': ['pokemon.txt', 'animals.txt', 'plants.txt'],
-    'video': ['pokemon.txt'],
-    'game': ['pokemon.txt'],
-    'entertainment': ['pokemon.txt', 'ai.txt'],
-    'ability': ['pokemon.txt'],
-    'traits': ['pokemon.txt'],
-    'capture': ['pokemon.txt'],
-    'train': ['pokemon.txt'],
-    'battle': ['pokemon.txt'],
-    'strategy': ['pokemon.txt'],
-    'decision': ['pokemon.txt', 'ai.txt'],
-    'pet': ['pokemon.txt', 'animals.txt'],
-    'artificial': ['ai.txt'],
-    'intelligence': ['ai.txt'],
-    'data': ['ai.txt', 'computer.txt'],
-    'machine': ['ai.txt', 'computer.txt'],
-    'human': ['ai.txt', 'animals.txt', 'plants.txt'],
-    'robot': ['ai.txt'],
-    'organism': ['animals.txt'],
-    'ecosystem': ['animals.txt', 'plants.txt'],
-    'earth': ['animals.txt', 'plants.txt'],
-    'plant': ['animals.txt'],
-    'species': ['animals.txt'],
-    'animal': ['animals.txt'],
-    'survive': ['animals.txt'],
-    'environment': ['animals.txt'],
-    'mammal': ['animals.txt'],
-    'insect': ['animals.txt'],
-    'food': ['animals.txt', 'plants.txt'],
-    'material': ['animals.txt'],
-    'essential': ['plants.txt', 'computer.txt'],
-    'oxygen': ['plants.txt'],
-    'photosynthesis': ['plants.txt'],
-    'tree': ['plants.txt'],
-    'moss': ['plants.txt'],
-    'medicine': ['plants.txt'],
-    'carbon dioxide': ['plants.txt'],
-    'calculation': ['computer.txt'],
-    'software': ['computer.txt'],
-    'life': ['computer.txt'],
-    'communication': ['computer.txt'],
-    'automation': ['computer.txt']
-    }
-
-    arr = query.split(' ')
-
-    results = []
-    for word in arr:
-        if(word in graph.keys()):
-            # print(graph[word])
-            for file in graph[word]:
-                results.append(file)
-
-    return results
+import re
+from bisect import bisect_right
+
+from scripts.positionalIndex import getPositionalIndex
+from scripts.ranking import top_k
+
+
+# Default collection indexed for proximity search
+DOCUMENTS_DIR = "data/documents"
+
+# Query tokens: "a phrase", NEAR/k (or /k), SAME (same section), parentheses-free words; operators in any case
+QUERY_PATTERN = re.compile(r'"[^"]*"?|\bNEAR/\d+\b|/\d+\b|\bSAME\b|\w+', re.IGNORECASE)
+
+
+def phrase(index, words):
+    """{doc_id: start positions} of the documents holding the words consecutively."""
+    postings = index.postings
+    if not words or any(word not in postings for word in words):
+        return {}
+    wordPositions = [dict(zip(*postings[word])) for word in words]
+    docs = set(wordPositions[0]).intersection(*wordPositions[1:])
+
+    matches = {}
+    for doc_id in docs:
+        starts = list(wordPositions[0][doc_id])
+        for offset, positions in enumerate(wordPositions[1:], start=1):
+            starts = intersectSorted(starts, [position - offset for position in positions[doc_id]])
+            if not starts:
+                break
+        if starts:
+            matches[doc_id] = starts
+    return matches
+
+def near(first, second, distance):
+    """{doc_id: matches} where a position of first lies within distance words of one of second (either order)."""
+    matches = {}
+    for doc_id in first.keys() & second.keys():
+        count = countWithin(first[doc_id], second[doc_id], distance)
+        if count:
+            matches[doc_id] = count
+    return matches
+
+def sameSection(index, first, second):
+    """{doc_id: shared sections} where both operands occur inside one section."""
+    matches = {}
+    for doc_id in first.keys() & second.keys():
+        starts = index.sectionStarts[doc_id]
+        sections = {bisect_right(starts, position) - 1 for position in first[doc_id]}
+        shared = sections & {bisect_right(starts, position) - 1 for position in second[doc_id]}
+        if shared:
+            matches[doc_id] = len(shared)
+    return matches
+
+
+def intersectSorted(first, second):
+    """Values present in both ascending sequences, by merging them."""
+    result = []
+    i = j = 0
+    while i < len(first) and j < len(second):
+        if first[i] < second[j]:
+            i += 1
+        elif first[i] > second[j]:
+            j += 1
+        else:
+            result.append(first[i])
+            i += 1
+            j += 1
+    return result
+
+
+def countWithin(first, second, distance):
+    """Number of positions of first with a position of second at most distance words away; one merge pass."""
+    count = 0
+    j = 0
+    for position in first:
+        while j < len(second) and second[j] < position - distance:
+            j += 1
+        if j < len(second) and second[j] <= position + distance and second[j] != position:
+            count += 1
+        elif j + 1 < len(second) and second[j] == position and second[j + 1] <= position + distance:
+            count += 1
+    return count
+
+
+def createIndex(folderPath=DOCUMENTS_DIR):
+    """Positional index of the .txt files of folderPath, shared with the other positional models."""
+    return getPositionalIndex(folderPath)
+
+
+def parseOperand(index, token):
+    words = tuple(index.corpus.analyzer.terms(token))
+    return phrase(index, words)
+
+
+def rankDocuments(query, topN=None):
+    """
+    Rank documents for a proximal nodes query. Words and "quoted phrases" match on their own;
+    'A NEAR/k B' (or 'A /k B') requires A within k words of B and 'A SAME B' requires both in one section.
+    Returns [(document name, number of matches), ...] of the topN (all when None) best documents, most matches first.
+    """
+    index = createIndex()
+    scores = {}
+    previous = None         # (positions by doc, whether they were counted) of the last operand
+    operator = None
+    for token in QUERY_PATTERN.findall(query):
+        if token.upper() == 'SAME' or token.upper().startswith('NEAR/') or token.startswith('/'):
+            operator = token.upper()
+            continue
+
+        operand = parseOperand(index, token)
+        if operator is not None and previous is not None:
+            first, counted = previous
+            if operator == 'SAME':
+                matches = sameSection(index, first, operand)
+            else:
+                matches = near(first, operand, int(operator.split('/')[1]))
+            # The proximity match replaces the standalone match of its left operand
+            if counted:
+                for doc_id, positions in first.items():
+                    scores[doc_id] -= len(positions)
+            for doc_id, count in matches.items():
+                scores[doc_id] = scores.get(doc_id, 0) + count
+            previous = (operand, False)
+        else:
+            for doc_id, positions in operand.items():
+                scores[doc_id] = scores.get(doc_id, 0) + len(positions)
+            previous = (operand, True)
+        operator = None
+
+    return top_k((item for item in scores.items() if item[1] > 0), topN, key=lambda item: (-item[1], item[0]))
+
+def search(query, topN=None):
+    """Return the (topN best) document names matching a proximal nodes query, most matches first."""
+    return [doc_id for doc_id, _ in rankDocuments(query, topN)]
+
+def searchBatch(queries, topN=None):
+    """Rank a list of queries; returns one list of (document name, number of matches) per query."""
+    return [rankDocuments(query, topN) for query in queries]
 
 
 def menu():
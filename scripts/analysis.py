@@ -0,0 +1,139 @@
+"""
+Text analysis shared by every model: an Analyzer runs the pipeline
+
+    tokenizer (compiled pattern) -> lowercase -> token filters -> stop words -> stemmer
+
+over a text. Documents are analyzed once per analyzer through Corpus.analyze, which streams every file
+(read_chunks) into the counts of its terms and re-analyzes only the changed ones on refresh; queries go through
+the same analyzer.
+"""
+import re
+import sys
+from collections import namedtuple
+from functools import partial
+
+# Default tokenizer: runs of word characters
+WORD_PATTERN = re.compile(r'\w+')
+# Whitespace separated tokens, punctuation included, as str.split() gives them
+WHITESPACE_PATTERN = re.compile(r'\S+')
+
+# A term and the [start, end) offsets of the text it was analyzed from
+Token = namedtuple('Token', ['term', 'start', 'end'])
+# Characters read at a time when a file is analyzed as a stream
+CHUNK_SIZE = 1 << 20
+# The whitespace before the last word of a text, and that word
+TRAILING_WORD_PATTERN = re.compile(r'\s+\S*\Z')
+
+
+# Token filters are partials of module-level functions, so that analyzers can be sent to worker processes
+
+def _strip(characters, term):
+    return term.strip(characters) or None
+
+
+def _delete(table, term):
+    return term.translate(table) or None
+
+
+def _minimum_length(length, term):
+    return term if len(term) >= length else None
+
+
+def strip_characters(characters):
+    """Token filter removing the given characters from both ends of a token, as str.strip does."""
+    return partial(_strip, characters)
+
+
+def delete_characters(characters):
+    """Token filter deleting every occurrence of the given characters, e.g. string.punctuation."""
+    return partial(_delete, str.maketrans('', '', characters))
+
+
+def minimum_length(length):
+    """Token filter dropping tokens of fewer than length characters."""
+    return partial(_minimum_length, length)
+
+
+def read_chunks(file, chunk_size=CHUNK_SIZE):
+    """
+    Yield (offset, text) pieces of a text file object of about chunk_size characters, together the whole file.
+    A piece is cut where the whitespace before its last word starts: the word may go on in the next read, so it is
+    carried over to the next piece with that whitespace (a blank line is never split). At most chunk_size characters
+    are carried over, so a run of more than chunk_size characters without whitespace is cut where the read ended.
+    Tokenizers must therefore not match whitespace.
+    """
+    carry = ''
+    offset = 0
+    while True:
+        chunk = file.read(chunk_size)
+        text = carry + chunk
+        if not chunk:
+            if text:
+                yield offset, text
+            return
+        trailing = TRAILING_WORD_PATTERN.search(text, max(0, len(text) - chunk_size))
+        cut = trailing.start() if trailing else len(text)
+        if cut:
+            yield offset, text[:cut]
+        carry = text[cut:]
+        offset += cut
+
+
+class Analyzer:
+    def __init__(self, pattern=WORD_PATTERN, lowercase=True, filters=(), stop_words=(), stemmer=None):
+        """
+        A configured analysis pipeline; analyzers are compared by identity, so keep one per configuration.
+
+        Args:
+            pattern (re.Pattern or str): Tokenizer, every match is a token.
+            lowercase (bool): Lowercase the tokens.
+            filters (iterable of callables): Map a token to a new token, or to None to drop it; run in order.
+            stop_words (iterable of str): Tokens dropped after the filters.
+            stemmer (callable): Maps the remaining tokens to their stem.
+        """
+        self.pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+        self.lowercase = lowercase
+        self.filters = tuple(filters)
+        self.stop_words = frozenset(stop_words)
+        self.stemmer = stemmer
+        # With only the tokenizer and lowercasing, terms() is a single findall over the lowercased text
+        self.simple = lowercase and not (self.filters or self.stop_words or stemmer)
+
+    def analyze(self, token):
+        """Run one token through the pipeline; returns the term, or None when the token is dropped."""
+        if self.lowercase:
+            token = token.lower()
+        for token_filter in self.filters:
+            token = token_filter(token)
+            if token is None:
+                return None
+        if token in self.stop_words:
+            return None
+        if self.stemmer is not None:
+            token = self.stemmer(token)
+        return sys.intern(token)
+
+    def tokens(self, text):
+        """Yield a Token with its offsets in text for every term of text."""
+        for match in self.pattern.finditer(text):
+            term = self.analyze(match.group())
+            if term is not None:
+                yield Token(term, match.start(), match.end())
+
+    def terms(self, text):
+        """Returns the list of interned terms of text."""
+        if self.simple:
+            return [sys.intern(term) for term in self.pattern.findall(text.lower())]
+        analyze = self.analyze
+        return [term for term in map(analyze, self.pattern.findall(text)) if term is not None]
+
+    __call__ = terms
+
+    def stream_terms(self, file, chunk_size=CHUNK_SIZE):
+        """Yield the terms of a text file object read chunk by chunk, so a file of any size is analyzed in bounded memory."""
+        for _, text in read_chunks(file, chunk_size):
+            yield from self.terms(text)
+
+
+# Word tokens, lowercased; how the shared corpus tokenizes documents
+DEFAULT_ANALYZER = Analyzer()
@@ -1,106 +1,248 @@
-import os
 import string
+from functools import lru_cache
+
+import numpy as np
+
+from scripts.analysis import WHITESPACE_PATTERN, Analyzer, delete_characters
+from scripts.corpus import get_corpus
+from scripts.ranking import top_k_indices
+
+# Stop words dropped from documents and queries (can be expanded or replaced with a stop word file)
+STOP_WORDS = frozenset({"the", "is", "at", "on", "in", "and", "a", "of", "to", "for"})
 
 # Preprocessing: Tokenization, Stop Word Removal, and Stemming
+@lru_cache(maxsize=None)
+def get_analyzer(stop_words):
+    # Lowercase whitespace separated tokens, delete their punctuation and drop the stop words
+    return Analyzer(WHITESPACE_PATTERN, filters=[delete_characters(string.punctuation)], stop_words=stop_words)
+
 def preprocess_text(text, stop_words):
-    # Lowercase the text
-    text = text.lower()
-    # Remove punctuation
-    text = text.translate(str.maketrans("", "", string.punctuation))
-    # Tokenize the text
-    tokens = text.split()
-    # Remove stop words
-    tokens = [token for token in tokens if token not in stop_words]
-    return tokens
-
-# Read documents and preprocess them
+    return get_analyzer(frozenset(stop_words)).terms(text)
+
+# Read documents and preprocess them (once per process and stop word list, shared via the corpus)
 def read_and_preprocess_documents(directory, stop_words):
-    documents = {}
-    for file_name in os.listdir(directory):
-        if file_name.endswith(".txt"):
-            with open(os.path.join(directory, file_name), 'r', encoding='utf-8') as file:
-                text = file.read()
-                documents[file_name] = preprocess_text(text, stop_words)
-    return documents
-
-# Represent terms as a binary vector
-def build_term_vectors(documents, query_terms):
-    unique_terms = set()
-    for terms in documents.values():
-        unique_terms.update(terms)
-    unique_terms.update(query_terms)
-
-    term_index = {term: i for i, term in enumerate(sorted(unique_terms))}
-
-    # Create binary vectors for documents
-    doc_vectors = {}
-    for doc_name, terms in documents.items():
-        vector = [1 if term in terms else 0 for term in term_index]
-        doc_vectors[doc_name] = vector
-
-    # Create binary vector for query
-    query_vector = [1 if term in query_terms else 0 for term in term_index]
-
-    return term_index, doc_vectors, query_vector
-
-# Compute Jaccard coefficient
-def compute_jaccard_coefficient(vec1, vec2):
-    intersection = sum(1 for a, b in zip(vec1, vec2) if a == b == 1)
-    union = sum(1 for a, b in zip(vec1, vec2) if a == 1 or b == 1)
-    return intersection / union if union > 0 else 0
-
-# Rank documents based on scores
-def rank_documents(doc_vectors, query_vector):
-    scores = {}
-    for doc_name, vector in doc_vectors.items():
-        scores[doc_name] = compute_jaccard_coefficient(vector, query_vector)
-    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    return get_corpus(directory).analyze(get_analyzer(frozenset(stop_words)))
+
+# Count the set bits of every uint64 word
+if hasattr(np, "bitwise_count"):
+    popcount = np.bitwise_count
+else:
+    _BYTE_BITS = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+    def popcount(words):
+        words = np.ascontiguousarray(words, dtype=np.uint64)
+        return _BYTE_BITS[words.view(np.uint8)].reshape(*words.shape, 8).sum(axis=-1)
+
+# Set the bits of the given term numbers in a row of uint64 words
+def set_bits(row, numbers):
+    np.bitwise_or.at(row, numbers >> 6, np.left_shift(np.uint64(1), (numbers & 63).astype(np.uint64)))
+
+# Documents as packed term bitsets, built once and updated with the changed documents on every refresh
+class BitsetIndex:
+    def __init__(self, directory, stop_words):
+        """
+        Packs the set of preprocessed terms of every document into a row of uint64 words.
+
+        Args:
+            directory (str): Folder holding the .txt documents.
+            stop_words (frozenset): Terms dropped by preprocess_text.
+        """
+        self.corpus = get_corpus(directory)
+        self.stop_words = stop_words
+        self.doc_ids = []  # doc_id of each bitset row, sorted
+        self.documents = {}  # {doc_id: Counter of preprocessed terms} the rows were packed from
+        self.term_index = {}  # {term: bit number}
+        self.bit_count = 0  # Bit numbers handed out, the free ones included
+        self.free_numbers = []  # Bit numbers of terms no document contains any more, reused first
+        self.bits = np.zeros((0, 0), dtype=np.uint64)  # (documents x words) term presence bitsets
+        self.doc_sizes = np.zeros(0, dtype=np.int64)  # Number of distinct terms of each document
+        self.postings = {}  # {term: array of the row numbers of the documents containing it}
+        self._build()
+        self.corpus.subscribe(self.apply_changes)
+
+    def _build(self):
+        documents = read_and_preprocess_documents(self.corpus.folder_path, self.stop_words)
+        doc_ids = sorted(documents)
+        term_index = {}
+        doc_terms = []
+        for doc_id in doc_ids:
+            doc_terms.append(np.array([term_index.setdefault(term, len(term_index)) for term in set(documents[doc_id])], dtype=np.int64))
+
+        bits = np.zeros((len(doc_ids), (len(term_index) + 63) // 64), dtype=np.uint64)
+        postings = {}
+        for row, numbers in enumerate(doc_terms):
+            set_bits(bits[row], numbers)
+            for number in numbers:
+                postings.setdefault(int(number), []).append(row)
+        terms = sorted(term_index, key=term_index.get)
+
+        self.doc_ids, self.documents, self.term_index, self.bits = doc_ids, documents, term_index, bits
+        self.bit_count, self.free_numbers = len(term_index), []
+        self.doc_sizes = popcount(bits).sum(axis=1, dtype=np.int64)
+        self.postings = {terms[number]: np.array(rows, dtype=np.int64) for number, rows in postings.items()}
+
+    def apply_changes(self, delta):
+        """
+        Follow a corpus refresh: only the rows of the changed documents are packed again and only the postings of
+        their terms change; the other rows are copied, moved when documents came or went so that rows stay in doc_id
+        order. Terms new to the collection take the bit numbers of vanished terms before new ones.
+        """
+        documents = read_and_preprocess_documents(self.corpus.folder_path, self.stop_words)
+        changed = delta.added + delta.modified
+        doc_ids = sorted(documents)
+        row_numbers = {doc_id: row for row, doc_id in enumerate(doc_ids)}
+        old_rows = {doc_id: row for row, doc_id in enumerate(self.doc_ids)}
+        # New row of every old row, -1 for removed documents; rows leaving are those of modified and removed documents
+        remap = np.array([row_numbers.get(doc_id, -1) for doc_id in self.doc_ids], dtype=np.int64)
+        leaving = np.zeros(len(self.doc_ids), dtype=bool)
+        leaving[[old_rows[doc_id] for doc_id in delta.modified + delta.removed]] = True
+        left_terms = set()
+        for doc_id in delta.modified + delta.removed:
+            left_terms.update(self.documents[doc_id])
+        joining = {}  # {term: [new row, ...]} of the changed documents
+        for doc_id in changed:
+            for term in documents[doc_id]:
+                joining.setdefault(term, []).append(row_numbers[doc_id])
+
+        moved = bool(delta.added or delta.removed)
+        postings = {}
+        for term, rows in self.postings.items():
+            if term in left_terms:
+                rows = rows[~leaving[rows]]
+            if moved:
+                rows = remap[rows]
+            postings[term] = rows
+        for term, rows in joining.items():
+            postings[term] = np.sort(np.concatenate([postings.get(term, np.zeros(0, dtype=np.int64)), rows]))
+
+        term_index = dict(self.term_index)
+        free_numbers = list(self.free_numbers)
+        for term in left_terms:
+            if len(postings[term]) == 0:
+                del postings[term]
+                free_numbers.append(term_index.pop(term))
+        free_numbers.sort(reverse=True)
+        bit_count = self.bit_count
+        for term in joining:
+            if term not in term_index:
+                if free_numbers:
+                    term_index[term] = free_numbers.pop()
+                else:
+                    term_index[term] = bit_count
+                    bit_count += 1
+
+        # Kept rows are copied to their new place; the bits of vanished terms are already clear in them
+        kept = np.flatnonzero(~leaving & (remap >= 0))
+        bits = np.zeros((len(doc_ids), (bit_count + 63) // 64), dtype=np.uint64)
+        bits[remap[kept], :self.bits.shape[1]] = self.bits[kept]
+        doc_sizes = np.zeros(len(doc_ids), dtype=np.int64)
+        doc_sizes[remap[kept]] = self.doc_sizes[kept]
+        for doc_id in changed:
+            row = row_numbers[doc_id]
+            set_bits(bits[row], np.array([term_index[term] for term in documents[doc_id]], dtype=np.int64))
+            doc_sizes[row] = len(documents[doc_id])
+
+        self.doc_ids, self.documents, self.term_index, self.bits = doc_ids, documents, term_index, bits
+        self.bit_count, self.free_numbers = bit_count, free_numbers
+        self.doc_sizes = doc_sizes
+        self.postings = postings
+
+    def candidates(self, query_terms):
+        """Row numbers of the documents containing at least one of the query terms."""
+        rows = [self.postings[term] for term in query_terms if term in self.postings]
+        return np.unique(np.concatenate(rows)) if rows else np.zeros(0, dtype=np.int64)
+
+    def presence(self, rows, terms):
+        """(rows x terms) 0/1 matrix telling which of the indexed terms each document contains."""
+        numbers = np.array([self.term_index[term] for term in terms], dtype=np.int64)
+        words = self.bits[np.ix_(rows, numbers >> 6)]
+        return (words >> (numbers & 63).astype(np.uint64)) & np.uint64(1)
+
+# Jaccard coefficient |d ∩ q| / |d ∪ q| of the candidate documents, by popcount
+def compute_jaccard_coefficients(index, rows, query_terms):
+    query_terms = set(query_terms)
+    known_terms = [term for term in query_terms if term in index.term_index]
+    if not known_terms:
+        return np.zeros(len(rows))
+    numbers = np.array([index.term_index[term] for term in known_terms], dtype=np.int64)
+    query_bits = np.zeros(index.bits.shape[1], dtype=np.uint64)
+    set_bits(query_bits, numbers)
+    words = np.unique(numbers >> 6)
+    intersection = popcount(index.bits[np.ix_(rows, words)] & query_bits[words]).sum(axis=1, dtype=np.int64)
+    # Query terms missing from every document still count in the union
+    union = index.doc_sizes[rows] + len(query_terms) - intersection
+    return intersection / union
+
+# Robertson/Sparck Jones log-odds weight of each term; without relevance information this is the
+# idf-like log((N - n + 0.5) / (n + 0.5))
+def compute_rsj_weights(index, terms, relevant_rows=None):
+    N = len(index.doc_ids)
+    n = np.array([len(index.postings[term]) for term in terms], dtype=np.float64)
+    if relevant_rows is None or len(relevant_rows) == 0:
+        return np.log((N - n + 0.5) / (n + 0.5))
+    R = len(relevant_rows)
+    r = index.presence(np.asarray(relevant_rows, dtype=np.int64), terms).sum(axis=0, dtype=np.int64).astype(np.float64)
+    return np.log(((r + 0.5) / (R - r + 0.5)) / ((n - r + 0.5) / (N - n - R + r + 0.5)))
+
+# Rank the documents containing a query term, by summed RSJ weights ("rsj") or Jaccard coefficient ("jaccard");
+# documents scoring 0 or less (common terms have negative RSJ weights) are left out
+def rank_documents(index, query_terms, weighting="rsj", relevant_docs=None, top_n=None):
+    rows = index.candidates(query_terms)
+    if len(rows) == 0:
+        return []
+    if weighting == "jaccard":
+        scores = compute_jaccard_coefficients(index, rows, query_terms)
+    else:
+        terms = [term for term in dict.fromkeys(query_terms) if term in index.term_index]
+        relevant_rows = None
+        if relevant_docs:
+            row_numbers = {doc_id: row for row, doc_id in enumerate(index.doc_ids)}
+            relevant_rows = [row_numbers[doc_id] for doc_id in relevant_docs if doc_id in row_numbers]
+        scores = index.presence(rows, terms).astype(np.float64) @ compute_rsj_weights(index, terms, relevant_rows)
+    return [(index.doc_ids[rows[i]], float(scores[i])) for i in top_k_indices(scores, top_n) if scores[i] > 0]
+
+@lru_cache(maxsize=None)
+def get_index(directory, stop_words):
+    return BitsetIndex(directory, frozenset(stop_words))
 
 # Main Function
 def main():
     # Directory containing the text files
     directory = "../data/documents"
-    
-    # List of stop words (can be expanded or replaced with a stop word file)
-    stop_words = {"the", "is", "at", "on", "in", "and", "a", "of", "to", "for"}
 
-    # Preprocess documents
-    documents = read_and_preprocess_documents(directory, stop_words)
+    # Preprocess documents into bitsets
+    index = get_index(directory, STOP_WORDS)
 
     # Input the user's query
     query = input("Enter your query: ")
-    query_terms = preprocess_text(query, stop_words)
-
-    # Build term vectors
-    term_index, doc_vectors, query_vector = build_term_vectors(documents, query_terms)
+    query_terms = preprocess_text(query, STOP_WORDS)
 
     # Rank documents
-    ranked_docs = rank_documents(doc_vectors, query_vector)
+    ranked_docs = rank_documents(index, query_terms)
 
     # Display results
     print("\nRanked Documents:")
     for doc, score in ranked_docs:
         print(f"{doc}: {score:.4f}")
 
-def search(query):
+def search(query, top_n=None):
      # Directory containing the text files
     directory = "data/documents"
-    
-    # List of stop words (can be expanded or replaced with a stop word file)
-    stop_words = {"the", "is", "at", "on", "in", "and", "a", "of", "to", "for"}
 
-    # Preprocess documents
-    documents = read_and_preprocess_documents(directory, stop_words)
+    # Preprocess documents into bitsets
+    index = get_index(directory, STOP_WORDS)
 
     # Input the user's query
-    query_terms = preprocess_text(query, stop_words)
+    query_terms = preprocess_text(query, STOP_WORDS)
 
-    # Build term vectors
-    term_index, doc_vectors, query_vector = build_term_vectors(documents, query_terms)
+    # Rank the documents with a positive score
+    ranked_docs = rank_documents(index, query_terms, top_n=top_n)
+    return [(item[0], f"{item[1]:.4f}") for item in ranked_docs]
 
-    # Rank documents
-    ranked_docs = rank_documents(doc_vectors, query_vector)
-    return [(item[0], f"{item[1]:.4f}") for item in ranked_docs if item[1] > 0]
+def search_batch(queries, top_n=None):
+    # Same preprocessing as search, one list of (doc_id, score) per query
+    index = get_index("data/documents", STOP_WORDS)
+    return [rank_documents(index, preprocess_text(query, STOP_WORDS), top_n=top_n) for query in queries]
 
 if __name__ == "__main__":
     main()
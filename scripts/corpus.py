@@ -0,0 +1,316 @@
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import Counter, namedtuple
+from collections.abc import Mapping
+from functools import partial
+
+from scripts.analysis import CHUNK_SIZE, DEFAULT_ANALYZER, read_chunks
+from scripts.ingestion import map_files
+
+# Default collection searched by the model routes
+DOCUMENTS_DIR = "data/documents"
+# Folder for persisted indexes and model artefacts
+INDEX_DIR = "data/index"
+
+logger = logging.getLogger(__name__)
+
+# What a refresh changed; previous holds {doc_id: term frequencies before the change} for modified and removed documents
+CorpusDelta = namedtuple('CorpusDelta', ['added', 'modified', 'removed', 'previous'])
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE):
+    """sha1 of the content of a text file as the corpus hashes it (decoded, then utf-8 encoded), read chunk by chunk."""
+    digest = hashlib.sha1()
+    with open(path, 'r', encoding='utf-8') as file:
+        for chunk in iter(lambda: file.read(chunk_size), ''):
+            digest.update(chunk.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def fingerprint(content_hashes):
+    """Hash of {doc_id: content sha1} in doc_id order; equal for equal collections whatever order they were read in."""
+    digest = hashlib.sha1()
+    for doc_id in sorted(content_hashes):
+        digest.update(doc_id.encode('utf-8') + b'\0' + content_hashes[doc_id].encode('ascii'))
+    return digest.hexdigest()
+
+
+def read_document(analyzer, path, chunk_size=CHUNK_SIZE):
+    """
+    Streams a text file through analyzer; returns (Counter of its terms, sha1 of its content as hash_file computes it),
+    or None when the file was deleted meanwhile. Only chunk_size characters of the file are held at a time.
+    """
+    counts = Counter()
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            for _, text in read_chunks(file, chunk_size):
+                digest.update(text.encode('utf-8'))
+                counts.update(analyzer.terms(text))
+    except FileNotFoundError:
+        return None
+    return counts, digest.hexdigest()
+
+
+def count_terms(analyzer, path, chunk_size=CHUNK_SIZE):
+    """Streams a text file through analyzer; returns the Counter of its terms, or None when the file was deleted meanwhile."""
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return Counter(analyzer.stream_terms(file, chunk_size))
+    except FileNotFoundError:
+        return None
+
+
+def _interned(counts):
+    """The counts with their terms interned, as the terms of counts made by worker processes are not."""
+    return Counter({sys.intern(term): count for term, count in counts.items()})
+
+
+class DocumentTexts(Mapping):
+    """
+    Read-only {doc_id: content} of the documents of a corpus, read from disk on access, so that only the contents
+    in use are held in memory. A file changed since the last refresh is read as it is now; one deleted since reads as ''.
+    """
+
+    def __init__(self, folder_path, doc_ids):
+        self.folder_path = folder_path
+        self._doc_ids = doc_ids  # Container of the document ids, in corpus order
+
+    def __getitem__(self, doc_id):
+        if doc_id not in self._doc_ids:
+            raise KeyError(doc_id)
+        try:
+            with open(os.path.join(self.folder_path, doc_id), 'r', encoding='utf-8') as file:
+                return file.read()
+        except FileNotFoundError:
+            return ''
+
+    def __iter__(self):
+        return iter(self._doc_ids)
+
+    def __len__(self):
+        return len(self._doc_ids)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_ids
+
+
+class Corpus:
+    def __init__(self, folder_path, analyzer=DEFAULT_ANALYZER):
+        """
+        Streams every .txt file of a folder once into the counts of its terms and keeps that shared view of it;
+        the contents themselves are read again only when asked for (documents), so memory does not grow with the
+        size of the files.
+
+        Args:
+            folder_path (str): Folder holding the .txt documents.
+            analyzer (Analyzer): Produces the terms; models analyze their queries with it too.
+        """
+        self.folder_path = folder_path
+        self.analyzer = analyzer
+        self.term_frequencies = {}  # {doc_id: Counter({term: frequency})} lowercase and interned
+        self.lengths = {}  # {doc_id: number of terms}
+        self.documents = DocumentTexts(folder_path, self.term_frequencies)  # {doc_id: raw content}, read on access
+        self.fingerprint = None  # Hash of the document ids and contents; identifies persisted artefacts
+        self.applied_fingerprint = None  # fingerprint once every listener applied it; labels results computed from the models
+        self.version = 0  # Incremented by every refresh that changed a document
+        self._file_stats = {}  # {doc_id: (modification time, size)} as of the last read
+        self.content_hashes = {}  # {doc_id: sha1 of the content}, tells whether a document changed between runs
+        self._analyzed = {}  # {analyzer: {doc_id: Counter of terms}} the documents as other analyzers see them
+        self._listeners = []  # callables returning the subscribed listener, or None once it was garbage collected
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()  # One refresh at a time, listeners included
+        self._read_documents()
+        self.applied_fingerprint = self.fingerprint
+
+    def _scan(self):
+        """Returns {doc_id: (modification time, size)} for the .txt files currently in the folder."""
+        stats = {}
+        for entry in os.scandir(self.folder_path):
+            if entry.name.endswith(".txt") and entry.is_file():
+                stat = entry.stat()
+                stats[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def _map(self, function, doc_ids, stats):
+        """Returns {doc_id: function(path)} of the documents, on several processes for large collections; files deleted meanwhile are left out."""
+        paths = [os.path.join(self.folder_path, doc_id) for doc_id in doc_ids]
+        values = map_files(function, paths, [stats[doc_id][1] for doc_id in doc_ids])
+        return {doc_id: value for doc_id, value in zip(doc_ids, values) if value is not None}
+
+    def _read(self, doc_ids, stats):
+        """Returns {doc_id: (Counter of terms, content sha1)} of the documents, streamed through the analyzer."""
+        return {
+            doc_id: (_interned(counts), content_hash)
+            for doc_id, (counts, content_hash) in self._map(partial(read_document, self.analyzer), doc_ids, stats).items()
+        }
+
+    def _count(self, analyzer, doc_ids, stats):
+        """
+        Returns {doc_id: Counter of terms} of the documents streamed through another analyzer; a file deleted
+        meanwhile counts no terms until the refresh that removes it.
+        """
+        counts = self._map(partial(count_terms, analyzer), doc_ids, stats)
+        return {doc_id: _interned(counts[doc_id]) if doc_id in counts else Counter() for doc_id in doc_ids}
+
+    def _read_documents(self):
+        """Streams all .txt files of the folder into term counts, on several processes for large collections."""
+        stats = self._scan()
+        documents = self._read(sorted(stats), stats)
+        self._file_stats = {doc_id: stats[doc_id] for doc_id in documents}
+        for doc_id, (counts, content_hash) in documents.items():
+            self.term_frequencies[doc_id] = counts
+            self.lengths[doc_id] = sum(counts.values())
+            self.content_hashes[doc_id] = content_hash
+        self._update_fingerprint()
+
+    def _update_fingerprint(self):
+        self.fingerprint = fingerprint(self.content_hashes)
+
+    def analyze(self, analyzer):
+        """Returns {doc_id: Counter of terms} of every document streamed through analyzer, computed once and kept up to date."""
+        with self._lock:
+            if analyzer not in self._analyzed:
+                self._analyzed[analyzer] = self._count(analyzer, list(self.term_frequencies), self._file_stats)
+            return self._analyzed[analyzer]
+
+    def open(self, doc_id):
+        """Opens a document as a text file object, to stream its content; raises FileNotFoundError once it was deleted."""
+        return open(os.path.join(self.folder_path, doc_id), 'r', encoding='utf-8')
+
+    def subscribe(self, listener):
+        """Calls listener(delta) after every refresh that changed the corpus; bound methods are held weakly."""
+        if hasattr(listener, '__self__'):
+            reference = weakref.WeakMethod(listener)
+        else:
+            reference = lambda: listener
+        with self._lock:
+            self._listeners.append(reference)
+
+    def refresh(self):
+        """
+        Re-reads only the files added or modified since the last read and forgets deleted ones.
+        The document dictionaries are replaced rather than mutated, so concurrent readers never see them change size.
+        applied_fingerprint changes only after every listener has applied the changes.
+
+        Returns:
+            CorpusDelta: The applied changes, or None when nothing changed.
+        """
+        with self._refresh_lock:
+            delta = self._apply_changes()
+            if delta is not None:
+                self.applied_fingerprint = self.fingerprint
+            return delta
+
+    def _apply_changes(self):
+        with self._lock:
+            stats = self._scan()
+            added = sorted(doc_id for doc_id in stats if doc_id not in self._file_stats)
+            removed = sorted(doc_id for doc_id in self._file_stats if doc_id not in stats)
+            touched = sorted(doc_id for doc_id in stats if doc_id in self._file_stats and stats[doc_id] != self._file_stats[doc_id])
+            if not (added or removed or touched):
+                return None
+
+            streamed = self._read(added + touched, stats)
+            for doc_id in added + touched:
+                if doc_id not in streamed:
+                    # Deleted between the scan and the read
+                    del stats[doc_id]
+                    if doc_id in touched:
+                        removed.append(doc_id)
+                    added = [added_id for added_id in added if added_id != doc_id]
+            self._file_stats = stats
+
+            modified = [doc_id for doc_id in touched if doc_id in streamed and streamed[doc_id][1] != self.content_hashes[doc_id]]
+            if not (added or removed or modified):
+                return None
+
+            # Build the new dictionaries aside and swap them in, so readers never see one change size
+            changed = added + modified
+            kept = [doc_id for doc_id in self.term_frequencies if doc_id not in removed]
+            previous = {doc_id: self.term_frequencies[doc_id] for doc_id in modified + removed}
+            term_frequencies = {doc_id: self.term_frequencies[doc_id] for doc_id in kept}
+            lengths = {doc_id: self.lengths[doc_id] for doc_id in kept}
+            content_hashes = {doc_id: self.content_hashes[doc_id] for doc_id in kept}
+            for doc_id in changed:
+                term_frequencies[doc_id], content_hashes[doc_id] = streamed[doc_id]
+                lengths[doc_id] = sum(term_frequencies[doc_id].values())
+
+            for analyzer, analyzed in list(self._analyzed.items()):
+                analyzed = {doc_id: counts for doc_id, counts in analyzed.items() if doc_id in term_frequencies}
+                analyzed.update(self._count(analyzer, changed, stats))
+                self._analyzed[analyzer] = analyzed
+
+            self.term_frequencies = term_frequencies
+            self.lengths = lengths
+            self.documents = DocumentTexts(self.folder_path, term_frequencies)
+            self.content_hashes = content_hashes
+            self._update_fingerprint()
+            self.version += 1
+            delta = CorpusDelta(added, modified, removed, previous)
+            listeners = [(reference, reference()) for reference in self._listeners]
+            self._listeners = [reference for reference, listener in listeners if listener is not None]
+
+        for _, listener in listeners:
+            if listener is not None:
+                listener(delta)
+        return delta
+
+
+_corpora = {}
+_corpora_lock = threading.Lock()
+
+
+def get_corpus(folder_path=DOCUMENTS_DIR):
+    """Returns the process-wide Corpus for the folder, loading it on first use."""
+    key = os.path.abspath(folder_path)
+    with _corpora_lock:
+        if key not in _corpora:
+            _corpora[key] = Corpus(folder_path)
+        return _corpora[key]
+
+
+def refresh_all():
+    """Applies the on-disk changes of every loaded corpus."""
+    with _corpora_lock:
+        corpora = list(_corpora.values())
+    for corpus in corpora:
+        corpus.refresh()
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def start_watching(interval=2.0, callbacks=(), log=logger):
+    """
+    Starts a daemon thread that polls the loaded corpora for changed files every interval seconds.
+    Only one watcher runs per process: later calls return the running thread.
+
+    Args:
+        interval (float): Seconds between two polls.
+        callbacks (iterable of callables): Extra refresh functions run on every poll, e.g. for other document trees.
+        log (logging.Logger): Receives the failed refreshes, e.g. the logger of the web app.
+    """
+    global _watcher
+    callbacks = [refresh_all, *callbacks]
+
+    def poll():
+        while True:
+            time.sleep(interval)
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception:  # Keep watching, the next poll retries
+                    log.exception('Refreshing the documents failed')
+
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = threading.Thread(target=poll, name='corpus-watcher', daemon=True)
+            _watcher.start()
+        return _watcher
@@ -0,0 +1,220 @@
+"""
+Compact on-disk inverted index that is memory-mapped at read time.
+
+File layout (all integers little-endian):
+
+    header       MAGIC, version, num_docs, num_terms, docs_offset, terms_offset, entries_offset,
+                 sha1 fingerprint of the indexed collection (see scripts.corpus.fingerprint)
+    postings     per term: varint(doc gap), varint(term frequency) pairs, doc numbers ascending
+    docs         per document: varint(byte length) + utf-8 document id
+    terms        utf-8 terms concatenated in sorted order
+    entries      one fixed-width TERM_ENTRY per term, sorted by term, used for binary search
+
+Build it from the project root with:
+
+    python -m scripts.diskIndex build [documents folder] [index file]
+"""
+import mmap
+import os
+import struct
+import sys
+
+from scripts.corpus import fingerprint as collectionFingerprint, hash_file as hashFile
+from scripts.ingestion import build_file_postings as buildFilePostings, text_files as textFiles
+
+MAGIC = b'IRIX'
+VERSION = 3  # 2: terms are Porter stems, 3: collection fingerprint in the header
+HEADER = struct.Struct('<4sIIIQQQ20s')
+TERM_ENTRY = struct.Struct('<QIQII')  # term offset, term length, postings offset, postings length, document frequency
+
+DEFAULT_INDEX_PATH = "data/index/documents.idx"
+
+
+def encodeVarint(value, buffer):
+    """Append value to buffer as an unsigned LEB128 varint."""
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def decodeVarint(data, position):
+    """Read one varint from data at position and return (value, next position)."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def writeIndex(path, postings, fingerprint):
+    """
+    Write an inverted index to path.
+
+    Args:
+        path (str): Destination file, replaced atomically.
+        postings (dict): {term: {doc_id: term frequency}}
+        fingerprint (str): Hex sha1 of the indexed collection, as Corpus.fingerprint gives it.
+    """
+    docIds = sorted({docId for docs in postings.values() for docId in docs})
+    docNumbers = {docId: number for number, docId in enumerate(docIds)}
+    terms = sorted(postings, key=lambda term: term.encode('utf-8'))
+
+    body = bytearray()
+    entries = []
+    termBlob = bytearray()
+    for term in terms:
+        encodedTerm = term.encode('utf-8')
+        start = HEADER.size + len(body)
+        previous = 0
+        for docNumber, frequency in sorted((docNumbers[docId], tf) for docId, tf in postings[term].items()):
+            encodeVarint(docNumber - previous, body)
+            encodeVarint(frequency, body)
+            previous = docNumber
+        entries.append((len(termBlob), len(encodedTerm), start, HEADER.size + len(body) - start, len(postings[term])))
+        termBlob += encodedTerm
+
+    docsOffset = HEADER.size + len(body)
+    for docId in docIds:
+        encodedDocId = docId.encode('utf-8')
+        encodeVarint(len(encodedDocId), body)
+        body += encodedDocId
+
+    termsOffset = HEADER.size + len(body)
+    body += termBlob
+    entriesOffset = HEADER.size + len(body)
+    for termOffset, termLength, postingsOffset, postingsLength, frequency in entries:
+        body += TERM_ENTRY.pack(termsOffset + termOffset, termLength, postingsOffset, postingsLength, frequency)
+
+    header = HEADER.pack(MAGIC, VERSION, len(docIds), len(terms), docsOffset, termsOffset, entriesOffset, bytes.fromhex(fingerprint))
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporaryPath = path + '.tmp'
+    with open(temporaryPath, 'wb') as file:
+        file.write(header)
+        file.write(body)
+    os.replace(temporaryPath, path)
+
+
+class DiskIndex:
+    def __init__(self, path):
+        """Memory-map an index written by writeIndex; postings stay in the shared page cache."""
+        self.path = path
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = struct.unpack_from('<4sI', self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} index file.')
+        _, _, self.numDocs, self.numTerms, docsOffset, self.termsOffset, self.entriesOffset, fingerprint = HEADER.unpack_from(self.data, 0)
+        self.fingerprint = fingerprint.hex()  # Compare with Corpus.fingerprint to tell whether the index is outdated
+
+        self.docIds = []
+        position = docsOffset
+        for _ in range(self.numDocs):
+            length, position = decodeVarint(self.data, position)
+            self.docIds.append(self.data[position:position + length].decode('utf-8'))
+            position += length
+
+    def _entry(self, number):
+        return TERM_ENTRY.unpack_from(self.data, self.entriesOffset + number * TERM_ENTRY.size)
+
+    def _term(self, entry):
+        return self.data[entry[0]:entry[0] + entry[1]]
+
+    def _find(self, term):
+        """Binary search the term entries; returns the entry or None."""
+        key = term.encode('utf-8')
+        low, high = 0, self.numTerms
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._entry(middle)
+            current = self._term(entry)
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                return entry
+        return None
+
+    def __contains__(self, term):
+        return self._find(term) is not None
+
+    def __getitem__(self, term):
+        result = self.postings(term)
+        if result is None:
+            raise KeyError(term)
+        return result
+
+    def __len__(self):
+        return self.numTerms
+
+    def documentFrequency(self, term):
+        entry = self._find(term)
+        return entry[4] if entry else 0
+
+    def postings(self, term):
+        """Return [(doc_id, term frequency), ...] for term, or None if it is not indexed."""
+        entry = self._find(term)
+        if entry is None:
+            return None
+
+        result = []
+        position, end = entry[2], entry[2] + entry[3]
+        docNumber = 0
+        while position < end:
+            gap, position = decodeVarint(self.data, position)
+            frequency, position = decodeVarint(self.data, position)
+            docNumber += gap
+            result.append((self.docIds[docNumber], frequency))
+        return result
+
+    def terms(self):
+        for number in range(self.numTerms):
+            yield self._term(self._entry(number)).decode('utf-8')
+
+    def close(self):
+        self.data.close()
+
+
+def openIndex(path=DEFAULT_INDEX_PATH):
+    """Return a DiskIndex for path, or None when no index has been built yet."""
+    if not os.path.exists(path):
+        return None
+    return DiskIndex(path)
+
+
+def buildIndex(folderPath, path, documentTermCounts):
+    """
+    Index every .txt file of folderPath and write it to path.
+
+    Args:
+        documentTermCounts (callable): Maps a file path to (doc_id, {term: count}), reading the file as a stream;
+            a module-level function.
+    """
+    paths = textFiles(folderPath)
+    # Hashed first: a file changing during the build then leaves an index that no longer matches the documents
+    fingerprint = collectionFingerprint({os.path.basename(filePath): hashFile(filePath) for filePath in paths})
+    # Files are streamed into term counts, by several processes for large collections
+    postings = buildFilePostings(documentTermCounts, paths)
+    writeIndex(path, postings, fingerprint)
+    return len(postings)
+
+
+if __name__ == '__main__':
+    from scripts.NonOverlappedList import documentTermCounts
+
+    if len(sys.argv) < 2 or sys.argv[1] != 'build':
+        print('Usage: python -m scripts.diskIndex build [documents folder] [index file]')
+        sys.exit(1)
+
+    folderPath = sys.argv[2] if len(sys.argv) > 2 else "data/documents"
+    indexPath = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_INDEX_PATH
+    termCount = buildIndex(folderPath, indexPath, documentTermCounts)
+    print(f'Indexed {termCount} terms from {folderPath} into {indexPath}')
@@ -1,100 +1,266 @@
-import os
-import re
 import math
+import heapq
+from bisect import bisect_left
 from collections import defaultdict
+from functools import lru_cache
+
+from scripts.corpus import get_corpus
+from scripts.ranking import top_k
 
 class GeneralizedVectorInformationRetrieval:
-    def __init__(self):
+    def __init__(self, corpus=None):
         """
-        Initializes the Generalized Vector IR system by reading and indexing all .txt files in the current folder.
+        Initializes the Generalized Vector IR system by indexing all .txt files of the shared corpus.
+        
+        Args:
+            corpus (Corpus): Pre-tokenized documents; defaults to the process-wide data/documents corpus.
         """
+        self.corpus = corpus or get_corpus()
         self.documents = {}  # {doc_id: content}
-        self.term_frequencies = defaultdict(lambda: defaultdict(int))  # {doc_id: {term: frequency}}
-        self.document_vectors = defaultdict(lambda: defaultdict(float))  # {doc_id: {term: tf-idf weight}}
+        self.term_frequencies = {}  # {doc_id: {term: frequency}}
+        self.doc_ids = []  # doc_id of each document number used in the postings
+        self.document_frequencies = {}  # {term: number of documents containing it}
+        self.idf = {}  # {term: inverse document frequency}
+        self.postings = {}  # {term: ([doc number, ...], [tf-idf weight / document magnitude, ...])}
+        self.max_weights = {}  # {term: largest normalized weight in its postings}, upper bound for MaxScore
         self.document_magnitudes = defaultdict(float)  # {doc_id: magnitude of the document vector}
         self._read_documents()
         self._calculate_tfidf_vectors()
+        self.corpus.subscribe(self.apply_changes)
     
     def _read_documents(self):
-        """Reads all .txt files in the current folder and stores their content."""
-        DOCUMENTS_DIR = "data/documents"
-        for filename in os.listdir(DOCUMENTS_DIR):
-            if filename.endswith(".txt"):
-                doc_id = filename  # Use filename as the document ID
-                filename = os.path.join(DOCUMENTS_DIR, filename)
-                with open(filename, 'r', encoding='utf-8') as file:
-                    content = file.read().lower()  # Convert to lowercase for case-insensitive search
-                    self.documents[doc_id] = content
-                    self._tokenize_and_count_terms(doc_id, content)
-    
-    def _tokenize_and_count_terms(self, doc_id, content):
-        """Tokenizes the document's content and counts term frequencies."""
-        terms = re.findall(r'\w+', content)  # Extract words only
-        for term in terms:
-            self.term_frequencies[doc_id][term] += 1
+        """Takes the documents and their term frequencies from the shared, already tokenized corpus."""
+        self.documents = self.corpus.documents
+        self.term_frequencies = self.corpus.term_frequencies
     
     def _calculate_tfidf_vectors(self):
-        """Calculates TF-IDF weights for each term in each document and computes document magnitudes."""
+        """Calculates TF-IDF weights and document magnitudes and inverts them into cosine-normalized postings."""
         total_documents = len(self.documents)
+        doc_ids = sorted(self.term_frequencies)
         
-        # Calculate document frequencies for each term
+        # Calculate document frequencies and inverse document frequencies (smoothed) for each term
         document_frequencies = defaultdict(int)
         for term_freqs in self.term_frequencies.values():
             for term in term_freqs:
                 document_frequencies[term] += 1
+        idf = {term: math.log(total_documents / (1 + df)) for term, df in document_frequencies.items()}
         
-        # Calculate TF-IDF weights and document magnitudes
-        for doc_id, term_freqs in self.term_frequencies.items():
-            max_freq = max(term_freqs.values())
-            for term, freq in term_freqs.items():
-                tf = freq / max_freq  # Term frequency (normalized)
-                idf = math.log(total_documents / (1 + document_frequencies[term]))  # Inverse document frequency (smoothed)
-                tf_idf = tf * idf  # TF-IDF weight
-                self.document_vectors[doc_id][term] = tf_idf
-            
-            # Calculate the magnitude of the document vector
-            magnitude = math.sqrt(sum(weight ** 2 for weight in self.document_vectors[doc_id].values()))
-            self.document_magnitudes[doc_id] = magnitude
+        postings = defaultdict(lambda: ([], []))
+        document_magnitudes = defaultdict(float)
+        for doc_number, doc_id in enumerate(doc_ids):
+            document_vector, document_magnitudes[doc_id] = self._normalized_vector(self.term_frequencies[doc_id], idf)
+            for term, weight in document_vector.items():
+                doc_numbers, weights = postings[term]
+                doc_numbers.append(doc_number)
+                weights.append(weight)
+        
+        self.doc_ids = doc_ids
+        self.document_frequencies = dict(document_frequencies)
+        self.idf = idf
+        self.document_magnitudes = document_magnitudes
+        self.postings = dict(postings)
+        self.max_weights = {term: max(abs(weight) for weight in weights) for term, (_, weights) in self.postings.items()}
     
-    def query(self, query_text):
+    def _normalized_vector(self, term_freqs, idf):
+        """Returns the TF-IDF vector of a document divided by its magnitude (empty when the magnitude is 0), and the magnitude."""
+        if not term_freqs:
+            return {}, 0.0
+        max_freq = max(term_freqs.values())
+        document_vector = {term: freq / max_freq * idf[term] for term, freq in term_freqs.items()}
+        
+        # Calculate the magnitude of the document vector
+        magnitude = math.sqrt(sum(weight ** 2 for weight in document_vector.values()))
+        if magnitude == 0:
+            return {}, 0.0
+        return {term: weight / magnitude for term, weight in document_vector.items()}, magnitude
+    
+    def apply_changes(self, delta):
+        """
+        Applies a corpus refresh to the TF-IDF statistics and postings.
+        Adding or removing documents changes the idf of every term, so the weights are then recomputed from the
+        in-memory term counts. Modified documents only re-weight themselves and the documents sharing a term whose
+        document frequency changed.
         """
-        Processes the query and returns a ranked list of documents based on cosine similarity.
+        self._read_documents()
+        if delta.added or delta.removed:
+            self._calculate_tfidf_vectors()
+            return
         
-        Args:
-            query_text (str): The user's search query.
+        document_frequencies = dict(self.document_frequencies)
+        changed_terms = set()
+        for doc_id in delta.modified:
+            old_terms = set(delta.previous[doc_id])
+            new_terms = set(self.term_frequencies[doc_id])
+            for term in old_terms - new_terms:
+                document_frequencies[term] -= 1
+                if document_frequencies[term] == 0:
+                    del document_frequencies[term]
+            for term in new_terms - old_terms:
+                document_frequencies[term] = document_frequencies.get(term, 0) + 1
+            changed_terms |= old_terms ^ new_terms
         
-        Returns:
-            list of tuples: List of (doc_id, score) sorted by descending score.
-        """
-        query_terms = re.findall(r'\w+', query_text.lower())  # Tokenize the query into terms
+        total_documents = len(self.documents)
+        idf = dict(self.idf)
+        for term in changed_terms:
+            if term in document_frequencies:
+                idf[term] = math.log(total_documents / (1 + document_frequencies[term]))
+            else:
+                idf.pop(term, None)
+        
+        # Documents whose vector changes: the modified ones, those sharing a re-weighted term and unweighted ones
+        doc_numbers_by_id = {doc_id: doc_number for doc_number, doc_id in enumerate(self.doc_ids)}
+        affected = {doc_numbers_by_id[doc_id] for doc_id in delta.modified}
+        for term in changed_terms:
+            affected.update(self.postings.get(term, ([], []))[0])
+        affected.update(doc_numbers_by_id[doc_id] for doc_id, magnitude in self.document_magnitudes.items() if magnitude == 0)
+        
+        touched_terms = set()
+        new_vectors = {}
+        document_magnitudes = defaultdict(float, self.document_magnitudes)
+        for doc_number in affected:
+            doc_id = self.doc_ids[doc_number]
+            touched_terms.update(delta.previous.get(doc_id, self.term_frequencies[doc_id]))
+            new_vectors[doc_number], document_magnitudes[doc_id] = self._normalized_vector(self.term_frequencies[doc_id], idf)
+            touched_terms.update(new_vectors[doc_number])
+        
+        postings = dict(self.postings)
+        max_weights = dict(self.max_weights)
+        for term in touched_terms:
+            entries = dict(zip(*postings.get(term, ([], []))))
+            for doc_number, vector in new_vectors.items():
+                if term in vector:
+                    entries[doc_number] = vector[term]
+                else:
+                    entries.pop(doc_number, None)
+            if entries:
+                doc_numbers = sorted(entries)
+                postings[term] = (doc_numbers, [entries[doc_number] for doc_number in doc_numbers])
+                max_weights[term] = max(abs(weight) for weight in entries.values())
+            else:
+                postings.pop(term, None)
+                max_weights.pop(term, None)
+        
+        self.document_frequencies = document_frequencies
+        self.idf = idf
+        self.document_magnitudes = document_magnitudes
+        self.postings = postings
+        self.max_weights = max_weights
+    
+    def _query_vector(self, query_text):
+        """Returns the TF-IDF vector {term: weight} of the query and its magnitude."""
+        query_terms = self.corpus.analyzer.terms(query_text)  # Tokenize the query into terms
         query_term_frequencies = defaultdict(int)
         for term in query_terms:
             query_term_frequencies[term] += 1
         
         query_vector = {}  # TF-IDF vector for the query
+        if not query_term_frequencies:
+            return query_vector, 0.0
         max_freq = max(query_term_frequencies.values())
         for term, freq in query_term_frequencies.items():
             tf = freq / max_freq  # Term frequency (normalized)
-            idf = math.log(len(self.documents) / (1 + self._document_frequency(term)))  # Inverse document frequency
+            idf = self.idf.get(term, math.log(len(self.documents)))  # Inverse document frequency (df = 0 when unseen)
             query_vector[term] = tf * idf
         
         query_magnitude = math.sqrt(sum(weight ** 2 for weight in query_vector.values()))
+        return query_vector, query_magnitude
+    
+    def query(self, query_text, top_n=None):
+        """
+        Processes the query and returns a ranked list of the documents sharing a term with it, based on cosine similarity.
         
-        document_scores = defaultdict(float)  # {doc_id: cosine similarity score}
-        for doc_id, doc_vector in self.document_vectors.items():
-            dot_product = sum(query_vector.get(term, 0) * doc_vector.get(term, 0) for term in query_vector)
-            if self.document_magnitudes[doc_id] * query_magnitude != 0:
-                document_scores[doc_id] = dot_product / (self.document_magnitudes[doc_id] * query_magnitude)
-            else:
-                document_scores[doc_id] = 0.0
+        Args:
+            query_text (str): The user's search query.
+            top_n (int): When given, only the best top_n documents are computed, with MaxScore early termination.
+        
+        Returns:
+            list of tuples: List of (doc_id, score) sorted by descending score.
+        """
+        query_vector, query_magnitude = self._query_vector(query_text)
+        query_vector = {term: weight for term, weight in query_vector.items() if term in self.postings}
+        if query_magnitude == 0:
+            query_vector = {term: 0.0 for term in query_vector}
+        else:
+            query_vector = {term: weight / query_magnitude for term, weight in query_vector.items()}
+        
+        if top_n is None:
+            scored = self._score_term_at_a_time(query_vector)
+        else:
+            scored = self._score_max_score(query_vector, top_n)
         
         # Rank documents by score in descending order
-        ranked_results = sorted(document_scores.items(), key=lambda x: x[1], reverse=True)
-        return ranked_results
+        ranked_results = top_k(scored, top_n, key=lambda x: (-x[1], x[0]))
+        return [(self.doc_ids[doc_number], score) for doc_number, score in ranked_results]
+    
+    def _score_term_at_a_time(self, query_vector):
+        """Accumulates the cosine of every document found in the postings of the query terms."""
+        accumulators = defaultdict(float)  # {doc number: cosine similarity score}
+        for term, query_weight in query_vector.items():
+            doc_numbers, weights = self.postings[term]
+            for doc_number, weight in zip(doc_numbers, weights):
+                accumulators[doc_number] += query_weight * weight
+        return list(accumulators.items())
+    
+    def _score_max_score(self, query_vector, top_n):
+        """
+        Document-at-a-time MaxScore: lists whose combined upper bound cannot lift a document into the
+        current top_n are only probed for documents found through the other (essential) lists.
+        Query and document weights share the sign of the term's idf, so every contribution is non-negative.
+        """
+        if top_n <= 0 or not query_vector:
+            return []
+        
+        terms = sorted(query_vector, key=lambda term: abs(query_vector[term]) * self.max_weights[term])
+        upper_bounds = [abs(query_vector[term]) * self.max_weights[term] for term in terms]
+        cumulative_bounds = []
+        total = 0.0
+        for bound in upper_bounds:
+            total += bound
+            cumulative_bounds.append(total)
+        
+        lists = [self.postings[term] for term in terms]
+        positions = [0] * len(terms)
+        heap = []  # min-heap of (score, -doc number) holding the current top_n
+        threshold = 0.0
+        first_essential = 0
+        while first_essential < len(terms):
+            # Next candidate is the smallest document number among the essential lists
+            candidate = min(
+                (lists[i][0][positions[i]] for i in range(first_essential, len(terms)) if positions[i] < len(lists[i][0])),
+                default=None,
+            )
+            if candidate is None:
+                break
+            
+            score = 0.0
+            for i in range(first_essential, len(terms)):
+                doc_numbers, weights = lists[i]
+                if positions[i] < len(doc_numbers) and doc_numbers[positions[i]] == candidate:
+                    score += query_vector[terms[i]] * weights[positions[i]]
+                    positions[i] += 1
+            
+            for i in range(first_essential - 1, -1, -1):
+                if len(heap) == top_n and score + cumulative_bounds[i] <= threshold:
+                    break
+                doc_numbers, weights = lists[i]
+                found = bisect_left(doc_numbers, candidate)
+                if found < len(doc_numbers) and doc_numbers[found] == candidate:
+                    score += query_vector[terms[i]] * weights[found]
+            
+            if len(heap) < top_n:
+                heapq.heappush(heap, (score, -candidate))
+            elif (score, -candidate) > heap[0]:
+                heapq.heapreplace(heap, (score, -candidate))
+            if len(heap) == top_n:
+                threshold = heap[0][0]
+                while first_essential < len(terms) and cumulative_bounds[first_essential] <= threshold:
+                    first_essential += 1
+        
+        return [(-negative_doc_number, score) for score, negative_doc_number in heap]
     
     def _document_frequency(self, term):
         """Returns the number of documents that contain the given term."""
-        return sum(1 for term_freqs in self.term_frequencies.values() if term in term_freqs)
+        return self.document_frequencies.get(term, 0)
     
     def display_results(self, query_text, top_n=5):
         """
@@ -104,7 +270,7 @@ class GeneralizedVectorInformationRetrieval:
             query_text (str): The user's search query.
             top_n (int): Number of top results to display.
         """
-        results = self.query(query_text)
+        results = self.query(query_text, top_n)
         mappedResults = []
         print(f"\nTop {top_n} results for query: '{query_text}'\n{'=' * 40}")
         for rank, (doc_id, score) in enumerate(results[:top_n], start=1):
@@ -114,12 +280,22 @@ class GeneralizedVectorInformationRetrieval:
         
         return mappedResults
 
+@lru_cache(maxsize=None)
+def get_model():
+    """Returns the TF-IDF vectors computed once for the process."""
+    return GeneralizedVectorInformationRetrieval()
+
 def search(query, top_n = 10):
     if not query:
         return []
-    ir_system = GeneralizedVectorInformationRetrieval()
+    ir_system = get_model()
     return ir_system.display_results(query, top_n)
 
+def search_batch(queries, top_n = 10):
+    """Ranks a list of queries against the loaded model; returns one list of (doc_id, score) per query."""
+    ir_system = get_model()
+    return [ir_system.query(query, top_n) if query else [] for query in queries]
+
 
 if __name__ == "__main__":
     # Example usage
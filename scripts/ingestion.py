@@ -0,0 +1,159 @@
+"""
+Parallel ingestion of document folders: files are read by a thread pool (I/O bound) and analyzed by a process pool
+(CPU bound), map-reduce style. Each worker analyzes a chunk of documents into a partial result, which the calling
+process merges into the final values or postings.
+
+Small collections are analyzed in-process, where starting the worker processes would cost more than it saves.
+The shared corpus and the index builders only need term counts: they stream the files instead (map_files,
+build_file_postings), so that no document is ever held in memory whole.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Threads reading files
+READ_THREADS = 8
+# Characters of text from which analysis is spread over worker processes
+PARALLEL_THRESHOLD = 4 * 1024 * 1024
+# Chunks handed out per worker process, so that uneven documents still balance
+CHUNKS_PER_PROCESS = 4
+# Pools are created from request and watcher threads; forking a multithreaded process can copy held locks into the
+# workers and deadlock them, so workers start from a fresh interpreter instead
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def _read(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def read_files(paths, threads=READ_THREADS):
+    """Returns the content of every path, in order, read by a thread pool; None for files deleted meanwhile."""
+    paths = list(paths)
+    if threads <= 1 or len(paths) <= 1:
+        return [_read(path) for path in paths]
+    with ThreadPoolExecutor(min(threads, len(paths))) as pool:
+        return list(pool.map(_read, paths))
+
+
+def _chunks(items, sizes, count):
+    """Split items into about count chunks of similar total size, keeping their order."""
+    target = sum(sizes) / count
+    chunks, chunk, size = [], [], 0
+    for item, item_size in zip(items, sizes):
+        chunk.append(item)
+        size += item_size
+        if size >= target:
+            chunks.append(chunk)
+            chunk, size = [], 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _worker_count(sizes, processes):
+    """Number of processes to analyze documents of the given sizes with; 0 means in-process."""
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1 or len(sizes) <= 1 or sum(sizes) < PARALLEL_THRESHOLD:
+        return 0
+    return min(processes, len(sizes))
+
+
+def _map_chunk(function, chunk):
+    return [(doc_id, function(content)) for doc_id, content in chunk]
+
+
+def _map_files_chunk(function, paths):
+    return [function(path) for path in paths]
+
+
+def _file_postings_chunk(function, paths):
+    """Partial postings {term: {document: count}} of one chunk of files, counted by function as they stream in."""
+    postings = {}
+    for path in paths:
+        name, counts = function(path)
+        for term, count in counts.items():
+            frequencies = postings.setdefault(term, {})
+            frequencies[name] = frequencies.get(name, 0) + count
+    return postings
+
+
+def _run(worker, function, items, sizes, processes):
+    """Results of worker(function, chunk) for the chunks of items, in order; in-process when not worth it."""
+    workers = _worker_count(sizes, processes)
+    if not workers:
+        return [worker(function, items)]
+    chunks = _chunks(items, sizes, workers * CHUNKS_PER_PROCESS)
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(START_METHOD)) as pool:
+        return list(pool.map(worker, [function] * len(chunks), chunks))
+
+
+def _documents(documents):
+    """(doc_id, content) pairs of {doc_id: content} and their sizes."""
+    items = list(documents.items())
+    return items, [len(content) for _, content in items]
+
+
+def _merge(partial_postings_list):
+    """Merge partial postings in order; the counts of a document found in several of them are added up."""
+    postings = {}
+    for partial_postings in partial_postings_list:
+        for term, frequencies in partial_postings.items():
+            if term not in postings:
+                postings[term] = frequencies
+                continue
+            merged = postings[term]
+            for name, count in frequencies.items():
+                merged[name] = merged.get(name, 0) + count
+    return postings
+
+
+def map_documents(function, documents, processes=None):
+    """
+    Returns {doc_id: function(content)} for {doc_id: content}, computed by a process pool for large collections.
+
+    Args:
+        function (callable): Picklable, e.g. a module-level function or the terms method of an Analyzer.
+        processes (int): Worker processes; defaults to the number of CPUs, 1 or less analyzes in-process.
+    """
+    values = {}
+    for partial_values in _run(_map_chunk, function, *_documents(documents), processes):
+        values.update(partial_values)
+    return values
+
+
+def map_files(function, paths, sizes, processes=None):
+    """
+    Returns [function(path), ...] for text files of the given sizes, computed by a process pool for large
+    collections; function streams a file (see analysis.read_chunks), so no file is held in memory whole.
+
+    Args:
+        function (callable): Picklable, e.g. a partial of a module-level function.
+        processes (int): Worker processes; defaults to the number of CPUs, 1 or less reads in-process.
+    """
+    values = []
+    for partial_values in _run(_map_files_chunk, function, list(paths), list(sizes), processes):
+        values.extend(partial_values)
+    return values
+
+
+def build_file_postings(function, paths, processes=None):
+    """
+    Inverted index {term: {document: count}} of text files that are never held in memory whole: function streams
+    a file into its term counts (see Analyzer.stream_terms) and each worker merges the counts of its files.
+
+    Args:
+        function (callable): Picklable, maps a file path to (document name, {term: count}).
+    """
+    paths = list(paths)
+    return _merge(_run(_file_postings_chunk, function, paths, [os.path.getsize(path) for path in paths], processes))
+
+
+def text_files(folder_path):
+    """Paths of the .txt files of a folder, sorted by name."""
+    names = sorted(entry.name for entry in os.scandir(folder_path) if entry.name.endswith('.txt') and entry.is_file())
+    return [os.path.join(folder_path, name) for name in names]
@@ -1,11 +1,17 @@
 import os
 
+from scripts.analysis import WHITESPACE_PATTERN, Analyzer, strip_characters
+from scripts.diskIndex import DEFAULT_INDEX_PATH, DiskIndex
+from scripts.stemmer import stem
+
 class searchEngine:
     def __init__(self):
         self.indexes = {}
-        # common Stop words and verb's suffixes to be filtered from text
+        self.diskIndex = None
+        # common Stop words to be filtered from text
         self.stopWords = {'the', 'is', 'and', 'in', 'to', 'of', 'a', 'with', 'for', 'on', 'by', 'are', 'an', 'as', 'that'}
-        self.verbSuffixes = {'ing', 'ed', 'ate', 'ify', 'ize', 'en', 'fy'}
+        # Whitespace separated words, lowercased, stripped of ',' and '.' and stemmed
+        self.analyzer = Analyzer(WHITESPACE_PATTERN, filters=[strip_characters(',.')], stop_words=self.stopWords, stemmer=stem)
 
     # Add fileName in the dict against its indexedWord 
     def addIndexInDict(self, indexWord, value):
@@ -42,6 +48,17 @@ class searchEngine:
             displayMsg(f'The Directory {documentsFolderPath} does not exist.')
             return False
 
+    # Memory-map an index written by `python -m scripts.diskIndex build` instead of re-reading the documents
+    def loadIndexes(self, indexPath):
+        try:
+            self.diskIndex = DiskIndex(indexPath)
+            return True
+        except FileNotFoundError:
+            displayMsg(f'The index file {indexPath} does not exist.')
+        except ValueError as error:
+            displayMsg(str(error))
+        return False
+
     # Take fileName and it's content as parameters and creates its index in the dictionary
     def createTitleAndContentsIndex(self, fileName, contentWords):
         # Remove .txt if any fileName has
@@ -54,23 +71,9 @@ class searchEngine:
         for indexWord in filteredFileNamesList + filteredContentWordsList:
             self.addIndexInDict(indexWord, fileName)
 
-    # This method take text as parameter and remove stop words and words with verb suffixes
+    # This method take text as parameter, remove stop words and returns the stems of the other words
     def filterImportantWords(self, text):
-        wordsList = []
-        for word in text.split():
-            word = word.lower().strip(',.')
-
-            # Check if the word is a stop word
-            if word in self.stopWords:
-                continue 
-
-            # Check if the word ends with a verb suffix
-            if any(word.endswith(suffix) for suffix in self.verbSuffixes):
-                continue
-
-            wordsList.append(word)
-
-        return wordsList
+        return self.analyzer.terms(text)
 
     # This method take query as parameter and returns a list of related file names
     def searchDocuments(self, query):
@@ -78,15 +81,16 @@ class searchEngine:
             displayMsg('Enter a valid query!')
             return None
 
-        if len(self.indexes) == 0:
-            displayMsg('Create Indexes to search a document!')
+        if len(self.indexes) == 0 and self.diskIndex is None:
+            displayMsg('Create or load Indexes to search a document!')
             return None
         
         results = []
-        for subQuery in query.split():
-            subQuery = subQuery.lower()
+        for subQuery in self.filterImportantWords(query):
             if subQuery in self.indexes:
                 results.extend(self.indexes[subQuery])
+            elif self.diskIndex is not None and subQuery in self.diskIndex:
+                results.extend(fileName for fileName, _ in self.diskIndex[subQuery])
 
         if len(results) == 0:
             displayMsg('No Document found against the query!')
@@ -134,9 +138,10 @@ if __name__ == '__main__':
         print('2. Create Indexes')
         print('3. Lookup Indexes')
         print('4. Search FileName')
-        print('5. Exit')
+        print('5. Load Index File (default: ' + DEFAULT_INDEX_PATH + ')')
+        print('6. Exit')
 
-        choice = input('Enter your choice (1-5): ')
+        choice = input('Enter your choice (1-6): ')
 
         if choice == '1':
             documentsFolderPath = input('\nEnter Documents Directory: ')
@@ -153,7 +158,11 @@ if __name__ == '__main__':
             if results:
                 searchEngineInstance.displayResult(query, results)
         elif choice == '5':
+            indexPath = input('\nEnter Index File (leave empty for default): ') or DEFAULT_INDEX_PATH
+            if searchEngineInstance.loadIndexes(indexPath):
+                displayMsg('Index file loaded successfully!')
+        elif choice == '6':
             print('Exiting program.')
             break
         else:
-            displayMsg('Invalid choice. Please enter a number between 1 and 5.')
\ No newline at end of file
+            displayMsg('Invalid choice. Please enter a number between 1 and 6.')
\ No newline at end of file
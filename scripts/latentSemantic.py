@@ -1,104 +1,184 @@
 import os
-import re
 # import math
 import numpy as np
-from collections import defaultdict
+from functools import lru_cache
+
+from scripts.corpus import INDEX_DIR, get_corpus
+from scripts.ranking import top_k_indices
+from scripts.sparse import SparseMatrix
+
+
+def truncated_svd(matrix, k, oversampling=10, power_iterations=4, seed=0):
+    """
+    Randomized SVD (Halko et al.) that only computes the top k singular triplets of a SparseMatrix.
+    
+    Returns:
+        tuple: U (rows x k), S (k,), Vt (k x columns).
+    """
+    k = min(k, *matrix.shape)
+    sample_size = min(k + oversampling, *matrix.shape)
+    rng = np.random.default_rng(seed)
+    
+    # Orthonormal basis Q approximating the range of the matrix
+    Q, _ = np.linalg.qr(matrix.dot(rng.standard_normal((matrix.shape[1], sample_size))))
+    for _ in range(power_iterations):
+        Q, _ = np.linalg.qr(matrix.transpose_dot(Q))
+        Q, _ = np.linalg.qr(matrix.dot(Q))
+    
+    # SVD of the small projected matrix B = Q.T @ A
+    B = matrix.transpose_dot(Q).T
+    U_small, S, Vt = np.linalg.svd(B, full_matrices=False)
+    return (Q @ U_small)[:, :k], S[:k], Vt[:k, :]
 
 
 class LatentSemanticIndexing:
-    def __init__(self, num_topics=2):
+    def __init__(self, num_topics=2, corpus=None):
         """
-        Initializes the LSI system by reading and indexing all .txt files in the current folder.
+        Initializes the LSI system by indexing all .txt files of the shared corpus.
         
         Args:
             num_topics (int): Number of latent topics to reduce the dimensionality to.
+            corpus (Corpus): Pre-tokenized documents; defaults to the process-wide data/documents corpus.
         """
+        self.corpus = corpus or get_corpus()
         self.documents = {}  # {doc_id: content}
-        self.term_frequencies = defaultdict(lambda: defaultdict(int))  # {doc_id: {term: frequency}}
+        self.term_frequencies = {}  # {doc_id: {term: frequency}}
         self.term_index = {}  # {term: index} for term-document matrix
         self.doc_index = {}  # {doc_id: index} for term-document matrix
-        self.term_document_matrix = None  # The raw term-document matrix
+        self.term_document_matrix = None  # The raw term-document matrix (SparseMatrix)
         self.U = None  # Left singular vectors (terms)
         self.S = None  # Singular values
         self.Vt = None  # Right singular vectors (documents)
+        self.projection = None  # U·S⁻¹, folds a term-count query vector into the reduced space
+        self.doc_ids = []  # doc_id of each row of normalized_doc_vectors
+        self.normalized_doc_vectors = None  # Documents in reduced space, one unit-length row per document
         self.num_topics = num_topics
         self._read_documents()
         self._build_term_document_matrix()
         self._perform_svd()
+        self._prepare_scoring()
+        self.corpus.subscribe(self.apply_changes)
     
     def _read_documents(self):
-        """Reads all .txt files in the current folder and stores their content."""
-        DOCUMENT_FOLDER = "data/documents"
-        for filename in os.listdir(DOCUMENT_FOLDER):
-            if filename.endswith(".txt"):
-                doc_id = filename  # Use filename as the document ID
-                filename = os.path.join(DOCUMENT_FOLDER, filename)
-                with open(filename, 'r', encoding='utf-8') as file:
-                    content = file.read().lower()  # Convert to lowercase for case-insensitive search
-                    self.documents[doc_id] = content
-                    self._tokenize_and_count_terms(doc_id, content)
-    
-    def _tokenize_and_count_terms(self, doc_id, content):
-        """Tokenizes the document's content and counts term frequencies."""
-        terms = re.findall(r'\w+', content)  # Extract words only
-        for term in terms:
-            self.term_frequencies[doc_id][term] += 1
+        """Takes the documents and their term frequencies from the shared, already tokenized corpus."""
+        self.documents = self.corpus.documents
+        self.term_frequencies = self.corpus.term_frequencies
     
     def _build_term_document_matrix(self):
-        """Builds the term-document matrix where each row represents a term and each column a document."""
+        """Builds the sparse term-document matrix where each row represents a term and each column a document."""
         all_terms = sorted(set(term for term_freqs in self.term_frequencies.values() for term in term_freqs))
         all_docs = sorted(self.documents.keys())
         
         self.term_index = {term: i for i, term in enumerate(all_terms)}
         self.doc_index = {doc_id: i for i, doc_id in enumerate(all_docs)}
         
-        num_terms = len(all_terms)
-        num_docs = len(all_docs)
-        self.term_document_matrix = np.zeros((num_terms, num_docs))
-        
+        rows, cols, values = [], [], []
         for doc_id, term_freqs in self.term_frequencies.items():
             doc_idx = self.doc_index[doc_id]
             for term, freq in term_freqs.items():
-                term_idx = self.term_index[term]
-                self.term_document_matrix[term_idx][doc_idx] = freq
+                rows.append(self.term_index[term])
+                cols.append(doc_idx)
+                values.append(freq)
+        
+        self.term_document_matrix = SparseMatrix(rows, cols, values, (len(all_terms), len(all_docs)))
     
     def _perform_svd(self):
-        """Performs Singular Value Decomposition (SVD) on the term-document matrix."""
-        U, S, Vt = np.linalg.svd(self.term_document_matrix, full_matrices=False)
-        self.U = U[:, :self.num_topics]  # Reduce dimensionality to num_topics
-        self.S = np.diag(S[:self.num_topics])
-        self.Vt = Vt[:self.num_topics, :]  # Reduced dimensionality
+        """Computes the top num_topics singular triplets of the term-document matrix, reusing a persisted result when the corpus is unchanged."""
+        if self._load_svd():
+            return
+        U, S, Vt = truncated_svd(self.term_document_matrix, self.num_topics)
+        self.U = U  # Reduce dimensionality to num_topics
+        self.S = np.diag(S)
+        self.Vt = Vt  # Reduced dimensionality
+        self._save_svd()
+    
+    def _svd_path(self):
+        return os.path.join(INDEX_DIR, f"lsi_{self.num_topics}.npz")
+    
+    def _load_svd(self):
+        """Loads U, S and Vt saved for the same corpus and number of topics; returns False if there are none."""
+        path = self._svd_path()
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as saved:
+            if str(saved["fingerprint"]) != self.corpus.fingerprint:
+                return False
+            self.U = saved["U"]
+            self.S = np.diag(saved["S"])
+            self.Vt = saved["Vt"]
+        return True
+    
+    def _save_svd(self):
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        temporary_path = self._svd_path() + ".tmp.npz"
+        np.savez(temporary_path, U=self.U, S=np.diag(self.S), Vt=self.Vt, fingerprint=self.corpus.fingerprint)
+        os.replace(temporary_path, self._svd_path())
+    
+    def _prepare_scoring(self):
+        """Precomputes the query projection and the unit-length document vectors used by every query."""
+        self.projection = self.U / np.diag(self.S)
+        self.doc_ids = sorted(self.doc_index, key=self.doc_index.get)
+        doc_vectors = self.Vt.T
+        norms = np.linalg.norm(doc_vectors, axis=1, keepdims=True)
+        self.normalized_doc_vectors = np.divide(doc_vectors, norms, out=np.zeros_like(doc_vectors), where=norms > 0)
+    
+    def _fold_in(self, query_texts):
+        """Projects each query into the reduced space; returns a (queries x num_topics) matrix of unit-length rows."""
+        folded = np.zeros((len(query_texts), self.projection.shape[1]))
+        for row, query_text in enumerate(query_texts):
+            term_indices = [self.term_index[term] for term in self.corpus.analyzer.terms(query_text) if term in self.term_index]
+            if term_indices:
+                folded[row] = self.projection[term_indices].sum(axis=0)
+        norms = np.linalg.norm(folded, axis=1, keepdims=True)
+        return np.divide(folded, norms, out=np.zeros_like(folded), where=norms > 0)
+    
+    def apply_changes(self, delta):
+        """
+        Folds added and modified documents into the existing reduced space (their vector is a·U·S⁻¹, like a query)
+        and drops removed ones. Terms unseen by the SVD are ignored until the matrix is rebuilt on the next start.
+        """
+        self._read_documents()
+        vectors = {doc_id: vector for doc_id, vector in zip(self.doc_ids, self.normalized_doc_vectors)}
+        for doc_id in delta.removed + delta.modified:
+            vectors.pop(doc_id, None)
+        for doc_id in delta.added + delta.modified:
+            folded = np.zeros(self.projection.shape[1])
+            for term, freq in self.term_frequencies[doc_id].items():
+                if term in self.term_index:
+                    folded += freq * self.projection[self.term_index[term]]
+            norm = np.linalg.norm(folded)
+            vectors[doc_id] = folded / norm if norm > 0 else folded
+        
+        doc_ids = sorted(vectors)
+        self.doc_index = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        self.doc_ids, self.normalized_doc_vectors = doc_ids, np.array([vectors[doc_id] for doc_id in doc_ids]).reshape(len(doc_ids), self.projection.shape[1])
+    
+    def query_batch(self, query_texts, top_n=None):
+        """
+        Scores many queries with one matrix product in reduced space.
+        
+        Args:
+            query_texts (list of str): The search queries.
+            top_n (int): Keep only the best top_n documents per query; all documents when None.
+        
+        Returns:
+            list: One list of (doc_id, score) sorted by descending score per query.
+        """
+        scores = self._fold_in(query_texts) @ self.normalized_doc_vectors.T
+        return [[(self.doc_ids[i], float(row[i])) for i in top_k_indices(row, top_n)] for row in scores]
     
-    def query(self, query_text):
+    def query(self, query_text, top_n=None):
         """
         Processes the query and returns a ranked list of documents based on cosine similarity in reduced space.
         
         Args:
             query_text (str): The user's search query.
+            top_n (int): Keep only the best top_n documents; all documents when None.
         
         Returns:
             list of tuples: List of (doc_id, score) sorted by descending score.
         """
-        query_terms = re.findall(r'\w+', query_text.lower())
-        query_vector = np.zeros(len(self.term_index))
-        
-        for term in query_terms:
-            if term in self.term_index:
-                term_idx = self.term_index[term]
-                query_vector[term_idx] += 1
-        
-        # Project query into reduced space
-        query_in_reduced_space = np.dot(np.dot(query_vector, self.U), np.linalg.inv(self.S))
-        
-        document_scores = defaultdict(float)
-        for doc_id, doc_idx in self.doc_index.items():
-            doc_vector = self.Vt[:, doc_idx]  # Document in reduced space
-            similarity = np.dot(query_in_reduced_space, doc_vector) / (np.linalg.norm(query_in_reduced_space) * np.linalg.norm(doc_vector))
-            document_scores[doc_id] = similarity
-        
-        # Rank documents by score in descending order
-        ranked_results = sorted(document_scores.items(), key=lambda x: x[1], reverse=True)
-        return ranked_results
+        return self.query_batch([query_text], top_n)[0]
     
     def display_results(self, query_text, top_n=5):
         """
@@ -108,7 +188,7 @@ class LatentSemanticIndexing:
             query_text (str): The user's search query.
             top_n (int): Number of top results to display.
         """
-        results = self.query(query_text)
+        results = self.query(query_text, top_n)
         mappedResults = []
         print(f"\nTop {top_n} results for query: '{query_text}'\n{'=' * 40}")
         for rank, (doc_id, score) in enumerate(results[:top_n], start=1):
@@ -118,10 +198,19 @@ class LatentSemanticIndexing:
         
         return mappedResults
 
+@lru_cache(maxsize=None)
+def get_model(num_topics=2):
+    """Runs the SVD once per process and number of topics."""
+    return LatentSemanticIndexing(num_topics=num_topics)
+
 def search(query, top_n = 10):
-    ir_system = LatentSemanticIndexing(num_topics=2)
+    ir_system = get_model(num_topics=2)
     return ir_system.display_results(query, top_n)
 
+def search_batch(queries, top_n = 10):
+    """Ranks a list of queries in one vectorized pass; returns one list of (doc_id, score) per query."""
+    return get_model(num_topics=2).query_batch(queries, top_n)
+
 
 if __name__ == "__main__":
     # Example usage
@@ -0,0 +1,132 @@
+"""
+Positional inverted index of a corpus, shared by the models that match phrases and proximity (Extended Boolean,
+Proximal Nodes). Documents are streamed through corpus.analyzer, so positions count the terms the corpus holds and
+no document is held in memory whole.
+"""
+import re
+import threading
+from array import array
+from bisect import bisect_left
+
+from scripts.analysis import read_chunks
+from scripts.corpus import DOCUMENTS_DIR, get_corpus
+
+# Sentence terminators and blank lines end a section
+SECTION_BREAK_PATTERN = re.compile(r'[.!?]+|\n\s*\n')
+
+
+def documentPositions(analyzer, file):
+    """
+    Return ({term: array of its positions}, array of the positions starting each section) of a text file object,
+    read chunk by chunk. A section starts at the first term after a section break.
+    """
+    positions = {}
+    sectionStarts = array('I', [0])
+    position = 0
+    sectionBreak = False    # A section break follows the last term read
+    for _, text in read_chunks(file):
+        breaks = SECTION_BREAK_PATTERN.finditer(text)
+        nextBreak = next(breaks, None)
+        for token in analyzer.tokens(text):
+            while nextBreak is not None and nextBreak.end() <= token.start:
+                sectionBreak = True
+                nextBreak = next(breaks, None)
+            if sectionBreak and sectionStarts[-1] != position:
+                sectionStarts.append(position)
+            sectionBreak = False
+            positions.setdefault(token.term, array('I')).append(position)
+            position += 1
+        sectionBreak = sectionBreak or nextBreak is not None
+    return positions, sectionStarts
+
+
+def readPositions(corpus, docId):
+    """documentPositions of a document of the corpus; a document deleted since the last refresh has none until the next one."""
+    try:
+        with corpus.open(docId) as file:
+            return documentPositions(corpus.analyzer, file)
+    except FileNotFoundError:
+        return {}, array('I', [0])
+
+
+class PositionalIndex:
+    """Word positions and section boundaries of every document, with postings sorted by document id."""
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+        self.docIds = []            # All document ids, sorted
+        self.postings = {}          # {term: ([doc_id, ...] sorted, [array of positions, ...])}
+        self.sectionStarts = {}     # {doc_id: array of the positions starting each section}
+        self.build()
+        self.corpus.subscribe(self.applyChanges)
+
+    def build(self):
+        postings = {}
+        sectionStarts = {}
+        documents = self.corpus.term_frequencies
+        for docId in sorted(documents):
+            termPositions, sectionStarts[docId] = readPositions(self.corpus, docId)
+            for term, positions in termPositions.items():
+                docIds, positionLists = postings.setdefault(term, ([], []))
+                docIds.append(docId)
+                positionLists.append(positions)
+        self.postings = postings
+        self.sectionStarts = sectionStarts
+        self.docIds = sorted(documents)
+
+    def applyChanges(self, delta):
+        """Move the postings of the refreshed documents instead of re-indexing the corpus; published lists are copied before they change."""
+        postings = dict(self.postings)
+        sectionStarts = dict(self.sectionStarts)
+        changedStarts = {}
+        copied = set()
+
+        def editable(term):
+            if term not in copied:
+                docIds, positionLists = postings.get(term, ([], []))
+                postings[term] = (list(docIds), list(positionLists))
+                copied.add(term)
+            return postings[term]
+
+        for docId in delta.modified + delta.removed:
+            for term in delta.previous[docId]:
+                docIds, positionLists = editable(term)
+                index = bisect_left(docIds, docId)
+                if index < len(docIds) and docIds[index] == docId:
+                    del docIds[index]
+                    del positionLists[index]
+                if not docIds:
+                    del postings[term]
+                    copied.discard(term)
+            sectionStarts.pop(docId, None)
+
+        documents = self.corpus.term_frequencies
+        for docId in delta.added + delta.modified:
+            termPositions, changedStarts[docId] = readPositions(self.corpus, docId)
+            for term, positions in termPositions.items():
+                docIds, positionLists = editable(term)
+                index = bisect_left(docIds, docId)
+                docIds.insert(index, docId)
+                positionLists.insert(index, positions)
+
+        # Readers take the postings, then the section starts: publish those of the changed documents before the
+        # postings naming them and drop those of removed documents after
+        sectionStarts.update(changedStarts)
+        self.sectionStarts = {**self.sectionStarts, **changedStarts}
+        self.postings = postings
+        self.docIds = sorted(documents)
+        self.sectionStarts = sectionStarts
+
+
+# One index per shared corpus, {corpus: PositionalIndex}
+_indexes = {}
+_indexesLock = threading.Lock()
+
+
+def getPositionalIndex(folderPath=DOCUMENTS_DIR):
+    """The positional index of the shared corpus of folderPath, built on first use and kept up to date on refresh."""
+    corpus = get_corpus(folderPath)
+    with _indexesLock:
+        if corpus not in _indexes:
+            _indexes[corpus] = PositionalIndex(corpus)
+        return _indexes[corpus]
@@ -0,0 +1,110 @@
+import json
+import math
+import os
+import random
+import threading
+
+from scripts.corpus import INDEX_DIR
+
+# Prior relevance probabilities of every loaded folder, shared by the probabilistic models
+PRIORS_PATH = os.path.join(INDEX_DIR, "priors.json")
+# Range the priors are scaled into, as the models' former random initialization
+MIN_PRIOR = 0.1
+MAX_PRIOR = 0.9
+
+_priors_lock = threading.Lock()
+
+
+def statistical_priors(corpus, doc_ids):
+    """
+    Derives a prior from corpus statistics: the mean inverse document frequency of a document's distinct terms,
+    scaled between MIN_PRIOR and MAX_PRIOR over the collection. Documents with rarer vocabulary score higher.
+
+    Args:
+        corpus (Corpus): The collection the statistics are taken from.
+        doc_ids (iterable of str): Documents to compute a prior for.
+
+    Returns:
+        dict: {doc_id: prior}
+    """
+    term_frequencies = corpus.term_frequencies
+    num_docs = len(term_frequencies)
+    document_frequencies = {}
+    for term_freqs in term_frequencies.values():
+        for term in term_freqs:
+            document_frequencies[term] = document_frequencies.get(term, 0) + 1
+
+    def specificity(term_freqs):
+        if not term_freqs:
+            return 0.0
+        return sum(math.log(num_docs / document_frequencies[term]) for term in term_freqs) / len(term_freqs)
+
+    specificities = {doc_id: specificity(term_freqs) for doc_id, term_freqs in term_frequencies.items()}
+    low = min(specificities.values(), default=0.0)
+    high = max(specificities.values(), default=0.0)
+    spread = high - low
+    return {
+        doc_id: MIN_PRIOR + (MAX_PRIOR - MIN_PRIOR) * ((specificities[doc_id] - low) / spread if spread > 0 else 0.5)
+        for doc_id in doc_ids
+    }
+
+
+def seeded_priors(doc_ids, seed):
+    """Uniform random priors that only depend on the seed and the document id, so adding documents never shifts the others."""
+    return {doc_id: random.Random(f"{seed}:{doc_id}").uniform(MIN_PRIOR, MAX_PRIOR) for doc_id in doc_ids}
+
+
+def _read_priors(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def _write_priors(path, saved):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = path + ".tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(saved, file, indent=1, sort_keys=True)
+    os.replace(temporary_path, path)
+
+
+def _folder_key(folder_path):
+    """The folder relative to the working directory, like PRIORS_PATH, so the file still applies to a moved checkout."""
+    return os.path.relpath(folder_path).replace(os.sep, '/')
+
+
+def load_priors(corpus, seed=None, path=PRIORS_PATH):
+    """
+    Returns the prior relevance probability of every document of the corpus. Priors persisted by an earlier run
+    are reused while the document content they were computed for is unchanged; new and modified documents get
+    a new prior, which is saved for the next start.
+
+    Args:
+        corpus (Corpus): The documents to return priors for.
+        seed (int): Use seeded random priors instead of the corpus statistics.
+        path (str): JSON file holding the persisted priors.
+
+    Returns:
+        dict: {doc_id: prior}
+    """
+    source = "statistics" if seed is None else f"seed:{seed}"
+    key = f"{_folder_key(corpus.folder_path)}|{source}"
+    content_hashes = corpus.content_hashes
+    with _priors_lock:
+        saved = _read_priors(path)
+        known = saved.get(key, {})  # {doc_id: {"hash": content sha1, "prior": prior}}
+        current = {
+            doc_id: entry for doc_id, entry in known.items()
+            if isinstance(entry, dict) and entry.get("hash") == content_hashes.get(doc_id)
+        }
+        missing = [doc_id for doc_id in content_hashes if doc_id not in current]
+        if missing:
+            new_priors = statistical_priors(corpus, missing) if seed is None else seeded_priors(missing, seed)
+            current.update({doc_id: {"hash": content_hashes[doc_id], "prior": new_priors[doc_id]} for doc_id in missing})
+        if current != known:
+            saved[key] = current
+            _write_priors(path, saved)
+    return {doc_id: current[doc_id]["prior"] for doc_id in content_hashes}
@@ -0,0 +1,53 @@
+import heapq
+
+import numpy as np
+
+
+class ModelUnavailable(Exception):
+    """Raised by a model that cannot answer searches yet, e.g. before its offline training; the message says why."""
+
+
+def top_k(items, k, key):
+    """
+    Returns sorted(items, key=key)[:k] without sorting every item: a bounded heap keeps the k smallest.
+
+    Args:
+        items (iterable): The scored items, e.g. (doc_id, score) pairs.
+        k (int): Number of items to keep; all items, fully sorted, when None.
+        key (callable): Sort key, smallest first, e.g. lambda item: (-item[1], item[0]).
+    """
+    if k is None:
+        return sorted(items, key=key)
+    if k <= 0:
+        return []
+    return heapq.nsmallest(k, items, key=key)
+
+
+def top_k_indices(scores, k):
+    """
+    Returns the indices of the k highest scores, best first, as np.argsort(-scores, kind="stable")[:k] would:
+    equal scores keep their index order. np.argpartition selects them in linear time, only the k are sorted.
+
+    Args:
+        scores (np.ndarray): One score per item.
+        k (int): Number of indices to keep; all of them when None.
+    """
+    scores = np.asarray(scores)
+    n = len(scores)
+    if k is None or k >= n:
+        return np.argsort(-scores, kind="stable")
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    above = np.flatnonzero(scores > threshold)
+    # Among the scores equal to the k-th one, the lowest indices win, as in a stable sort
+    ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+    chosen = np.concatenate([above, ties])
+    return chosen[np.argsort(-scores[chosen], kind="stable")]
+
+
+def paginate(ranked, page, per_page):
+    """Returns the items of a 1-based page of a ranked list."""
+    start = (page - 1) * per_page
+    return ranked[start:start + per_page]
@@ -0,0 +1,205 @@
+"""
+Caches of search results keyed by (model endpoint, normalized query, index version).
+
+ResultCache keeps entries in process memory; SqliteResultCache stores them in a local SQLite file
+so that several worker processes serving the app share their hits. Both evict the least recently
+used entry beyond maxSize and expire entries older than ttl seconds. ResultCache also drops the
+entries of an endpoint as soon as it is asked for a different index version; in the shared file
+the version is only part of the key.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by get when the cache holds no usable entry
+MISSING = object()
+
+
+def normalizeQuery(query):
+    """Collapse the whitespace of a query; case is kept as some models read upper case operators."""
+    return ' '.join(query.split())
+
+
+class ResultCache:
+    def __init__(self, maxSize=1024, ttl=300.0):
+        """
+        In-process LRU cache with a time to live.
+
+        Args:
+            maxSize (int): Number of entries kept.
+            ttl (float): Seconds an entry stays valid; None keeps entries until evicted.
+        """
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # {(endpoint, query, version): (time stored, results)}, least recently used first
+        self.versions = {}  # {endpoint: index version of its cached entries}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def _checkVersion(self, endpoint, version):
+        """Drop the entries of endpoint cached for another index version."""
+        if self.versions.get(endpoint, version) != version:
+            stale = [key for key in self.entries if key[0] == endpoint]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+        self.versions[endpoint] = version
+
+    def get(self, endpoint, query, version):
+        """Return the cached results, or MISSING."""
+        key = (endpoint, normalizeQuery(query), version)
+        with self.lock:
+            self._checkVersion(endpoint, version)
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[0] > self.ttl:
+                del self.entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, endpoint, query, version, results):
+        key = (endpoint, normalizeQuery(query), version)
+        with self.lock:
+            self._checkVersion(endpoint, version)
+            self.entries[key] = (time.time(), results)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'backend': 'memory',
+                'size': len(self.entries),
+                'maxSize': self.maxSize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+class SqliteResultCache(ResultCache):
+    def __init__(self, path, maxSize=1024, ttl=300.0):
+        """
+        LRU cache with a time to live stored in a SQLite file shared by every process opening it.
+        Results are stored as JSON, so tuples come back as lists; the hit and miss counters are those of this process.
+        Workers may serve different index versions for a while, so entries of other versions are left to expire
+        rather than purged.
+
+        Args:
+            path (str): Database file, created if needed.
+        """
+        super().__init__(maxSize, ttl)
+        self.path = path
+        self.local = threading.local()  # .connection: the connection of the current thread
+        self.connections = []  # Every connection opened, for close()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        with connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'endpoint TEXT, query TEXT, version TEXT, stored REAL, used REAL, value TEXT, '
+                'PRIMARY KEY (endpoint, query, version))'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+
+    def _connection(self):
+        """The connection of the calling thread, opened on its first use and kept open."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
+    def get(self, endpoint, query, version):
+        key = (endpoint, normalizeQuery(query), str(version))
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            row = connection.execute('SELECT stored, value FROM results WHERE endpoint = ? AND query = ? AND version = ?', key).fetchone()
+            expired = row is not None and self.ttl is not None and now - row[0] > self.ttl
+            if expired:
+                connection.execute('DELETE FROM results WHERE endpoint = ? AND query = ? AND version = ?', key)
+            elif row is not None:
+                connection.execute('UPDATE results SET used = ? WHERE endpoint = ? AND query = ? AND version = ?', (now, *key))
+        with self.lock:
+            if row is None or expired:
+                self.evictions += expired
+                self.misses += 1
+                return MISSING
+            self.hits += 1
+        return json.loads(row[1])
+
+    def put(self, endpoint, query, version, results):
+        key = (endpoint, normalizeQuery(query), str(version))
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)', (*key, now, now, json.dumps(results)))
+            evicted = 0
+            if self.ttl is not None:
+                evicted += max(connection.execute('DELETE FROM results WHERE stored < ?', (now - self.ttl,)).rowcount, 0)
+            cursor = connection.execute(
+                'DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.maxSize,)
+            )
+            evicted += max(cursor.rowcount, 0)
+        with self.lock:
+            self.evictions += evicted
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM results')
+
+    def close(self):
+        """Close the connections of every thread; a thread using the cache afterwards opens a new one."""
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for connection in connections:
+            connection.close()
+        self.local = threading.local()
+
+    def stats(self):
+        size = self._connection().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        with self.lock:
+            return {
+                'backend': 'sqlite',
+                'path': self.path,
+                'size': size,
+                'maxSize': self.maxSize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def createResultCache(path=None, maxSize=1024, ttl=300.0):
+    """Return a SqliteResultCache shared through path, or an in-process ResultCache when no path is given."""
+    if path:
+        return SqliteResultCache(path, maxSize, ttl)
+    return ResultCache(maxSize, ttl)
@@ -0,0 +1,54 @@
+"""
+Sparse matrices in coordinate form shared by the models: Latent Semantic Indexing factors its term-document
+matrix with them and the neural ranker trains on batches of sparse query-document features.
+"""
+import numpy as np
+
+
+class SparseMatrix:
+    def __init__(self, rows, cols, values, shape, dtype=np.float64):
+        """
+        Matrix stored in coordinate form: only the non-zero entries are kept.
+        
+        Args:
+            rows, cols (list of int): Row and column index of each entry.
+            values (list of float): Value of each entry.
+            shape (tuple): (number of rows, number of columns).
+            dtype (np.dtype): Type of the values and of the products computed with them.
+        """
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.cols = np.asarray(cols, dtype=np.int64)
+        self.values = np.asarray(values, dtype=dtype)
+        self.shape = shape
+        self._row_order = None  # Entry positions sorted by row, and where each row starts in them; built by take_rows
+        self._row_starts = None
+    
+    def dot(self, X):
+        """Returns self @ X for a dense X with one row per column of this matrix."""
+        result = np.empty((self.shape[0], X.shape[1]), dtype=np.result_type(self.values, X))
+        for j in range(X.shape[1]):
+            result[:, j] = np.bincount(self.rows, weights=self.values * X[self.cols, j], minlength=self.shape[0])
+        return result
+    
+    def transpose_dot(self, X):
+        """Returns self.T @ X for a dense X with one row per row of this matrix."""
+        result = np.empty((self.shape[1], X.shape[1]), dtype=np.result_type(self.values, X))
+        for j in range(X.shape[1]):
+            result[:, j] = np.bincount(self.cols, weights=self.values * X[self.rows, j], minlength=self.shape[1])
+        return result
+    
+    def take_rows(self, row_numbers):
+        """Returns the given rows, in that order, as a new SparseMatrix; only their entries are copied."""
+        if self._row_order is None:
+            self._row_order = np.argsort(self.rows, kind="stable")
+            self._row_starts = np.searchsorted(self.rows[self._row_order], np.arange(self.shape[0] + 1))
+        row_numbers = np.asarray(row_numbers, dtype=np.int64)
+        starts = self._row_starts[row_numbers]
+        lengths = self._row_starts[row_numbers + 1] - starts
+        # Positions starts[i], ..., starts[i] + lengths[i] - 1 of every row, concatenated
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        entries = self._row_order[offsets]
+        return SparseMatrix(
+            np.repeat(np.arange(len(row_numbers)), lengths), self.cols[entries], self.values[entries],
+            (len(row_numbers), self.shape[1]), self.values.dtype,
+        )
@@ -0,0 +1,142 @@
+"""
+Porter stemmer (M.F. Porter, "An algorithm for suffix stripping", 1980), used by the analyzers at index and query time.
+
+Stems are memoized in a bounded LRU cache keyed by the surface form: a collection repeats the same words
+over and over, so most lookups never run the algorithm.
+"""
+from functools import lru_cache
+
+# Number of distinct surface forms whose stem is kept
+STEM_CACHE_SIZE = 65536
+
+VOWELS = frozenset('aeiou')
+
+# (suffix, replacement) rules of steps 2 to 4; within a step the longest matching suffix is the only one tried
+STEP2_RULES = [
+    ('ational', 'ate'), ('tional', 'tion'), ('enci', 'ence'), ('anci', 'ance'), ('izer', 'ize'), ('abli', 'able'),
+    ('alli', 'al'), ('entli', 'ent'), ('eli', 'e'), ('ousli', 'ous'), ('ization', 'ize'), ('ation', 'ate'),
+    ('ator', 'ate'), ('alism', 'al'), ('iveness', 'ive'), ('fulness', 'ful'), ('ousness', 'ous'), ('aliti', 'al'),
+    ('iviti', 'ive'), ('biliti', 'ble'),
+]
+STEP3_RULES = [
+    ('icate', 'ic'), ('ative', ''), ('alize', 'al'), ('iciti', 'ic'), ('ical', 'ic'), ('ful', ''), ('ness', ''),
+]
+STEP4_SUFFIXES = [
+    'al', 'ance', 'ence', 'er', 'ic', 'able', 'ible', 'ant', 'ement', 'ment', 'ent', 'ion', 'ou', 'ism', 'ate',
+    'iti', 'ous', 'ive', 'ize',
+]
+STEP2_RULES.sort(key=lambda rule: len(rule[0]), reverse=True)
+STEP3_RULES.sort(key=lambda rule: len(rule[0]), reverse=True)
+STEP4_SUFFIXES.sort(key=len, reverse=True)
+
+
+def _is_consonant(word, i):
+    if word[i] in VOWELS:
+        return False
+    if word[i] == 'y':
+        return i == 0 or not _is_consonant(word, i - 1)
+    return True
+
+
+def _measure(stem):
+    """m of a stem written [C](VC)^m[V]: the number of vowel-consonant sequences."""
+    measure = 0
+    after_vowel = False
+    for i in range(len(stem)):
+        consonant = _is_consonant(stem, i)
+        if consonant and after_vowel:
+            measure += 1
+        after_vowel = not consonant
+    return measure
+
+
+def _has_vowel(stem):
+    return any(not _is_consonant(stem, i) for i in range(len(stem)))
+
+
+def _ends_double_consonant(word):
+    return len(word) >= 2 and word[-1] == word[-2] and _is_consonant(word, len(word) - 1)
+
+
+def _ends_cvc(word):
+    """consonant-vowel-consonant ending, the last consonant not w, x or y (as in hop, not in snow)."""
+    return (
+        len(word) >= 3 and _is_consonant(word, len(word) - 3) and not _is_consonant(word, len(word) - 2)
+        and _is_consonant(word, len(word) - 1) and word[-1] not in 'wxy'
+    )
+
+
+def _step1(word):
+    # Step 1a: plurals
+    if word.endswith('sses') or word.endswith('ies'):
+        word = word[:-2]
+    elif word.endswith('s') and not word.endswith('ss'):
+        word = word[:-1]
+
+    # Step 1b: -eed, -ed, -ing
+    if word.endswith('eed'):
+        if _measure(word[:-3]) > 0:
+            word = word[:-1]
+    else:
+        stem = None
+        if word.endswith('ed') and _has_vowel(word[:-2]):
+            stem = word[:-2]
+        elif word.endswith('ing') and _has_vowel(word[:-3]):
+            stem = word[:-3]
+        if stem is not None:
+            word = stem
+            if word.endswith(('at', 'bl', 'iz')):
+                word += 'e'
+            elif _ends_double_consonant(word) and word[-1] not in 'lsz':
+                word = word[:-1]
+            elif _measure(word) == 1 and _ends_cvc(word):
+                word += 'e'
+
+    # Step 1c: y -> i
+    if word.endswith('y') and _has_vowel(word[:-1]):
+        word = word[:-1] + 'i'
+    return word
+
+
+def _replace_suffix(word, rules):
+    """Steps 2 and 3: replace the longest matching suffix when the remaining stem has m > 0."""
+    for suffix, replacement in rules:
+        if word.endswith(suffix):
+            stem = word[:-len(suffix)]
+            return stem + replacement if _measure(stem) > 0 else word
+    return word
+
+
+def _step4(word):
+    for suffix in STEP4_SUFFIXES:
+        if word.endswith(suffix):
+            stem = word[:-len(suffix)]
+            if _measure(stem) > 1 and (suffix != 'ion' or stem.endswith(('s', 't'))):
+                return stem
+            return word
+    return word
+
+
+def _step5(word):
+    if word.endswith('e'):
+        measure = _measure(word[:-1])
+        if measure > 1 or (measure == 1 and not _ends_cvc(word[:-1])):
+            word = word[:-1]
+    if word.endswith('ll') and _measure(word) > 1:
+        word = word[:-1]
+    return word
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(word):
+    """
+    Returns the Porter stem of a lowercase word; words of one or two letters are kept as they are.
+    stem.cache_info() reports the hits and the size of the stem cache.
+    """
+    if len(word) <= 2:
+        return word
+    word = _step1(word)
+    word = _replace_suffix(word, STEP2_RULES)
+    word = _replace_suffix(word, STEP3_RULES)
+    word = _step4(word)
+    return _step5(word)
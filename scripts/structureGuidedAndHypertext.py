@@ -1,50 +1,134 @@
+import hashlib
 import os
 import re
-
-indexMap = {}
-
-def addInIndexMap(key, value):
-    if key not in indexMap:
-        indexMap[key] = [value]
-    elif indexMap[key].count(value) == 0:
-        indexMap[key].append(value)
+import threading
+from collections import OrderedDict
+
+from scripts.analysis import Analyzer, minimum_length
+from scripts.ingestion import map_documents as mapDocuments, read_files as readFiles
+from scripts.stemmer import stem
+
+# indexMap, titleWords and browsingStructure are never changed once published: updates build new dictionaries
+# and swap them in under linkMapLock, so request threads can keep reading the ones they took
+indexMap = {}       # {keyword: [link target, ...]} in structure order; targets are document paths or '#chapter' anchors
+titleWords = {}     # {link target: [keyword, ...]} the words each target was indexed under
+fileStats = {}      # {file path: (modification time, size)} of the files read into browsingStructure
+linkMapVersion = 0  # Incremented whenever indexMap changes
+renderedPages = OrderedDict()   # {(path, content hash, linkMapVersion): linked content}, least recently used first
+MAX_RENDERED_PAGES = 256
+linkMapLock = threading.Lock()      # Guards the swaps and renderedPages; held by link map updates throughout
+refreshLock = threading.Lock()      # One refresh of the document tree at a time
+
+# Link keywords: whitespace separated words stripped of leading and trailing ',' and '.' (so token offsets
+# cover the word only), of five letters or more, lowercased and stemmed, without stop words
+wordPattern = re.compile(r'[^\s,.]+(?:[,.]+[^\s,.]+)*')
+stopWords = {'the', 'is', 'and', 'in', 'to', 'of', 'a', 'with', 'for', 'on', 'by', 'are', 'an', 'as', 'that', 'was', 'it'}
+ANALYZER = Analyzer(wordPattern, filters=[minimum_length(5)], stop_words=stopWords, stemmer=stem)
+
+# The target lists are replaced rather than changed, as a published indexMap may share them
+
+def addInIndexMap(linkMap, key, value):
+    targets = linkMap.get(key, [])
+    if value not in targets:
+        linkMap[key] = targets + [value]
+
+def removeFromIndexMap(linkMap, key, value):
+    targets = linkMap.get(key, [])
+    if value in targets:
+        targets = [target for target in targets if target != value]
+        if targets:
+            linkMap[key] = targets
+        else:
+            del linkMap[key]
+
+def indexTarget(linkMap, targetWords, target, text, words=None):
+    """Index the important words of text (or the given words of it) under a link target."""
+    if words is None:
+        words = filterImportantWords(text)
+    targetWords[target] = words
+    for word in words:
+        addInIndexMap(linkMap, word, target)
+
+def extractTitles(structure, linkMap, targetWords, prefix = ''):
+    """Index chapter names (as '#' anchors) and document contents found in the structure."""
+    targets = {}
+    collectTargets(structure, targets, prefix)
+    # Analyze the texts up front, on several processes for large structures
+    words = mapDocuments(ANALYZER.terms, targets)
+    for target, text in targets.items():
+        indexTarget(linkMap, targetWords, target, text, words[target])
+
+def collectTargets(structure, targets, prefix = ''):
+    """Fill targets with {link target: text} for the chapter names and documents of the structure, in structure order."""
+    for name, substructure in structure.items():
+        if isinstance(substructure, dict):
+            targets['#' + prefix + name] = name
+            collectTargets(substructure, targets, prefix + name + '/')
+        elif isinstance(substructure, str):
+            targets[prefix + name] = substructure
+
+def buildLinkMap(fileStructure):
+    """Build the keyword to target map once for the whole structure."""
+    global indexMap, titleWords, linkMapVersion
+    with linkMapLock:
+        newIndexMap, newTitleWords = {}, {}
+        extractTitles(fileStructure, newIndexMap, newTitleWords)
+        indexMap, titleWords = newIndexMap, newTitleWords
+        linkMapVersion += 1
+
+def updateLinkMap(changedPaths, fileStructure):
+    """Re-index only the changed document paths, and the chapters that appeared or disappeared with them."""
+    global indexMap, titleWords, linkMapVersion
+    with linkMapLock:
+        newIndexMap, newTitleWords = dict(indexMap), dict(titleWords)
+        currentTargets = {}
+        collectTargets(fileStructure, currentTargets)
+        staleTargets = set(changedPaths) | (set(newTitleWords) - set(currentTargets))
+        newTargets = (set(changedPaths) | (set(currentTargets) - set(newTitleWords))) & set(currentTargets)
+
+        for target in staleTargets:
+            for word in newTitleWords.pop(target, []):
+                removeFromIndexMap(newIndexMap, word, target)
+        for target in newTargets:
+            indexTarget(newIndexMap, newTitleWords, target, currentTargets[target])
+        indexMap, titleWords = newIndexMap, newTitleWords
+        linkMapVersion += 1
 
 def addHyperlinksToContent(content, currentFilePath, fileStructure):
     """
     Modify the content to add hyperlinks to other documents
     based on keywords found in the text.
     """
-    # print(fileStructure['Chapter 1 - Monuments']['The Eiffel Tower'], 'fileStructure')
-
-    # Extract words or terms that are used as document names in the structure
-    def extractTitles(structure, prefix = ''):
-        for name, substructure in structure.items():
-            if isinstance(substructure, dict):
-                splittedContent = filterImportantWords(name)
-                for word in splittedContent:
-                    addInIndexMap(word, '#' + prefix + name)
-
-                extractTitles(substructure, prefix + name + '/')
-            elif isinstance(substructure, str):
-                splittedAndFilteredList = filterImportantWords(substructure)
-                for word in splittedAndFilteredList:
-                    addInIndexMap(word, prefix + name)
-    
-    extractTitles(fileStructure)
-
-    # for key, value in indexMap.items():
-    #     print(key, ' => ', value)
-
-    # Create hyperlinks for the titles in the content
-    for word in filterImportantWords(content):
-        if word in indexMap:
-            docs = indexMap[word][:]
-            docs.remove(currentFilePath)
-            if len(docs):
-                hyperLink = f'/document/{docs[0]}' if docs[0].count('#') == 0 else f'/{docs[0]}'
-                content = re.sub(r'\b' + re.escape(word) + r'\b', f'<a href="{hyperLink}">{word}</a>', content)
-    
-    return content
+    if not indexMap:
+        buildLinkMap(fileStructure)
+
+    with linkMapLock:
+        linkMap = indexMap
+        cacheKey = (currentFilePath, hashlib.sha1(content.encode('utf-8')).hexdigest(), linkMapVersion)
+        linkedContent = renderedPages.get(cacheKey)
+        if linkedContent is not None:
+            renderedPages.move_to_end(cacheKey)
+            return linkedContent
+
+    # Link the important words of this content, each to the first other target indexed under the same stem,
+    # in a single scan of the content
+    pieces = []
+    position = 0
+    for token in ANALYZER.tokens(content):
+        docs = [doc for doc in linkMap.get(token.term, []) if doc != currentFilePath]
+        if docs:
+            hyperLink = f'/document/{docs[0]}' if docs[0].count('#') == 0 else f'/{docs[0]}'
+            pieces.append(content[position:token.start])
+            pieces.append(f'<a href="{hyperLink}">{content[token.start:token.end]}</a>')
+            position = token.end
+    pieces.append(content[position:])
+    linkedContent = ''.join(pieces)
+
+    with linkMapLock:
+        renderedPages[cacheKey] = linkedContent
+        while len(renderedPages) > MAX_RENDERED_PAGES:
+            renderedPages.popitem(last=False)
+    return linkedContent
 
 def readDirectoryStructure(rootDir):
     """
@@ -52,7 +136,8 @@ def readDirectoryStructure(rootDir):
     representing the hierarchy and content of the .txt files.
     """
     hierarchy = {}
-    
+    textFiles = []  # (parent node, file name, file path)
+
     # Traverse the directory structure
     for root, dirs, files in os.walk(rootDir):
         # Skip the root directory itself, focus on files
@@ -66,38 +151,99 @@ def readDirectoryStructure(rootDir):
         for part in pathParts:
             parent = parent.setdefault(part, {})
 
-        # Add content for each text file
+        # Collect each text file, its content is read below
         for file in files:
             if file.endswith('.txt'):
-                # Read file content
-                with open(os.path.join(root, file), 'r') as f:
-                    content = f.read()
-                
-                # Store content with the filename as the key
-                parent[file.replace('.txt', '')] = content
-    
-    return hierarchy
+                filePath = os.path.join(root, file)
+                fileStats[filePath] = fileStat(filePath)
+                textFiles.append((parent, file, filePath))
+
+    # Read the files with a thread pool and store each content with the filename as the key
+    contents = readFiles([filePath for _, _, filePath in textFiles])
+    for (parent, file, filePath), content in zip(textFiles, contents):
+        if content is None:
+            del fileStats[filePath]
+            continue
+        parent[file.replace('.txt', '')] = content
 
-def filterImportantWords(text):
-    """
-    Filter out unimportant words (stop words, verb suffixes) and return a list of important words.
-    """
-    stopWords = {'the', 'is', 'and', 'in', 'to', 'of', 'a', 'with', 'for', 'on', 'by', 'are', 'an', 'as', 'that', 'was', 'it'}
-    verbSuffixes = {'ing', 'ed', 'ate', 'ify', 'ize', 'en', 'fy'}
-    wordsList = []
-    for word in text.split():
-        word = word.lower().strip(',.')
+    return hierarchy
 
-        if word in stopWords or len(word) <= 4:
-            continue 
+def fileStat(filePath):
+    stat = os.stat(filePath)
+    return (stat.st_mtime_ns, stat.st_size)
 
-        if any(word.endswith(suffix) for suffix in verbSuffixes):
-            continue
+def getBrowsingStructure():
+    """The current {chapter: {title: content}} structure; a refresh swaps in a new one rather than changing it."""
+    return browsingStructure
 
-        wordsList.append(word)
+def copyChapters(structure, pathParts):
+    """Copy the chapters along pathParts (creating missing ones) into structure; returns them, innermost last."""
+    chapters = [structure]
+    for part in pathParts:
+        chapter = dict(chapters[-1].get(part, {}))
+        chapters[-1][part] = chapter
+        chapters.append(chapter)
+    return chapters
 
-    return wordsList
+def refreshBrowsingStructure():
+    """
+    Re-read only the .txt files of rootDirectory added or modified since the last read and forget deleted ones.
+    The changed chapters are copied into a new browsingStructure, which replaces the one pages may be rendering.
+    Returns the document paths ('Chapter/Title') that changed.
+    """
+    global browsingStructure
+    with refreshLock:
+        currentStats = {}
+        for root, dirs, files in os.walk(rootDirectory):
+            if root == rootDirectory:
+                continue
+            for file in files:
+                if file.endswith('.txt'):
+                    filePath = os.path.join(root, file)
+                    try:
+                        currentStats[filePath] = fileStat(filePath)
+                    except FileNotFoundError:
+                        continue
+
+        changedPaths = []
+        structure = dict(browsingStructure)
+        for filePath in set(fileStats) | set(currentStats):
+            if fileStats.get(filePath) == currentStats.get(filePath):
+                continue
+
+            pathParts = os.path.relpath(filePath, rootDirectory)[:-len('.txt')].split(os.sep)
+            if filePath in currentStats:
+                try:
+                    with open(filePath, 'r') as f:
+                        content = f.read()
+                except FileNotFoundError:
+                    continue
+                copyChapters(structure, pathParts[:-1])[-1][pathParts[-1]] = content
+                fileStats[filePath] = currentStats[filePath]
+            else:
+                # Remove the document and any chapter left empty
+                parents = copyChapters(structure, pathParts[:-1])
+                parents[-1].pop(pathParts[-1], None)
+                for depth in range(len(pathParts) - 1, 0, -1):
+                    if not parents[depth]:
+                        parents[depth - 1].pop(pathParts[depth - 1], None)
+                del fileStats[filePath]
+
+            changedPaths.append('/'.join(pathParts))
+
+        if changedPaths:
+            with linkMapLock:
+                browsingStructure = structure
+            if indexMap:
+                updateLinkMap(changedPaths, structure)
+        return changedPaths
 
+def filterImportantWords(text):
+    """
+    Filter out unimportant words (stop words, short words) and return the stems of the important words.
+    """
+    return ANALYZER.terms(text)
 
 rootDirectory = 'data/Famous Landmarks Around the World'
 browsingStructure = readDirectoryStructure(rootDirectory)
+buildLinkMap(browsingStructure)